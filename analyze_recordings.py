@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import time
+
+from lib.ts_health import analyze_recording
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks all .ts recordings in a directory for continuity errors, timestamp gaps and lost packet sync")
+    parser.add_argument("path", help="Recording or directory with recordings")
+    parser.add_argument("--max-gap", metavar="seconds", dest="max_gap", type=float, default=1.0, help="Jumps in the PCR or PTS larger than this are counted as gaps (Default: 1.0)")
+    parser.add_argument("--json", metavar="path", dest="json_path", help="Write the full results including the bitrate over time to this file")
+    parser.add_argument("--only-problems", dest="only_problems", action="store_true", help="Only print recordings with problems")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        paths = sorted(os.path.join(dirpath, f) for dirpath, _, filenames in os.walk(args.path) for f in filenames if f.endswith(".ts"))
+    else:
+        paths = [ args.path ]
+
+    results = {}
+    total_bytes = 0
+    problems = 0
+    start = time.perf_counter()
+
+    for path in paths:
+        try:
+            report = analyze_recording(path, args.max_gap)
+        except Exception as e:
+            print(f"{path}: could not be analyzed: {repr(e)}")
+            continue
+
+        results[path] = report.to_dict()
+        total_bytes += report.bytes
+
+        if not report.is_healthy():
+            problems += 1
+
+        if not args.only_problems or not report.is_healthy():
+            print(f"{'OK     ' if report.is_healthy() else 'PROBLEM'} {path}: {report.summary()}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Analyzed {len(results)} recordings ({total_bytes / 1000**3:.2f} GB) in {elapsed:.1f}s, {problems} with problems")
+
+    if args.json_path is not None:
+        with open(args.json_path, "w") as json_file:
+            json.dump(results, json_file, indent=4)
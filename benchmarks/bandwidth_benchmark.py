@@ -0,0 +1,91 @@
+import argparse
+import time
+from threading import Event, Thread
+
+import requests
+
+from benchmarks.fake_servers import FakeBulkServer, FakeVRCDNServer, ThrottledLink
+from lib.bandwidth import BandwidthManager
+
+class Download(Thread):
+    def __init__(self, url: str, manager: BandwidthManager, name: str, priority, stop_event: Event):
+        super().__init__(name=name, daemon=True)
+        self._url = url
+        self._client = manager.register(name, priority)
+        self._stop_event = stop_event
+
+        self.bytes_received = 0
+
+    def run(self):
+        try:
+            with requests.get(self._url, stream=True, timeout=10) as response:
+                for data in response.iter_content(chunk_size=10 * 1024):
+                    self.bytes_received += len(data)
+                    self._client.consume(len(data))
+
+                    if self._stop_event.is_set():
+                        break
+        finally:
+            self._client.close()
+
+def run(args, limit):
+    link = ThrottledLink(args.link)
+    usernames = [ f"bench_user_{i}" for i in range(args.live) ]
+    vrcdn = FakeVRCDNServer(set(usernames), args.bitrate, link).start()
+    bulk = FakeBulkServer(link).start()
+
+    manager = BandwidthManager()
+    manager.configure(limit, weights={ f"vrcdn={usernames[0]}": args.first_weight })
+
+    stop_event = Event()
+    downloads = [ Download(f"{vrcdn.url}/live/{u}.live.ts", manager, f"vrcdn={u}", "live", stop_event) for u in usernames ]
+    downloads += [ Download(f"{bulk.url}/bulk", manager, f"bulk-{i}", "bulk", stop_event) for i in range(args.bulk) ]
+
+    for download in downloads:
+        download.start()
+
+    time.sleep(args.warmup)
+    start_bytes = [ d.bytes_received for d in downloads ]
+    start_time = time.monotonic()
+
+    time.sleep(args.duration)
+
+    rates = [ (d.bytes_received - b) / (time.monotonic() - start_time) for d, b in zip(downloads, start_bytes) ]
+    allocations = manager.get_allocations()
+
+    stop_event.set()
+    vrcdn.stop()
+    bulk.stop()
+
+    return downloads, rates, allocations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how live downloads and bulk transfers share a throttled local link, with and without the bandwidth manager")
+    parser.add_argument("--link", metavar="bytes", type=int, default=10_000_000, help="Capacity of the simulated link in bytes per second (Default: 10000000)")
+    parser.add_argument("--limit", metavar="bytes", type=int, default=9_000_000, help="Bandwidth limit of the manager in bytes per second (Default: 9000000)")
+    parser.add_argument("--live", metavar="N", type=int, default=8, help="Number of live streams (Default: 8)")
+    parser.add_argument("--bitrate", metavar="bits", type=int, default=6_000_000, help="Bitrate of every live stream in bits per second (Default: 6000000)")
+    parser.add_argument("--bulk", metavar="N", type=int, default=4, help="Number of concurrent bulk downloads (Default: 4)")
+    parser.add_argument("--first-weight", metavar="weight", dest="first_weight", type=float, default=1.0, help="Weight of the first live stream (Default: 1)")
+    parser.add_argument("--duration", metavar="seconds", type=int, default=20, help="Duration of the measurement (Default: 20)")
+    parser.add_argument("--warmup", metavar="seconds", type=int, default=5, help="Time before the measurement starts (Default: 5)")
+    args = parser.parse_args()
+
+    stream_rate = args.bitrate / 8
+    print(f"Link: {args.link / 1000**2:.1f} MB/s, {args.live} live streams at {stream_rate / 1000**2:.2f} MB/s, {args.bulk} bulk downloads")
+
+    for name, limit in (("unshaped", None), (f"limit {args.limit / 1000**2:.1f} MB/s", args.limit)):
+        downloads, rates, allocations = run(args, limit)
+
+        live_rates = [ r for d, r in zip(downloads, rates) if d.name.startswith("vrcdn=") ]
+        bulk_rates = [ r for d, r in zip(downloads, rates) if d.name.startswith("bulk-") ]
+
+        print(f"\n{name}:")
+        print(f"  live: min {min(live_rates) / 1000**2:.2f} MB/s, mean {sum(live_rates) / len(live_rates) / 1000**2:.2f} MB/s ({100 * min(live_rates) / stream_rate:.0f}% of the stream bitrate for the slowest one)")
+        if len(bulk_rates) > 0:
+            print(f"  bulk: total {sum(bulk_rates) / 1000**2:.2f} MB/s")
+
+        if limit is not None:
+            print("  allocations at the end:")
+            for client_name, (priority, allocation) in sorted(allocations.items()):
+                print(f"    {client_name:<24} {priority:<5} {allocation / 1000**2:8.2f} MB/s")
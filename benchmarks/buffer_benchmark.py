@@ -0,0 +1,139 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeHelixServer, FakeHLSServer
+from benchmarks.run_benchmark import REPO_ROOT, free_port, read_process_stats, scrape_metrics, summarize
+from lib import ts_health
+
+# runs main.py against the stand-ins with a mix of low and high bitrate streams and returns the RSS samples, the ring buffer sizes
+# at the end and the number of PTS gaps in the recordings, which is how segments dropped by streamlink show up
+def run(args, name: str, extra_config: dict, streamlink_options: list[str]):
+    usernames = [ f"bench_user_{i}" for i in range(args.live) ]
+    high_bitrate_users = usernames[:args.high]
+
+    helix = FakeHelixServer(set(usernames)).start()
+    hls = FakeHLSServer(set(usernames), args.bitrate, bitrates={ u: args.high_bitrate for u in high_bitrate_users }).start()
+
+    metrics_port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="tar3000-buffer-bench-") as work_dir:
+        config = {
+            "twitch": {
+                "clientid": "benchmark",
+                "secret": "benchmark",
+                "api_base_url": f"{helix.url}/helix/",
+                "auth_base_url": f"{helix.url}/oauth2/",
+                "stream_url": f"{hls.url}/live/{{username}}/master.m3u8",
+            },
+            "streamers": usernames,
+            "output_path": os.path.join(work_dir, "recordings"),
+            "update_interval": 5,
+            "metrics_port": metrics_port,
+            **extra_config,
+        }
+
+        # YAML is a superset of JSON, so we don't need an extra dependency to write the config file
+        config_path = os.path.join(work_dir, "config.yaml")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+
+        command = [ sys.executable, os.path.join(REPO_ROOT, "main.py"), "-C", config_path ]
+        for option in streamlink_options:
+            command += [ "-c", option ]
+
+        log_file = open(os.path.join(work_dir, "main.log"), "w")
+        process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=log_file, stderr=subprocess.STDOUT)
+
+        rss_samples: list[float] = []
+        start_time = time.monotonic()
+        final_metrics = {}
+
+        try:
+            while time.monotonic() - start_time < args.duration:
+                if process.poll() is not None:
+                    raise Exception(f"main.py exited early with code {process.returncode}, see the log below:\n" + open(log_file.name).read())
+
+                if time.monotonic() - start_time >= args.warmup:
+                    rss_samples.append(float(read_process_stats(process.pid)[1]))
+
+                time.sleep(1)
+
+            final_metrics = scrape_metrics(metrics_port)
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+
+            helix.stop()
+            hls.stop()
+
+        gaps: dict[str, int] = {}
+        for path in glob.glob(os.path.join(work_dir, "recordings", "*", "*.ts")):
+            username = os.path.basename(os.path.dirname(path))
+            report = ts_health.analyze_recording(path, max_gap=args.segment_duration)
+            gaps[username] = gaps.get(username, 0) + sum(report.pts_gaps.values())
+
+    buffers = { labels["username"]: v for labels, v in final_metrics.get("recorder_ringbuffer_bytes", []) }
+
+    return {
+        "name": name,
+        "rss_bytes": summarize(rss_samples),
+        "pts_gaps": gaps,
+        "ringbuffer_bytes": buffers,
+        "high_bitrate_users": high_bitrate_users,
+    }
+
+def print_result(result: dict):
+    rss = result["rss_bytes"]
+    gaps = result["pts_gaps"]
+    high_gaps = sum(v for u,v in gaps.items() if u in result["high_bitrate_users"])
+
+    print(f"\n{result['name']}:")
+    if rss is not None:
+        print(f"  rss: median {rss['median'] / 1024**2:.1f} MiB, max {rss['max'] / 1024**2:.1f} MiB")
+    print(f"  dropped segments (PTS gaps): {sum(gaps.values())} in total, {high_gaps} in the high bitrate streams")
+
+    if len(result["ringbuffer_bytes"]) > 0:
+        sizes = sorted(result["ringbuffer_bytes"].values())
+        print(f"  ring buffers at the end: {sizes[0] / 1024**2:.1f} - {sizes[-1] / 1024**2:.1f} MiB, {sum(sizes) / 1024**2:.1f} MiB in total")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the memory use and the dropped segments of static streamlink buffer settings with the adaptive buffer tuning")
+    parser.add_argument("--live", metavar="N", type=int, default=16, help="Number of live streams (Default: 16)")
+    parser.add_argument("--high", metavar="N", type=int, default=4, help="Number of them streaming with the high bitrate (Default: 4)")
+    parser.add_argument("--bitrate", metavar="bits", type=int, default=3_000_000, help="Bitrate of the other streams in bits per second (Default: 3000000)")
+    parser.add_argument("--high-bitrate", metavar="bits", dest="high_bitrate", type=int, default=20_000_000, help="Bitrate of the high bitrate streams in bits per second (Default: 20000000)")
+    parser.add_argument("--static-buffer", metavar="bytes", dest="static_buffer", type=int, default=16 * 1024 * 1024, help="Ring buffer size of the static run, streamlink's default (Default: 16777216)")
+    parser.add_argument("--static-threads", metavar="N", dest="static_threads", type=int, default=1, help="Segment threads of the static run, streamlink's default (Default: 1)")
+    parser.add_argument("--memory-budget", metavar="bytes", dest="memory_budget", type=int, default=128 * 1024 * 1024, help="Memory budget of the adaptive run (Default: 134217728)")
+    parser.add_argument("--duration", metavar="seconds", type=int, default=120, help="Duration of every run (Default: 120)")
+    parser.add_argument("--warmup", metavar="seconds", type=int, default=20, help="Time before the RSS is sampled (Default: 20)")
+    args = parser.parse_args()
+    args.segment_duration = 2.0
+
+    if ts_health.np is None:
+        print("This benchmark requires numpy to find the dropped segments in the recordings (uv sync --extra ts-health)")
+        sys.exit(1)
+
+    print(f"{args.live} live streams, {args.high} of them at {args.high_bitrate / 1000**2:.1f} Mbit/s and the rest at {args.bitrate / 1000**2:.1f} Mbit/s")
+
+    static = run(
+        args,
+        f"static ({args.static_buffer / 1024**2:.0f} MiB, {args.static_threads} segment threads)",
+        { "buffer_tuning": { "enabled": False } },
+        [ f"ringbuffer-size:int={args.static_buffer}", f"stream-segment-threads:int={args.static_threads}" ],
+    )
+    print_result(static)
+
+    adaptive = run(args, f"adaptive ({args.memory_budget / 1024**2:.0f} MiB budget)", { "buffer_tuning": { "enabled": True, "memory_budget": args.memory_budget } }, [])
+    print_result(adaptive)
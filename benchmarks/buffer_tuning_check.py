@@ -0,0 +1,54 @@
+import sys
+
+from lib.buffer_tuning import TUNER
+
+MiB = 1024 * 1024
+
+# feeds a known bitrate history (in bytes per second) into the tuner like the read loop of a recorder would, and returns the
+# settings the next recorder of the same user starts with
+def settings_after(name: str, rates: list[float]):
+    stream = TUNER.register(name, 4 * MiB, lambda size: None)
+    for rate in rates:
+        TUNER._add_sample(stream, rate)
+    stream.close()
+
+    return TUNER.get_settings(name)
+
+# each case is the name of the check, the measured settings and the expected ring buffer size and segment threads
+def run():
+    TUNER.configure(True, 256 * MiB, 10, 2 * MiB, 64 * MiB, 4)
+    cases: list[tuple[str, tuple[int, int], tuple[int, int]]] = []
+
+    # nothing measured yet: a 6 Mbit/s stream with a burst factor of 1.5 is assumed
+    cases.append(("unknown user", TUNER.get_settings("twitch=unknown_user"), (11_250_000, 2)))
+
+    # 4.4 Mbit/s on average with one burst of twice that rate, the buffer holds 10 seconds of the average rate times the burst factor
+    cases.append(("bursty 4.4 Mbit/s", settings_after("twitch=bursty_user", [ 500_000.0 ] * 9 + [ 1_000_000.0 ]), (10_000_000, 2)))
+
+    # a steady 20 Mbit/s stream is limited to max_buffer and max_segment_threads
+    cases.append(("steady 20 Mbit/s", settings_after("twitch=high_user", [ 2_500_000.0 ] * 60), (25_000_000, 4)))
+    cases.append(("burst beyond max_buffer", settings_after("twitch=spiky_user", [ 2_500_000.0 ] * 9 + [ 10_000_000.0 ]), (64 * MiB, 4)))
+
+    # less than MIN_SAMPLES samples are not used
+    cases.append(("too few samples", settings_after("twitch=short_user", [ 100_000.0 ] * 9), (11_250_000, 2)))
+
+    # the buffers of running recorders leave only 8 MiB of the budget
+    running = TUNER.register("twitch=running_user", 248 * MiB, lambda size: None)
+    cases.append(("budget almost used", TUNER.get_settings("twitch=bursty_user"), (8 * MiB, 2)))
+    running.close()
+
+    # a disabled tuner doesn't learn anything
+    TUNER.configure(False, 256 * MiB, 10, 2 * MiB, 64 * MiB, 4)
+    cases.append(("disabled", settings_after("twitch=disabled_user", [ 2_500_000.0 ] * 60), (11_250_000, 2)))
+
+    failed = False
+    for name, actual, expected in cases:
+        ok = actual == expected
+        failed = failed or not ok
+        print(f"{'ok' if ok else 'FAILED':<8} {name:<24} ring buffer {actual[0]:>10} bytes, {actual[1]} segment thread(s)" + ("" if ok else f", expected {expected[0]} bytes and {expected[1]} segment thread(s)"))
+
+    return not failed
+
+if __name__ == "__main__":
+    if not run():
+        sys.exit(1)
@@ -0,0 +1,496 @@
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Optional
+import hashlib
+import hmac
+import json
+import re
+import time
+import urllib.parse
+import zlib
+
+TS_PACKET_SIZE = 188
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+
+def _crc32_mpeg2(data: bytes):
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+            crc &= 0xFFFFFFFF
+    return crc
+
+def _encode_pts(pts: int):
+    return bytes([
+        0x21 | ((pts >> 29) & 0x0E),
+        (pts >> 22) & 0xFF,
+        0x01 | ((pts >> 14) & 0xFE),
+        (pts >> 7) & 0xFF,
+        0x01 | ((pts << 1) & 0xFE),
+    ])
+
+def _packet(pid: int, cc: int, payload: bytes, pusi=False, random_access=False):
+    header = bytes([0x47, (0x40 if pusi else 0) | (pid >> 8), pid & 0xFF])
+
+    if random_access:
+        payload = payload[:TS_PACKET_SIZE - 6]
+        stuffing = TS_PACKET_SIZE - 6 - len(payload)
+        adaptation_field = bytes([1 + stuffing, 0x40]) + b"\xff" * stuffing
+        return header + bytes([0x30 | cc]) + adaptation_field + payload
+
+    if len(payload) < TS_PACKET_SIZE - 4:
+        stuffing = TS_PACKET_SIZE - 5 - len(payload)
+        adaptation_field = bytes([stuffing]) + (b"\x00" + b"\xff" * (stuffing - 1) if stuffing > 0 else b"")
+        return header + bytes([0x30 | cc]) + adaptation_field + payload
+
+    return header + bytes([0x10 | cc]) + payload[:TS_PACKET_SIZE - 4]
+
+def _psi_section(table_id: int, table_id_extension: int, body: bytes):
+    section = bytes([table_id, 0xB0 | ((len(body) + 9) >> 8), (len(body) + 9) & 0xFF, table_id_extension >> 8, table_id_extension & 0xFF, 0xC1, 0x00, 0x00]) + body
+    return b"\x00" + section + _crc32_mpeg2(section).to_bytes(4, "big")
+
+# generates a deterministic MPEG-TS stream with a single video PID, PES headers with PTS for every frame and a keyframe flag every keyframe_interval seconds.
+# the payload is just filler, but the container structure is valid, so every segment can be generated independently and still line up with its neighbours.
+class FakeTransportStream:
+    def __init__(self, bitrate: int, fps: int = 30, keyframe_interval: float = 2.0):
+        self.fps = fps
+        self.keyframe_frames = max(1, int(keyframe_interval * fps))
+        self.packets_per_frame = max(1, bitrate // 8 // fps // TS_PACKET_SIZE)
+
+        pat = _psi_section(0x00, 1, bytes([0x00, 0x01, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF]))
+        pmt = _psi_section(0x02, 1, bytes([0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00, 0x1B, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00]))
+        self._pat = [ _packet(0, cc, pat + b"\xff" * (184 - len(pat)), pusi=True) for cc in range(16) ]
+        self._pmt = [ _packet(PMT_PID, cc, pmt + b"\xff" * (184 - len(pmt)), pusi=True) for cc in range(16) ]
+        self._filler = [ _packet(VIDEO_PID, cc, b"\x00" * 184) for cc in range(16) ]
+
+    def frames(self, first_frame: int, count: int, table_index: int):
+        parts = [ self._pat[table_index % 16], self._pmt[table_index % 16] ]
+        cc = (first_frame * self.packets_per_frame) % 16
+
+        for frame in range(first_frame, first_frame + count):
+            pts = (frame * 90000 // self.fps) % (1 << 33)
+            pes_header = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + _encode_pts(pts)
+            parts.append(_packet(VIDEO_PID, cc, pes_header + b"\x00" * 184, pusi=True, random_access=(frame % self.keyframe_frames == 0)))
+            cc = (cc + 1) % 16
+
+            for _ in range(self.packets_per_frame - 1):
+                parts.append(self._filler[cc])
+                cc = (cc + 1) % 16
+
+        return b"".join(parts)
+
+class _FakeServer:
+    def __init__(self, handler_class: type[BaseHTTPRequestHandler]):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+        self._server.daemon_threads = True
+        self._server.fake = self # type: ignore
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._stall_window: Optional[tuple[float, float]] = None
+        self.stopped = False
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    # every request that is running or arrives in the next duration seconds stops sending anything and never completes,
+    # requests that arrive afterwards are served normally again
+    def stall(self, duration: float):
+        now = time.monotonic()
+        self._stall_window = (now, now + duration)
+
+    def is_stalled(self, request_start: float):
+        return self._stall_window is not None and time.monotonic() >= self._stall_window[0] and request_start < self._stall_window[1]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def fake(self):
+        return self.server.fake # type: ignore
+
+    # the headers and the body are sent in a single write, because twitchAPI only reads the body of the token response
+    # after closing its session, which fails if the body hasn't arrived together with the headers
+    def send_body(self, status: int, content_type: str, body: bytes):
+        head = f"{self.protocol_version} {status} {HTTPStatus(status).phrase}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+        self.wfile.write(head.encode("latin-1") + body)
+
+    def send_json(self, data: dict):
+        self.send_body(200, "application/json", json.dumps(data).encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+    def hang_if_stalled(self, request_start: float):
+        if not self.fake.is_stalled(request_start):
+            return
+
+        while not self.fake.stopped:
+            time.sleep(0.1)
+
+        raise ConnectionResetError("stalled request aborted")
+
+class _HelixHandler(_Handler):
+    def do_POST(self):
+        # the body has to be consumed, otherwise it is parsed as the next request on the kept alive connection
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path.startswith("/oauth2/token"):
+            self.send_json({ "access_token": "benchmark", "expires_in": 3600 * 24, "token_type": "bearer" })
+        else:
+            self.send_body(404, "text/plain", b"not found")
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+
+        if url.path == "/oauth2/validate":
+            self.send_json({ "client_id": "benchmark", "scopes": [], "expires_in": 3600 * 24 })
+        elif url.path == "/helix/streams":
+            self.fake.record_request()
+            user_logins = urllib.parse.parse_qs(url.query).get("user_login", [])
+            self.send_json({
+                "data": [ self.fake.stream_object(u) for u in user_logins if u in self.fake.live_users ],
+                "pagination": {},
+            })
+        else:
+            self.send_body(404, "text/plain", b"not found")
+
+# stand-in for the get_streams endpoint of the Twitch Helix API and the app token endpoint
+class FakeHelixServer(_FakeServer):
+    def __init__(self, live_users: set[str]):
+        super().__init__(_HelixHandler)
+        self.live_users = set(live_users)
+        self.request_count = 0
+        self._lock = Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def stream_object(self, username: str):
+        return {
+            "id": str(zlib.crc32(username.encode("utf-8"))),
+            "user_id": str(zlib.crc32(username.encode("utf-8"))),
+            "user_login": username,
+            "user_name": username,
+            "game_id": "0",
+            "game_name": "Benchmark",
+            "type": "live",
+            "title": f"Benchmark stream of {username}",
+            "viewer_count": 1,
+            "started_at": "2025-01-01T00:00:00Z",
+            "language": "en",
+            "thumbnail_url": "",
+            "tag_ids": [],
+            "tags": [],
+            "is_mature": False,
+        }
+
+class _HLSHandler(_Handler):
+    path_re = re.compile(r"^/live/([^/]+)/(master\.m3u8|media\.m3u8|(\d+)\.ts)$")
+
+    def do_GET(self):
+        match = self.path_re.match(urllib.parse.urlparse(self.path).path)
+
+        if match is None or match.group(1) not in self.fake.live_users:
+            self.send_body(404, "text/plain", b"not found")
+            return
+
+        username = match.group(1)
+
+        try:
+            self.hang_if_stalled(time.monotonic())
+        except ConnectionResetError:
+            return
+
+        if match.group(2) == "master.m3u8":
+            self.send_body(200, "application/vnd.apple.mpegurl", self.fake.master_playlist(username).encode("utf-8"))
+        elif match.group(2) == "media.m3u8":
+            self.send_body(200, "application/vnd.apple.mpegurl", self.fake.media_playlist(username).encode("utf-8"))
+        else:
+            self.send_body(200, "video/mp2t", self.fake.segment(username, int(match.group(3))))
+
+# stand-in for an HLS origin with a master playlist and a sliding window live media playlist per user.
+# users in bitrates stream with their own bitrate instead of the shared one
+class FakeHLSServer(_FakeServer):
+    def __init__(self, live_users: set[str], bitrate: int, segment_duration: float = 2.0, window: int = 6, bitrates: dict[str, int] = {}):
+        super().__init__(_HLSHandler)
+        self.live_users = set(live_users)
+        self.bitrate = bitrate
+        self.bitrates = dict(bitrates)
+        self.segment_duration = segment_duration
+        self.window = window
+        self.start_time = time.time()
+
+        self._streams = { b: FakeTransportStream(b) for b in { bitrate, *self.bitrates.values() } }
+        self._frames_per_segment = int(segment_duration * self._streams[bitrate].fps)
+        self._segment_cache: dict[tuple[int, int], bytes] = {}
+        self._lock = Lock()
+
+    def master_playlist(self, username: str):
+        return "\n".join([
+            "#EXTM3U",
+            f"#EXT-X-STREAM-INF:BANDWIDTH={self.bitrates.get(username, self.bitrate)},RESOLUTION=1280x720",
+            f"/live/{username}/media.m3u8",
+            "",
+        ])
+
+    def media_playlist(self, username: str):
+        current = int((time.time() - self.start_time) / self.segment_duration)
+        first = max(0, current - self.window + 1)
+
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{int(self.segment_duration + 0.999)}",
+            f"#EXT-X-MEDIA-SEQUENCE:{first}",
+        ]
+
+        for sequence in range(first, current + 1):
+            lines.append(f"#EXTINF:{self.segment_duration:.3f},")
+            lines.append(f"/live/{username}/{sequence}.ts")
+
+        return "\n".join(lines) + "\n"
+
+    def segment(self, username: str, sequence: int):
+        bitrate = self.bitrates.get(username, self.bitrate)
+
+        # all users with the same bitrate get the same segment contents, so we only have to generate each one once
+        with self._lock:
+            if (bitrate, sequence) not in self._segment_cache:
+                self._segment_cache[(bitrate, sequence)] = self._streams[bitrate].frames(sequence * self._frames_per_segment, self._frames_per_segment, sequence)
+
+                for old_key in [ k for k in self._segment_cache if k[1] < sequence - self.window * 2 ]:
+                    del self._segment_cache[old_key]
+
+            return self._segment_cache[(bitrate, sequence)]
+
+class _VRCDNHandler(_Handler):
+    path_re = re.compile(r"^/live/([^/]+)\.live\.ts$")
+
+    def do_GET(self):
+        match = self.path_re.match(urllib.parse.urlparse(self.path).path)
+
+        if match is None or match.group(1) not in self.fake.live_users:
+            self.send_body(404, "text/plain", b"not found")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp2t")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        stream = self.fake.stream
+        chunk_frames = stream.fps // 10
+        frame = 0
+        start = time.monotonic()
+
+        try:
+            while not self.fake.stopped:
+                self.hang_if_stalled(start)
+
+                data = stream.frames(frame, chunk_frames, frame // chunk_frames)
+
+                if self.fake.link is not None:
+                    self.fake.link.transmit(len(data))
+
+                self.wfile.write(data)
+                frame += chunk_frames
+
+                delay = start + frame / stream.fps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+# stand-in for the VRCDN HTTP-TS endpoint, which sends an endless MPEG-TS stream at the configured bitrate
+class FakeVRCDNServer(_FakeServer):
+    def __init__(self, live_users: set[str], bitrate: int, link: Optional["ThrottledLink"] = None):
+        super().__init__(_VRCDNHandler)
+        self.live_users = set(live_users)
+        self.stream = FakeTransportStream(bitrate)
+        self.link = link
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        super().stop()
+
+# simulates a shared link with limited capacity, every server using the same link competes for it chunk by chunk
+class ThrottledLink:
+    def __init__(self, rate: int):
+        self._rate = rate
+        self._lock = Lock()
+        self._next_free = 0.0
+
+    # blocks until the link had time to transmit the data
+    def transmit(self, size: int):
+        with self._lock:
+            end = max(self._next_free, time.monotonic()) + size / self._rate
+            self._next_free = end
+
+        delay = end - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+class _BulkHandler(_Handler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk = b"\x00" * (64 * 1024)
+
+        try:
+            while not self.fake.stopped:
+                self.fake.link.transmit(len(chunk))
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+# sends an endless download as fast as the link allows, standing in for background transfers like uploads or copies to a NAS
+class FakeBulkServer(_FakeServer):
+    def __init__(self, link: ThrottledLink):
+        super().__init__(_BulkHandler)
+        self.link = link
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        super().stop()
+
+class _S3Handler(_Handler):
+    def _check_request(self, body: bytes):
+        url = urllib.parse.urlsplit(self.path)
+        authorization = self.headers.get("Authorization", "")
+        match = re.match(r"^AWS4-HMAC-SHA256 Credential=([^/]+)/([^,]+), SignedHeaders=([^,]+), Signature=([0-9a-f]+)$", authorization)
+
+        if match is None or match.group(1) != self.fake.access_key:
+            return False
+        if self.headers.get("x-amz-content-sha256") != hashlib.sha256(body).hexdigest():
+            return False
+
+        access_key, scope, signed_headers, signature = match.groups()
+        canonical_headers = "".join(f"{name}:{self.headers.get(name, '').strip()}\n" for name in signed_headers.split(";"))
+        canonical_request = "\n".join([ self.command, url.path, url.query, canonical_headers, signed_headers, self.headers["x-amz-content-sha256"] ])
+        string_to_sign = "\n".join([ "AWS4-HMAC-SHA256", self.headers["x-amz-date"], scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest() ])
+
+        signing_key = f"AWS4{self.fake.secret_key}".encode("utf-8")
+        for part in scope.split("/"):
+            signing_key = hmac.new(signing_key, part.encode("utf-8"), hashlib.sha256).digest()
+
+        return hmac.compare_digest(signature, hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest())
+
+    def _handle(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+        key = urllib.parse.unquote(url.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if not self._check_request(body):
+            self.send_body(403, "application/xml", b"<Error><Code>SignatureDoesNotMatch</Code></Error>")
+            return
+
+        status, response = self.fake.handle(self.command, key, { name: values[0] for name, values in query.items() }, body)
+
+        if isinstance(response, str): # an etag
+            self.send_response(status)
+            self.send_header("ETag", response)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.send_body(status, "application/xml", response)
+
+    def do_GET(self):
+        self._handle()
+
+    def do_PUT(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+# stand-in for S3 compatible storage like MinIO, which supports the multipart upload API and reading the uploaded objects.
+# the requests have to be signed, and fail_requests can be set to make the next requests fail with a server error
+class FakeS3Server(_FakeServer):
+    def __init__(self, access_key: str = "benchmark", secret_key: str = "benchmark-secret", min_part_size: int = 5 * 1024 * 1024):
+        super().__init__(_S3Handler)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.min_part_size = min_part_size
+        self.fail_requests = 0
+
+        self.objects: dict[str, bytes] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.uploaded_bytes = 0
+        self._next_upload_id = 0
+        self._lock = Lock()
+
+    def handle(self, method: str, key: str, query: dict[str, str], body: bytes) -> tuple[int, bytes | str]:
+        with self._lock:
+            if self.fail_requests > 0:
+                self.fail_requests -= 1
+                return 500, b"<Error><Code>InternalError</Code></Error>"
+
+            if method == "POST" and "uploads" in query:
+                self._next_upload_id += 1
+                self.uploads[str(self._next_upload_id)] = {}
+                return 200, f"<InitiateMultipartUploadResult><Key>{key}</Key><UploadId>{self._next_upload_id}</UploadId></InitiateMultipartUploadResult>".encode("utf-8")
+
+            if method == "GET" and key in self.objects:
+                return 200, self.objects[key]
+
+            upload = self.uploads.get(query.get("uploadId", ""))
+            if upload is None:
+                return 404, b"<Error><Code>NoSuchUpload</Code></Error>"
+
+            if method == "PUT":
+                upload[int(query["partNumber"])] = body
+                self.uploaded_bytes += len(body)
+                return 200, f"\"{hashlib.md5(body).hexdigest()}\""
+
+            if method == "DELETE":
+                del self.uploads[query["uploadId"]]
+                return 204, b""
+
+            parts = [ (int(number), etag) for number, etag in re.findall(rb"<PartNumber>(\d+)</PartNumber><ETag>([^<]+)</ETag>", body) ]
+            if [ number for number, _ in parts ] != list(range(1, len(parts) + 1)):
+                return 400, b"<Error><Code>InvalidPartOrder</Code></Error>"
+
+            for number, etag in parts:
+                if number not in upload or etag.decode("utf-8") != f"\"{hashlib.md5(upload[number]).hexdigest()}\"":
+                    return 400, b"<Error><Code>InvalidPart</Code></Error>"
+                if number < len(parts) and len(upload[number]) < self.min_part_size:
+                    return 400, b"<Error><Code>EntityTooSmall</Code></Error>"
+
+            self.objects[key] = b"".join(upload[number] for number, _ in parts)
+            del self.uploads[query["uploadId"]]
+            return 200, b"<CompleteMultipartUploadResult></CompleteMultipartUploadResult>"
+
+class _SlowHandler(_Handler):
+    def do_GET(self):
+        time.sleep(self.fake.delay)
+        self.send_body(200, "text/plain", b"ok")
+
+# answers every request after a fixed delay, standing in for slow stream resolution or a slow stream server
+class FakeSlowServer(_FakeServer):
+    def __init__(self, delay: float):
+        super().__init__(_SlowHandler)
+        self.delay = delay
@@ -0,0 +1,347 @@
+import argparse
+import bisect
+import itertools
+import logging
+import math
+import random
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from lib.backoff import StartBackoff
+from lib.recorder_base import RecorderBase, StartFailure
+from lib.scheduler import Scheduler
+from lib.service_base import ServiceBase
+from lib.stream_metadata import StreamMetadata
+from lib.trace import read_trace
+from lib.username_definition import UsernameDefinition
+
+Labels = tuple[str, str]
+
+# one stream of a user, as it was seen in the trace
+@dataclass
+class StreamInterval:
+    start: float # when the stream actually started (reported by the service if possible, otherwise when the update first saw it)
+    api_start: float # when an update first reported the stream as live
+    api_end: float # when an update first reported the stream as offline
+    data_end: float # when the recorder stopped for the last time before the stream went offline
+
+@dataclass
+class Trace:
+    start: float
+    end: float
+    settings: dict[str, float]
+    watches: dict[str, set[str]] = field(default_factory=dict)
+    streams: dict[Labels, list[StreamInterval]] = field(default_factory=dict)
+    interruptions: dict[Labels, list[float]] = field(default_factory=dict) # times at which running recordings stopped
+    failures: dict[Labels, list[tuple[float, float, str]]] = field(default_factory=dict) # (from, until, reason) in which starts failed
+
+# turns the events of a trace into what actually happened to every stream, independent of the settings used while recording it
+def load_trace(path: str) -> Trace:
+    trace: Optional[Trace] = None
+    open_streams: dict[Labels, StreamInterval] = {}
+    last_start: dict[Labels, float] = {}
+    open_failures: dict[Labels, tuple[float, str]] = {}
+    last_stop: dict[Labels, float] = {}
+
+    def close_failure(labels: Labels, until: float):
+        assert trace is not None
+        if labels in open_failures:
+            since, reason = open_failures.pop(labels)
+            trace.failures.setdefault(labels, []).append((since, until, reason))
+
+    for event in read_trace(path):
+        t: float = event["t"]
+        if trace is None:
+            if event["type"] != "header":
+                raise Exception(f"{path} does not start with a trace header")
+            trace = Trace(t, t, event["settings"])
+
+        trace.end = max(trace.end, t)
+
+        if event["type"] == "watches":
+            for service, usernames in event["watches"].items():
+                trace.watches.setdefault(service, set()).update(usernames)
+        elif event["type"] == "poll":
+            for username in event["went_live"]:
+                labels = (event["service"], username)
+                start = min(event["started_at"].get(username, t), t)
+                open_streams[labels] = StreamInterval(start, t, math.inf, math.inf)
+
+            for username in event["went_offline"]:
+                labels = (event["service"], username)
+                stream = open_streams.pop(labels, None)
+                if stream is None:
+                    continue
+
+                stream.api_end = t
+                stream.data_end = min(last_stop.get(labels, t), t) if last_stop.get(labels, 0) >= stream.api_start else t
+                trace.streams.setdefault(labels, []).append(stream)
+                close_failure(labels, t)
+        elif event["type"] == "start":
+            last_start[(event["service"], event["username"])] = t
+        elif event["type"] == "stop":
+            labels = (event["service"], event["username"])
+
+            if event["recorded"]:
+                close_failure(labels, last_start.get(labels, t))
+                trace.interruptions.setdefault(labels, []).append(t)
+                last_stop[labels] = t
+            elif event["failure"] is not None and labels not in open_failures:
+                open_failures[labels] = (last_start.get(labels, t), event["failure"])
+
+    if trace is None:
+        raise Exception(f"{path} is empty")
+
+    for labels, stream in open_streams.items():
+        stream.api_end = trace.end
+        stream.data_end = trace.end
+        trace.streams.setdefault(labels, []).append(stream)
+        close_failure(labels, trace.end)
+
+    for labels in list(open_failures):
+        close_failure(labels, trace.end)
+
+    for streams in trace.streams.values():
+        streams.sort(key=lambda s: s.api_start)
+
+    return trace
+
+class VirtualClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+# starts successfully if the stream was recordable at that time in the trace, and stops where the real recorders stopped
+class ReplayRecorder(RecorderBase):
+    def __init__(self, simulation: "Simulation", service_name: str, username: str):
+        super().__init__()
+        self.service_name = service_name
+        self._username = username
+        self._simulation = simulation
+
+    def getFreshClone(self):
+        self._simulation.restarts += 1
+        return ReplayRecorder(self._simulation, self.service_name, self._username)
+
+    def startRecording(self, metadata):
+        self._simulation.start_recorder(self)
+
+    def stopRecording(self):
+        self._simulation.stop_recorder(self)
+
+    def abort(self, error: Exception):
+        self.stopRecording()
+
+    def finish(self):
+        self._is_finished = True
+
+# reports the live status from the trace at the simulated time, and counts the requests the real service would have sent
+class ReplayService(ServiceBase[ReplayRecorder]):
+    def __init__(self, name: str, simulation: "Simulation"):
+        super().__init__()
+        self.initialized = True
+        self._name = name
+        self._simulation = simulation
+        self._live: set[str] = set()
+
+    def init(self, config):
+        return True
+
+    def is_user_live(self, username: str) -> bool:
+        return username in self._live
+
+    def get_live_users(self) -> set[str]:
+        return set(self._live)
+
+    def update_streams(self, usernames: Iterable[str]):
+        usernames = list(usernames)
+        self._simulation.api_requests += math.ceil(len(usernames) / 100) if self._name == "twitch" else len(usernames)
+        self._live = self._simulation.api_live[self._name].intersection(usernames)
+        return len(self._live)
+
+    def get_recorder(self, username: str, params: list[str], plugins) -> ReplayRecorder:
+        return ReplayRecorder(self._simulation, self._name, username)
+
+    def start_recorder(self, username: str, recorder: ReplayRecorder):
+        recorder.startRecording(StreamMetadata(username, username, "", datetime.fromtimestamp(self._simulation.clock.now), self._name, {}))
+
+class Simulation:
+    def __init__(self, trace: Trace, settings: dict[str, float], seed: int):
+        self.trace = trace
+        self.clock = VirtualClock(trace.start)
+        self.api_requests = 0
+        self.start_attempts = 0
+        self.restarts = 0
+
+        self._running: dict[ReplayRecorder, tuple[float, float]] = {} # recorder -> (start time, end of the stream data)
+        self._recorded: dict[Labels, list[tuple[float, float]]] = {}
+        self._interruptions = sorted((t, labels) for labels, times in trace.interruptions.items() for t in times)
+        self._next_interruption = 0
+
+        # the live status the service reports, updated while the clock advances
+        self.api_live: dict[str, set[str]] = { name: set() for name in trace.watches }
+        self._api_changes = sorted(
+            change for labels, streams in trace.streams.items() for s in streams
+            for change in ((s.api_start, True, labels), (s.api_end, False, labels))
+        )
+        self._next_api_change = 0
+
+        services: Dict[str, ServiceBase] = { name: ReplayService(name, self) for name in trace.watches }
+        self.scheduler = Scheduler(
+            services,
+            lambda d: ReplayRecorder(self, d.service, d.username),
+            settings["update_interval"],
+            settings["update_end_interval"],
+            settings["stream_end_timeout"],
+            backoff=StartBackoff(random=random.Random(seed).random),
+            clock=self.clock,
+        )
+        self.scheduler.set_watches({
+            f"{service}={username}": UsernameDefinition(service, username, [])
+            for service, usernames in trace.watches.items() for username in usernames
+        })
+
+    def _find_stream(self, labels: Labels, now: float, attribute: str) -> Optional[StreamInterval]:
+        streams = self.trace.streams.get(labels, [])
+        i = bisect.bisect_right(streams, now, key=lambda s: s.api_start) - 1
+        if i >= 0 and getattr(streams[i], attribute) > now:
+            return streams[i]
+        return None
+
+    def start_recorder(self, recorder: ReplayRecorder):
+        now = self.clock.now
+        labels = recorder.getMetricLabels()
+        self.start_attempts += 1
+        recorder._start_time = now
+
+        for since, until, reason in self.trace.failures.get(labels, []):
+            if since <= now < until:
+                recorder._encountered_error = StartFailure(reason, "failed in the trace")
+                recorder._stop_time = now
+                return
+
+        recorder._is_initialized = True
+
+        stream = self._find_stream(labels, now, "data_end")
+        if stream is None:
+            recorder._stop_time = now # the stream was already over, so the recorder ends right away
+            return
+
+        recorder._recording = True
+        recorder._ever_recorded = True
+        self._running[recorder] = (now, stream.data_end)
+
+    def stop_recorder(self, recorder: ReplayRecorder):
+        if recorder in self._running:
+            start, _ = self._running.pop(recorder)
+            self._recorded.setdefault(recorder.getMetricLabels(), []).append((start, self.clock.now))
+
+        recorder._recording = False
+        recorder._stop_time = self.clock.now
+        recorder._is_finished = True
+
+    # stops the recorders where the recordings stopped in the trace
+    def advance(self, now: float):
+        self.clock.now = now
+
+        while self._next_api_change < len(self._api_changes) and self._api_changes[self._next_api_change][0] <= now:
+            _, live, (service, username) = self._api_changes[self._next_api_change]
+            self._next_api_change += 1
+
+            if live:
+                self.api_live.setdefault(service, set()).add(username)
+            else:
+                self.api_live.setdefault(service, set()).discard(username)
+
+        while self._next_interruption < len(self._interruptions) and self._interruptions[self._next_interruption][0] <= now:
+            _, labels = self._interruptions[self._next_interruption]
+            self._next_interruption += 1
+
+            for recorder in [ r for r in self._running if r.getMetricLabels() == labels ]:
+                self.stop_recorder(recorder)
+
+        for recorder in [ r for r, (_, data_end) in self._running.items() if data_end <= now ]:
+            self.stop_recorder(recorder)
+
+    def run(self):
+        now = self.trace.start
+
+        while now <= self.trace.end:
+            self.advance(now)
+            self.scheduler.tick()
+            now += 1 # the main loop sleeps for a second between ticks
+
+        for recorder in list(self._running):
+            self.stop_recorder(recorder)
+
+    def get_results(self):
+        lags: list[float] = []
+        missed = 0.0
+
+        for labels, streams in self.trace.streams.items():
+            segments = sorted(self._recorded.get(labels, []))
+
+            for stream in streams:
+                covered = [ (max(s, stream.start), min(e, stream.data_end)) for s, e in segments if e > stream.start and s < stream.data_end ]
+                covered = [ (s, e) for s, e in covered if e > s ]
+
+                recorded = 0.0
+                position = stream.start
+                for s, e in covered:
+                    recorded += max(0.0, e - max(s, position))
+                    position = max(position, e)
+
+                missed += max(0.0, (stream.data_end - stream.start) - recorded)
+
+                if len(covered) > 0:
+                    lags.append(covered[0][0] - stream.start)
+
+        lags.sort()
+        return {
+            "api_requests": self.api_requests,
+            "starts": self.start_attempts,
+            "restarts": self.restarts,
+            "lag_mean": sum(lags) / len(lags) if len(lags) > 0 else 0,
+            "lag_p95": lags[int(len(lags) * 0.95)] if len(lags) > 0 else 0,
+            "missed_minutes": missed / 60,
+            "streams": sum(len(s) for s in self.trace.streams.values()),
+            "unrecorded": sum(len(s) for s in self.trace.streams.values()) - len(lags),
+        }
+
+def parse_list(value: str):
+    return [ float(v) for v in value.split(",") ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a trace recorded with --trace through the scheduler with a virtual clock, to compare the effects of different settings")
+    parser.add_argument("trace", help="Path to the trace file")
+    parser.add_argument("--update-interval", metavar="seconds", dest="update_interval", type=parse_list, help="Comma separated list of values to try (Default: the value from the trace)")
+    parser.add_argument("--update-end-interval", metavar="seconds", dest="update_end_interval", type=parse_list, help="Comma separated list of values to try (Default: the value from the trace)")
+    parser.add_argument("--stream-end-timeout", metavar="seconds", dest="stream_end_timeout", type=parse_list, help="Comma separated list of values to try (Default: the value from the trace)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the backoff jitter (Default: 1)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    trace = load_trace(args.trace)
+    streams = sum(len(s) for s in trace.streams.values())
+    watches = sum(len(u) for u in trace.watches.values())
+    print(f"Trace of {(trace.end - trace.start) / 3600:.1f} hours with {watches} watches and {streams} streams, recorded with {trace.settings}")
+    print()
+    print(f"{'update':>8} {'end':>6} {'timeout':>8} | {'requests':>9} {'starts':>7} {'restarts':>9} {'lag mean':>9} {'lag p95':>8} {'missed min':>11} {'unrecorded':>11}")
+
+    grid = itertools.product(
+        args.update_interval or [ trace.settings["update_interval"] ],
+        args.update_end_interval or [ trace.settings["update_end_interval"] ],
+        args.stream_end_timeout or [ trace.settings["stream_end_timeout"] ],
+    )
+
+    for update_interval, update_end_interval, stream_end_timeout in grid:
+        settings = { "update_interval": update_interval, "update_end_interval": update_end_interval, "stream_end_timeout": stream_end_timeout }
+        simulation = Simulation(trace, settings, args.seed)
+        simulation.run()
+        r = simulation.get_results()
+
+        print(f"{update_interval:>8g} {update_end_interval:>6g} {stream_end_timeout:>8g} | {r['api_requests']:>9} {r['starts']:>7} {r['restarts']:>9} {r['lag_mean']:>8.1f}s {r['lag_p95']:>7.1f}s {r['missed_minutes']:>11.1f} {r['unrecorded']:>11}")
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+from benchmarks.fake_servers import FakeHelixServer, FakeHLSServer, FakeVRCDNServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+metric_line_re = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$")
+label_re = re.compile(r"(\w+)=\"((?:[^\"\\]|\\.)*)\"")
+
+def parse_metrics(text: str):
+    result: dict[str, list[tuple[dict, float]]] = {}
+
+    for line in text.splitlines():
+        match = metric_line_re.match(line)
+        if match is None:
+            continue
+
+        labels = dict(label_re.findall(match.group(2) or ""))
+        result.setdefault(match.group(1), []).append((labels, float(match.group(3))))
+
+    return result
+
+def scrape_metrics(port: int):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+        return parse_metrics(resp.read().decode("utf-8"))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def read_process_stats(pid: int):
+    with open(f"/proc/{pid}/stat", "r") as stat_file:
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+
+    with open(f"/proc/{pid}/statm", "r") as statm_file:
+        rss_pages = int(statm_file.read().split()[1])
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks # utime + stime
+
+    return cpu_seconds, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def summarize(values: list[float]):
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+    return {
+        "min": values[0],
+        "median": values[len(values) // 2],
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+def run_benchmark(args):
+    usernames = [ f"bench_user_{i}" for i in range(args.watches) ]
+    live_users = set(usernames[:args.live])
+
+    helix = FakeHelixServer(live_users).start()
+    hls = FakeHLSServer(live_users, args.bitrate).start()
+    vrcdn = FakeVRCDNServer(live_users, args.bitrate).start()
+
+    metrics_port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="tar3000-bench-") as work_dir:
+        if args.service == "twitch":
+            streamers = usernames
+        else:
+            streamers = [ f"vrcdn={u}" for u in usernames ]
+
+        config = {
+            "twitch": {
+                "clientid": "benchmark",
+                "secret": "benchmark",
+                "api_base_url": f"{helix.url}/helix/",
+                "auth_base_url": f"{helix.url}/oauth2/",
+                "stream_url": f"{hls.url}/live/{{username}}/master.m3u8",
+            },
+            "vrcdn": {
+                "stream_url": f"{vrcdn.url}/live/{{username}}.live.ts",
+            },
+            "streamers": streamers,
+            "output_path": os.path.join(work_dir, "recordings"),
+            "update_interval": args.update_interval,
+            "metrics_port": metrics_port,
+        }
+
+        # YAML is a superset of JSON, so we don't need an extra dependency to write the config file
+        config_path = os.path.join(work_dir, "config.yaml")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+
+        log_file = open(os.path.join(work_dir, "main.log"), "w")
+        process = subprocess.Popen([ sys.executable, os.path.join(REPO_ROOT, "main.py"), "-C", config_path, "--log", args.loglevel ], cwd=REPO_ROOT, stdout=log_file, stderr=subprocess.STDOUT)
+
+        cpu_samples: list[tuple[float, float]] = []
+        rss_samples: list[int] = []
+        start_time = time.monotonic()
+        warmup_done = False
+
+        try:
+            while time.monotonic() - start_time < args.duration:
+                if process.poll() is not None:
+                    raise Exception(f"main.py exited early with code {process.returncode}, see the log below:\n" + open(log_file.name).read())
+
+                cpu_seconds, rss = read_process_stats(process.pid)
+                cpu_samples.append((time.monotonic(), cpu_seconds))
+                rss_samples.append(rss)
+
+                # the write rates are computed between two scrapes, so the first one marks the beginning of the measurement window
+                if not warmup_done and time.monotonic() - start_time >= args.warmup:
+                    try:
+                        scrape_metrics(metrics_port)
+                        warmup_done = True
+                    except OSError:
+                        pass
+
+                time.sleep(1)
+
+            final_metrics = scrape_metrics(metrics_port)
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+
+            helix.stop()
+            hls.stop()
+            vrcdn.stop()
+
+    poll_latency = {}
+    poll_counts = { l["service"]: v for l,v in final_metrics.get("service_poll_duration_seconds_count", []) }
+    for labels, poll_sum in final_metrics.get("service_poll_duration_seconds_sum", []):
+        count = poll_counts.get(labels["service"], 0)
+        if count > 0:
+            poll_latency[labels["service"]] = { "mean": poll_sum / count, "count": count }
+
+    write_rates = [ v / 1000**2 for _,v in final_metrics.get("recorder_write_rate_bytes", []) ]
+    time_to_first_byte = [ v for _,v in final_metrics.get("recorder_time_to_first_byte_seconds", []) ]
+
+    measured = [ s for s in cpu_samples if s[0] - cpu_samples[0][0] >= args.warmup ] or cpu_samples
+    cpu_percent = None
+    if len(measured) > 1:
+        cpu_percent = 100 * (measured[-1][1] - measured[0][1]) / (measured[-1][0] - measured[0][0])
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "revision": git_revision(),
+        "parameters": {
+            "service": args.service,
+            "watches": args.watches,
+            "live": args.live,
+            "bitrate": args.bitrate,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "update_interval": args.update_interval,
+        },
+        "results": {
+            "poll_latency_seconds": poll_latency,
+            "helix_requests": helix.request_count,
+            "recorders_active": sum(v for _,v in final_metrics.get("recorders_active", [])),
+            "time_to_first_byte_seconds": summarize(time_to_first_byte),
+            "recorder_write_rate_mb_per_second": summarize(write_rates),
+            "total_write_rate_mb_per_second": sum(write_rates),
+            "cpu_percent": cpu_percent,
+            "rss_bytes": summarize([ float(r) for r in rss_samples ]),
+        },
+    }
+
+def flatten(data: dict, prefix: str = ""):
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            result.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[f"{prefix}{key}"] = value
+    return result
+
+def compare(previous: dict, current: dict):
+    if previous["parameters"] != current["parameters"]:
+        print("Warning: the benchmark parameters differ between the two runs")
+
+    previous_results = flatten(previous["results"])
+    current_results = flatten(current["results"])
+
+    for key, value in current_results.items():
+        if key not in previous_results:
+            continue
+
+        old_value = previous_results[key]
+        change = f"{100 * (value - old_value) / old_value:+.1f}%" if old_value != 0 else "n/a"
+        print(f"{key:<50} {old_value:>14.4f} -> {value:>14.4f} ({change})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs main.py against local stand-ins of the Twitch API, an HLS origin and VRCDN and measures its performance")
+    parser.add_argument("--service", choices=["twitch", "vrcdn"], default="twitch", help="Service the watched users belong to (Default: twitch)")
+    parser.add_argument("--watches", metavar="N", type=int, default=100, help="Number of watched users (Default: 100)")
+    parser.add_argument("--live", metavar="M", type=int, default=10, help="Number of watched users that are live (Default: 10)")
+    parser.add_argument("--bitrate", metavar="bits", type=int, default=6_000_000, help="Bitrate of every live stream in bits per second (Default: 6000000)")
+    parser.add_argument("--duration", metavar="seconds", type=int, default=60, help="Total duration of the benchmark (Default: 60)")
+    parser.add_argument("--warmup", metavar="seconds", type=int, default=20, help="Time after which the throughput and CPU measurements start (Default: 20)")
+    parser.add_argument("--update-interval", metavar="seconds", dest="update_interval", type=int, default=10, help="Update interval passed to main.py (Default: 10)")
+    parser.add_argument("--log", metavar="loglevel", dest="loglevel", default="WARNING", help="Log level passed to main.py (Default: WARNING)")
+    parser.add_argument("-o", "--output-dir", metavar="path", dest="output_dir", default=os.path.join(REPO_ROOT, "benchmarks", "results"), help="Directory the result JSON files are written to (Default: benchmarks/results)")
+    parser.add_argument("--compare", metavar="path", help="Result file of a previous run to compare against")
+    args = parser.parse_args()
+
+    if args.live > args.watches:
+        parser.error("--live can not be larger than --watches")
+
+    result = run_benchmark(args)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    result_path = os.path.join(args.output_dir, f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{args.service}_{args.watches}w_{args.live}l.json")
+
+    with open(result_path, "w") as result_file:
+        json.dump(result, result_file, indent=4)
+
+    print(json.dumps(result["results"], indent=4))
+    print(f"Results written to {result_path}")
+
+    if args.compare is not None:
+        with open(args.compare, "r") as previous_file:
+            compare(json.load(previous_file), result)
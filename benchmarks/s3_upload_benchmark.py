@@ -0,0 +1,113 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import cast
+
+from benchmarks.fake_servers import FakeS3Server, FakeTransportStream
+from lib.config import SinkConfig
+from lib.sinks import S3Sink, create_sinks, finish_sinks, resume_uploads
+
+# writes a fake stream into the file and the sinks like a recorder does, as fast as possible or at the given rate
+def record(path: str, sink_configs: list[SinkConfig], size: int, rate: float | None):
+    stream = FakeTransportStream(6_000_000)
+    frame = 0
+    written = 0
+    write_time = 0.0
+    start = time.monotonic()
+
+    with open(path, "ab") as output_file:
+        sinks = create_sinks(sink_configs, "benchmark", "bench_user", path, output_file.tell())
+
+        while written < size:
+            data = stream.frames(frame, 3, frame)
+            frame += 3
+
+            write_start = time.perf_counter()
+            output_file.write(data)
+            for sink in sinks:
+                sink.write(data)
+            write_time += time.perf_counter() - write_start
+
+            written += len(data)
+
+            if rate is not None:
+                delay = start + written / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    for sink in sinks:
+        sink.close()
+
+    return sinks, written, write_time
+
+def check_object(server: FakeS3Server, path: str):
+    key = f"/benchmark/benchmark/bench_user/{os.path.basename(path)}"
+
+    with open(path, "rb") as recording:
+        expected = recording.read()
+
+    if server.objects.get(key) != expected:
+        raise Exception(f"The uploaded object doesn't match the recording ({len(server.objects.get(key, b''))} of {len(expected)} bytes)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streams recordings to a local S3 stand-in and checks that interrupted uploads are resumed correctly")
+    parser.add_argument("--size", metavar="bytes", type=int, default=200 * 1024 * 1024, help="Size of every recording in bytes (Default: 209715200)")
+    parser.add_argument("--rate", metavar="bytes", type=float, default=None, help="Write rate of the recorder in bytes per second (Default: as fast as possible)")
+    parser.add_argument("--part-size", metavar="bytes", dest="part_size", type=int, default=8 * 1024 * 1024, help="Part size of the uploads (Default: 8388608)")
+    parser.add_argument("--concurrency", metavar="N", type=int, default=4, help="Number of parallel part uploads (Default: 4)")
+    args = parser.parse_args()
+
+    server = FakeS3Server().start()
+    sink_configs = [ SinkConfig(
+        type="s3",
+        url=server.url,
+        bucket="benchmark",
+        access_key=server.access_key,
+        secret_key=server.secret_key,
+        part_size=args.part_size,
+        upload_concurrency=args.concurrency,
+    ) ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, baseline_written, baseline_time = record(os.path.join(directory, "baseline.ts"), [], args.size, args.rate)
+
+        # a recording without interruptions
+        path = os.path.join(directory, "uninterrupted.ts")
+        start = time.monotonic()
+        sinks, written, write_time = record(path, sink_configs, args.size, args.rate)
+        closed = time.monotonic()
+        finish_sinks(sink_configs, "benchmark", path)
+        finished = time.monotonic()
+        check_object(server, path)
+
+        # the stand-in runs in the same process, so most of the difference is the time the recorder waits for the GIL while it hashes the parts
+        print(f"Uninterrupted recording of {written / 1000**2:.0f} MB:")
+        print(f"  recorder: {write_time / (written / 1000**2) * 1000:.3f} ms per MB for writing the file and the sink, {baseline_time / (baseline_written / 1000**2) * 1000:.3f} ms per MB without the sink")
+        print(f"  upload: {written / (finished - start) / 1000**2:.1f} MB/s, {finished - closed:.2f} s from the end of the recording to the complete upload")
+        print(f"  memory: at most {args.concurrency * args.part_size / 1024**2:.0f} MiB of parts in flight")
+
+        # a recorder that is restarted in the middle, and fails to upload some parts
+        path = os.path.join(directory, "restarted.ts")
+        record(path, sink_configs, args.size // 2, args.rate)
+        server.fail_requests = 2
+        record(path, sink_configs, args.size // 2, args.rate)
+        finish_sinks(sink_configs, "benchmark", path)
+        check_object(server, path)
+        print("Restarted recording: OK")
+
+        # the process stops in the middle of a recording, and the upload is completed at the next start
+        path = os.path.join(directory, "resumed.ts")
+        sinks, _, _ = record(path, sink_configs, args.size // 2, args.rate)
+        for sink in sinks:
+            cast(S3Sink, sink).join()
+
+        uploaded_before = server.uploaded_bytes
+        resume_uploads(sink_configs, [ directory ])
+        check_object(server, path)
+        print(f"Resumed recording: OK, {(server.uploaded_bytes - uploaded_before) / 1000**2:.1f} MB uploaded after the restart")
+
+        if any(f.endswith(".json") for f in os.listdir(directory)):
+            raise Exception("Upload state files were left behind")
+
+    server.stop()
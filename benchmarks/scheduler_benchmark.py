@@ -0,0 +1,187 @@
+import argparse
+import random
+import time
+from datetime import datetime
+from typing import Dict, Iterable
+
+from lib.recorder_base import RecorderBase
+from lib.scheduler import Scheduler
+from lib.service_base import ServiceBase
+from lib.stream_metadata import StreamMetadata
+from lib.username_definition import UsernameDefinition
+
+# a recorder that doesn't download anything, it just records until the fake service says the stream is over
+class FakeRecorder(RecorderBase):
+    service_name = "fake"
+
+    def __init__(self, service: "FakeService", username: str):
+        super().__init__()
+        self._service = service
+        self._username = username
+
+    def getFreshClone(self):
+        return FakeRecorder(self._service, self._username)
+
+    def startRecording(self, metadata):
+        self._recording = True
+        self._is_initialized = True
+        self._service.recorders[self._username] = self
+
+    def stopRecording(self):
+        self._recording = False
+        self._is_finished = True
+        self._stop_time = self._service.clock.now
+
+    def abort(self, error: Exception):
+        self.stopRecording()
+
+    def finish(self):
+        self._is_finished = True
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+# keeps the live status of all users in memory and flips a few of them every simulated minute
+class FakeService(ServiceBase[FakeRecorder]):
+    def __init__(self, clock: VirtualClock, usernames: list[str], live: int, changes_per_minute: float, seed: int):
+        super().__init__()
+        self.initialized = True
+        self.clock = clock
+        self.recorders: Dict[str, FakeRecorder] = {}
+
+        self._random = random.Random(seed)
+        self._usernames = usernames
+        self._live = set(self._random.sample(usernames, live))
+        self._changes_per_minute = changes_per_minute
+        self._pending_changes = 0.0
+        self._reported_live: set[str] = set()
+
+    def init(self, config):
+        return True
+
+    def is_user_live(self, username: str) -> bool:
+        return username in self._reported_live
+
+    def get_live_users(self) -> set[str]:
+        return self._reported_live
+
+    # swaps some live users with offline ones, so the number of live streams stays the same
+    def simulate_second(self):
+        self._pending_changes += self._changes_per_minute / 60
+
+        while self._pending_changes >= 1:
+            self._pending_changes -= 1
+
+            ended = self._random.choice(tuple(self._live))
+            self._live.remove(ended)
+            self._live.add(self._random.choice(self._usernames))
+
+            # the download ends right away, but the API only reports it at the next update
+            if ended not in self._live and ended in self.recorders:
+                self.recorders[ended].stopRecording()
+
+    def update_streams(self, usernames: Iterable[str]):
+        watched = set(usernames)
+        self._reported_live = self._live & watched
+        return len(self._reported_live)
+
+    def get_recorder(self, username: str, params: list[str], plugins) -> FakeRecorder:
+        return FakeRecorder(self, username)
+
+    def start_recorder(self, username: str, recorder: FakeRecorder):
+        recorder.startRecording(StreamMetadata(username, username, "", datetime.fromtimestamp(self.clock.now), "fake", {}))
+
+# the main loop before the scheduler existed, which checked every watch on every tick while anything was live
+class LegacyLoop:
+    def __init__(self, services: Dict[str, ServiceBase], watches: Dict[str, UsernameDefinition], update_interval: float, update_end_interval: float, stream_end_timeout: float, clock: VirtualClock):
+        self._services = services
+        self._watches = watches
+        self._update_interval = update_interval
+        self._update_end_interval = update_end_interval
+        self._stream_end_timeout = stream_end_timeout
+        self._clock = clock
+
+        self._recorders: Dict[str, RecorderBase] = {}
+        self._last_check = 0.0
+
+    def tick(self):
+        streams_live = 0
+        recorders = self._recorders
+
+        if (self._clock() - self._last_check >= self._update_interval) or any(r.isFinished() for r in recorders.values()) or \
+           (any(not r.isRecording() for r in recorders.values()) and self._clock() - self._last_check >= self._update_end_interval):
+            self._last_check = self._clock()
+
+            for service_name, service in self._services.items():
+                streams_live += service.update_streams(w.username for w in self._watches.values() if w.service == service_name)
+
+        if streams_live > 0 or len(recorders) > 0:
+            for username_id, username_definition in self._watches.items():
+                service = self._services[username_definition.service]
+                is_live = service.is_user_live(username_definition.username)
+
+                if username_id in recorders and (recorders[username_id].isInitialized() or recorders[username_id].encounteredError()) and not recorders[username_id].isRecording():
+                    if is_live:
+                        recorders[username_id] = recorders[username_id].getFreshClone()
+                        service.start_recorder(username_definition.username, recorders[username_id])
+                    elif self._clock() - recorders[username_id].getStopTime() >= self._stream_end_timeout:
+                        recorders[username_id].finish()
+                        del recorders[username_id]
+
+                if is_live and username_id not in recorders:
+                    recorders[username_id] = service.get_recorder(username_definition.username, username_definition.parameters, [])
+                    service.start_recorder(username_definition.username, recorders[username_id])
+
+def run(args, use_scheduler: bool):
+    clock = VirtualClock()
+    usernames = [ f"user_{i}" for i in range(args.watches) ]
+    service = FakeService(clock, usernames, args.live, args.changes, args.seed)
+    services: Dict[str, ServiceBase] = { "fake": service }
+    watches = { f"fake={u}": UsernameDefinition("fake", u, []) for u in usernames }
+
+    loop: Scheduler | LegacyLoop
+    if use_scheduler:
+        loop = Scheduler(services, lambda d: service.get_recorder(d.username, d.parameters, []), args.update_interval, args.update_end_interval, args.stream_end_timeout, clock=clock)
+        loop.set_watches(watches)
+    else:
+        loop = LegacyLoop(services, watches, args.update_interval, args.update_end_interval, args.stream_end_timeout, clock)
+
+    tick_times: list[float] = []
+
+    for _ in range(args.ticks):
+        start = time.perf_counter()
+        loop.tick()
+        tick_times.append(time.perf_counter() - start)
+
+        clock.now += 1 # the main loop sleeps for a second between ticks
+        service.simulate_second()
+
+    tick_times.sort()
+    return {
+        "mean_ms": 1000 * sum(tick_times) / len(tick_times),
+        "median_ms": 1000 * tick_times[len(tick_times) // 2],
+        "p99_ms": 1000 * tick_times[int(len(tick_times) * 0.99)],
+        "total_s": sum(tick_times),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the per-tick cost of the scheduler with the previous main loop, using a fake service and a virtual clock")
+    parser.add_argument("--watches", metavar="N", type=int, default=10_000, help="Number of watched users (Default: 10000)")
+    parser.add_argument("--live", metavar="M", type=int, default=100, help="Number of users that are live at any time (Default: 100)")
+    parser.add_argument("--changes", metavar="C", type=float, default=5, help="Number of streams that end (and start) per minute (Default: 5)")
+    parser.add_argument("--ticks", metavar="T", type=int, default=3600, help="Number of simulated seconds (Default: 3600)")
+    parser.add_argument("--update-interval", metavar="seconds", dest="update_interval", type=float, default=120, help="(Default: 120)")
+    parser.add_argument("--update-end-interval", metavar="seconds", dest="update_end_interval", type=float, default=10, help="(Default: 10)")
+    parser.add_argument("--stream-end-timeout", metavar="seconds", dest="stream_end_timeout", type=float, default=0, help="(Default: 0)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the simulated stream changes (Default: 1)")
+    args = parser.parse_args()
+
+    print(f"{args.watches} watches, {args.live} live, {args.changes} changes per minute, {args.ticks} ticks")
+
+    for name, use_scheduler in (("previous main loop", False), ("scheduler", True)):
+        result = run(args, use_scheduler)
+        print(f"{name:<20} mean {result['mean_ms']:8.3f} ms   median {result['median_ms']:8.3f} ms   p99 {result['p99_ms']:8.3f} ms   total {result['total_s']:7.2f} s")
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeHelixServer, FakeHLSServer, FakeVRCDNServer
+from benchmarks.run_benchmark import REPO_ROOT, free_port, scrape_metrics
+
+def sum_by_service(final_metrics: dict, name: str):
+    result: dict[str, float] = {}
+    for labels, value in final_metrics.get(name, []):
+        result[labels["service"]] = result.get(labels["service"], 0) + value
+    return result
+
+def read_log_tail(log_path: str, lines: int = 40):
+    with open(log_path, "r") as log_file:
+        return "".join(log_file.readlines()[-lines:])
+
+def wait_for(metrics_port: int, deadline: float, condition):
+    while time.monotonic() < deadline:
+        try:
+            current = scrape_metrics(metrics_port)
+            if condition(current):
+                return current
+        except OSError:
+            pass
+
+        time.sleep(0.5)
+
+    return None
+
+# lets the stand-ins stop sending in the middle of the streams and checks that the stall watchdog aborts the recorders of both services
+# and that they are restarted once the servers respond again, all within the stall timeout plus the time a restart takes
+def run(args):
+    twitch_users = [ f"twitch_user_{i}" for i in range(args.live) ]
+    vrcdn_users = [ f"vrcdn_user_{i}" for i in range(args.live) ]
+
+    helix = FakeHelixServer(set(twitch_users)).start()
+    hls = FakeHLSServer(set(twitch_users), args.bitrate).start()
+    vrcdn = FakeVRCDNServer(set(vrcdn_users), args.bitrate).start()
+
+    metrics_port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="tar3000-stall-check-") as work_dir:
+        config = {
+            "twitch": {
+                "clientid": "benchmark",
+                "secret": "benchmark",
+                "api_base_url": f"{helix.url}/helix/",
+                "auth_base_url": f"{helix.url}/oauth2/",
+                "stream_url": f"{hls.url}/live/{{username}}/master.m3u8",
+            },
+            "vrcdn": {
+                "stream_url": f"{vrcdn.url}/live/{{username}}.live.ts",
+            },
+            "streamers": twitch_users + [ f"vrcdn={u}" for u in vrcdn_users ],
+            "output_path": os.path.join(work_dir, "recordings"),
+            # VRCDN delays every poll by up to one interval and a poll during the stall sees the users as offline until it times out,
+            # so the interval is kept short to let the next poll find the users live again soon after the stall ended
+            "update_interval": 1,
+            "stall_timeout": args.stall_timeout,
+            "metrics_port": metrics_port,
+        }
+
+        # YAML is a superset of JSON, so we don't need an extra dependency to write the config file
+        config_path = os.path.join(work_dir, "config.yaml")
+        with open(config_path, "w") as config_file:
+            json.dump(config, config_file)
+
+        log_path = os.path.join(work_dir, "main.log")
+        log_file = open(log_path, "w")
+        process = subprocess.Popen([ sys.executable, os.path.join(REPO_ROOT, "main.py"), "-C", config_path ], cwd=REPO_ROOT, stdout=log_file, stderr=subprocess.STDOUT)
+
+        try:
+            started = wait_for(metrics_port, time.monotonic() + 30, lambda m: sum(v for _,v in m.get("recorders_active", [])) >= args.live * 2)
+            if started is None:
+                raise AssertionError(f"Not all recorders started within 30 seconds, see the end of the log below:\n{read_log_tail(log_path)}")
+
+            # let the recorders receive a few seconds of data, so the stall hits them in the middle of the stream
+            time.sleep(2)
+            started = scrape_metrics(metrics_port)
+
+            starts_before = sum_by_service(started, "recorder_start_duration_seconds_count")
+            stalls_before = sum_by_service(started, "recorder_stalls_total")
+
+            # the stall ends before the watchdog fires, so the restarted recorders get data again
+            stall_start = time.monotonic()
+            hls.stall(args.stall_timeout / 2)
+            vrcdn.stall(args.stall_timeout / 2)
+
+            # the watchdog checks every stall_timeout / 4 seconds (at most 5), and a restart takes up to one tick plus the start itself.
+            # the VRCDN poll that hung during the stall is over by then, so the users are live again when their recorders stop
+            bound = args.stall_timeout + min(5.0, args.stall_timeout / 4) + args.restart_slack
+
+            def restarted(m: dict):
+                starts = sum_by_service(m, "recorder_start_duration_seconds_count")
+                return all(starts.get(s, 0) - starts_before.get(s, 0) >= args.live for s in ("twitch", "vrcdn")) \
+                    and sum(v for _,v in m.get("recorders_active", [])) >= args.live * 2
+
+            result = wait_for(metrics_port, stall_start + bound, restarted)
+            elapsed = time.monotonic() - stall_start
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log_file.close()
+
+            helix.stop()
+            hls.stop()
+            vrcdn.stop()
+
+        if result is None:
+            raise AssertionError(f"The recorders were not aborted and restarted within {bound:.1f} seconds of the stall, see the end of the log below:\n{read_log_tail(log_path)}")
+
+    stalls = sum_by_service(result, "recorder_stalls_total")
+    print(f"All {args.live * 2} recorders were aborted and restarted {elapsed:.1f} seconds after the stall (bound {bound:.1f} seconds)")
+    for service in ("twitch", "vrcdn"):
+        print(f"  {service}: {stalls.get(service, 0) - stalls_before.get(service, 0):.0f} stall(s) detected by the watchdog")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that recorders whose stream stops sending data are aborted and restarted within the stall timeout")
+    parser.add_argument("--live", metavar="N", type=int, default=2, help="Number of live streams per service (Default: 2)")
+    parser.add_argument("--bitrate", metavar="bits", type=int, default=3_000_000, help="Bitrate of every stream in bits per second (Default: 3000000)")
+    parser.add_argument("--stall-timeout", metavar="seconds", dest="stall_timeout", type=int, default=10, help="Stall timeout of the recorder (Default: 10)")
+    parser.add_argument("--restart-slack", metavar="seconds", dest="restart_slack", type=float, default=5, help="Time a restart may take after the abort (Default: 5)")
+    args = parser.parse_args()
+
+    try:
+        run(args)
+    except AssertionError as e:
+        print(f"FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,137 @@
+import argparse
+import math
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, cast
+
+import requests
+
+from benchmarks.fake_servers import FakeSlowServer
+from lib.recorder_base import RecorderBase
+from lib.scheduler import Scheduler, WatchState
+from lib.service_base import ServiceBase
+from lib.stream_metadata import StreamMetadata
+from lib.username_definition import UsernameDefinition
+
+# a recorder whose start blocks on a request to the slow server, like streamlink resolving a stream or VRCDN waiting for the first response
+class SlowStartRecorder(RecorderBase):
+    service_name = "slow"
+
+    def __init__(self, url: str, username: str):
+        super().__init__()
+        self._url = url
+        self._username = username
+
+    def getFreshClone(self):
+        return SlowStartRecorder(self._url, self._username)
+
+    def startRecording(self, metadata):
+        requests.get(f"{self._url}/resolve/{self._username}", timeout=60).raise_for_status()
+
+        self._recording = True
+        self._is_initialized = True
+        self.started_at = time.monotonic()
+
+    def stopRecording(self):
+        self._recording = False
+        self._stop_time = time.time()
+
+    def abort(self, error: Exception):
+        self.stopRecording()
+
+    def finish(self):
+        self._is_finished = True
+
+class SlowStartService(ServiceBase[SlowStartRecorder]):
+    def __init__(self, url: str, live_users: set[str]):
+        super().__init__()
+        self.initialized = True
+        self._url = url
+        self._live_users = live_users
+
+    def init(self, config):
+        return True
+
+    def is_user_live(self, username: str) -> bool:
+        return username in self._live_users
+
+    def update_streams(self, usernames: Iterable[str]):
+        return len(self._live_users)
+
+    def get_live_users(self) -> set[str]:
+        return set(self._live_users)
+
+    def get_recorder(self, username: str, params: list[str], plugins) -> SlowStartRecorder:
+        return SlowStartRecorder(self._url, username)
+
+    def start_recorder(self, username: str, recorder: SlowStartRecorder):
+        recorder.startRecording(StreamMetadata(username, username, "", datetime.now(), "slow", {}))
+
+def run(args, start_concurrency: int):
+    server = FakeSlowServer(args.delay).start()
+    usernames = [ f"user_{i}" for i in range(args.live) ]
+    services: Dict[str, ServiceBase] = { "slow": SlowStartService(server.url, set(usernames)) }
+
+    scheduler = Scheduler(services, lambda d: services["slow"].get_recorder(d.username, d.parameters, []), 120, 10, 0, start_concurrency=start_concurrency)
+    scheduler.set_watches({ f"slow={u}": UsernameDefinition("slow", u, []) for u in usernames })
+
+    tick_times: list[float] = []
+    start = time.monotonic()
+
+    # like the main loop, but with a shorter sleep so the end of the startup is measured more precisely
+    while any(state != WatchState.RECORDING for state in scheduler.get_watch_states().values()):
+        tick_start = time.monotonic()
+        scheduler.tick()
+        tick_times.append(time.monotonic() - tick_start)
+        time.sleep(0.05)
+
+    total = time.monotonic() - start
+    # from the users going live to the recorder being started, including the wait for a free start slot
+    start_latencies = sorted(cast(SlowStartRecorder, r).started_at - start for r in scheduler.get_recorders())
+
+    scheduler.stop_all()
+    server.stop()
+
+    return total, max(tick_times), start_latencies
+
+# with a start concurrency the starts must not block the main loop, and the recorders start in batches of start_concurrency,
+# so the last one has started after ceil(live / start_concurrency) start delays
+def check(args, start_concurrency: int, longest_tick: float, latencies: list[float]):
+    failures: list[str] = []
+
+    if longest_tick > args.tick_bound:
+        failures.append(f"the longest tick took {longest_tick:.2f} s, more than {args.tick_bound:.2f} s")
+
+    bound = math.ceil(args.live / start_concurrency) * args.delay + args.slack
+    if latencies[-1] > bound:
+        failures.append(f"the last recorder started after {latencies[-1]:.2f} s, more than {bound:.2f} s")
+
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how long it takes to start recorders whose start blocks, when many users go live at the same time")
+    parser.add_argument("--live", metavar="N", type=int, default=10, help="Number of users going live at the same time (Default: 10)")
+    parser.add_argument("--delay", metavar="seconds", type=float, default=2, help="Time it takes to start a single recorder (Default: 2)")
+    parser.add_argument("--concurrency", metavar="N", type=str, default="0,4,16", help="Comma separated list of start concurrencies to compare, 0 starts the recorders on the main loop (Default: 0,4,16)")
+    parser.add_argument("--tick-bound", metavar="seconds", dest="tick_bound", type=float, default=0.5, help="Longest a tick may take with a start concurrency (Default: 0.5)")
+    parser.add_argument("--slack", metavar="seconds", type=float, default=1, help="Time the last start may take on top of the start delays (Default: 1)")
+    args = parser.parse_args()
+
+    print(f"{args.live} users going live at once, {args.delay:.1f} seconds to start each recorder")
+
+    failed = False
+    for concurrency in [ int(c) for c in args.concurrency.split(",") ]:
+        total, longest_tick, latencies = run(args, concurrency)
+
+        name = "inline" if concurrency == 0 else f"concurrency {concurrency}"
+        print(f"{name:<16} all started after {total:6.2f} s   longest tick {longest_tick:6.2f} s   start latency median {latencies[len(latencies) // 2]:6.2f} s   max {latencies[-1]:6.2f} s")
+
+        # inline starts are only measured for comparison, they block the main loop by design
+        if concurrency > 0:
+            for failure in check(args, concurrency, longest_tick, latencies):
+                print(f"  FAILED: {failure}")
+                failed = True
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import ffmpeg # type: ignore
+
+from lib.ts_index import TS_PACKET_SIZE, TS_SYNC_BYTE, get_index_path, index_timeline, read_index
+
+PROGRAM_TABLE_SCAN_SIZE = 1024 * 1024
+
+def parse_time(value: str):
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+# returns the PAT and PMT packets from the start of the recording, which have to be in front of the copied range,
+# so that ffmpeg knows which streams are in the file
+def read_program_tables(recording_file, size: int):
+    recording_file.seek(0)
+    data = recording_file.read(size)
+    tables = b""
+
+    for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if data[pos] != TS_SYNC_BYTE or not data[pos + 1] & 0x40:
+            continue
+
+        pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+        payload = pos + 4
+        if data[pos + 3] & 0x20: # skip the adaptation field
+            payload += 1 + data[pos + 4]
+        if payload >= pos + TS_PACKET_SIZE - 1:
+            continue
+
+        table_id = data[payload + 1 + data[payload]] if payload + 1 + data[payload] < pos + TS_PACKET_SIZE else None
+
+        if pid == 0 or table_id == 0x02:
+            tables += data[pos:pos + TS_PACKET_SIZE]
+
+    return tables
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cuts a clip out of a recording with the help of its keyframe index, without reading the file from the start")
+    parser.add_argument("recording", help="Path to the .ts recording")
+    parser.add_argument("start", help="Start of the clip in seconds or HH:MM:SS since the start of the recording")
+    parser.add_argument("end", help="End of the clip in seconds or HH:MM:SS since the start of the recording")
+    parser.add_argument("output", help="Path of the clip, the container is chosen by ffmpeg from the extension")
+    args = parser.parse_args()
+
+    start = parse_time(args.start)
+    end = parse_time(args.end)
+
+    if end <= start:
+        print("The end of the clip has to be after its start")
+        sys.exit(1)
+
+    index_path = get_index_path(args.recording)
+    if not os.path.exists(index_path):
+        print(f"{index_path} does not exist, only recordings made with indexing can be cut with this script")
+        sys.exit(1)
+
+    timeline = index_timeline(read_index(index_path))
+    if len(timeline) == 0:
+        print("The index does not contain any keyframes")
+        sys.exit(1)
+
+    # the clip starts at the last keyframe before the start, and the copied range ends at the first keyframe after the end
+    first_keyframe = max([ k for k in timeline if k[1] <= start ], key=lambda k: k[1], default=timeline[0])
+    after_end = [ k for k in timeline if k[1] > end ]
+    end_offset = after_end[0][0] if len(after_end) > 0 else os.path.getsize(args.recording)
+
+    print(f"Copying {(end_offset - first_keyframe[0]) / 1000**2:.1f} MB starting at keyframe {first_keyframe[1]:.2f}s")
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    with tempfile.NamedTemporaryFile(suffix=".ts", dir=output_dir, delete=False) as range_file:
+        range_path = range_file.name
+
+        with open(args.recording, "rb") as recording_file:
+            range_file.write(read_program_tables(recording_file, min(first_keyframe[0], PROGRAM_TABLE_SCAN_SIZE)))
+
+            recording_file.seek(first_keyframe[0])
+            remaining = end_offset - first_keyframe[0]
+
+            while remaining > 0:
+                chunk = recording_file.read(min(remaining, 4 * 1024 * 1024))
+                if not chunk:
+                    break
+                range_file.write(chunk)
+                remaining -= len(chunk)
+
+    try:
+        # only the edges are processed by ffmpeg, the clip is cut at the end and starts with the keyframe
+        ffmpeg.input(range_path).output(args.output, codec="copy", t=end - first_keyframe[1]).overwrite_output().run()
+    finally:
+        os.remove(range_path)
@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+from typing import Optional
+import logging
+
+from lib import metrics
+from lib.recorder_base import RecorderBase
+from lib.storage_mover import get_free_space
+from lib.username_definition import UsernameDefinition
+
+log = logging.getLogger(__file__)
+
+admission_decisions = metrics.REGISTRY.counter("admission_decisions_total", "Number of recordings that were admitted, queued or preempted by the admission control", ("decision", "reason"))
+admission_queued = metrics.REGISTRY.gauge("admission_queued_recordings", "Number of live users waiting for the admission control to let their recording start")
+admission_bitrate = metrics.REGISTRY.gauge("admission_bitrate_bits", "Estimated total bitrate of the admitted recordings at the last admission decision in bits per second")
+
+# the bitrate of a recording is only measured after this many seconds, before that the last known or the default bitrate is used
+MIN_BITRATE_DURATION = 30
+
+@dataclass
+class AdmissionDecision:
+    admitted: bool
+    reason: str # why the recording was queued, or why other recordings have to be preempted for it
+    preempt: list[str] = field(default_factory=list) # ids of the recordings that have to be stopped first
+
+# limits the number of concurrent recordings, their total bitrate and the disk space they leave free.
+# when a user with a higher priority goes live while the limits are reached, recordings with a lower priority are preempted
+# (the ones that started last first), otherwise the new recording has to wait until there is room for it
+class AdmissionController:
+    def __init__(
+        self,
+        max_recordings: Optional[int] = None,
+        max_bitrate: Optional[int] = None,
+        min_free_disk: int = 0,
+        default_bitrate: int = 6_000_000,
+        preempt: bool = True,
+        disk_path: Optional[str] = None,
+    ):
+        self.configure(max_recordings, max_bitrate, min_free_disk, default_bitrate, preempt)
+
+        self._disk_path = disk_path
+        self._known_bitrates: dict[str, float] = {} # last measured bitrate per user, used when they go live again
+
+    def configure(self, max_recordings: Optional[int], max_bitrate: Optional[int], min_free_disk: int, default_bitrate: int, preempt: bool):
+        self.max_recordings = max_recordings
+        self.max_bitrate = max_bitrate
+        self.min_free_disk = min_free_disk
+        self.default_bitrate = default_bitrate
+        self.preempt = preempt
+
+    def is_limited(self):
+        return self.max_recordings is not None or self.max_bitrate is not None or (self.min_free_disk > 0 and self._disk_path is not None)
+
+    def _get_bitrate(self, definition: UsernameDefinition, recorder: Optional[RecorderBase], now: float) -> float:
+        if recorder is not None:
+            bitrate = recorder.getBitrate(now, MIN_BITRATE_DURATION)
+            if bitrate is not None:
+                self._known_bitrates[definition.get_id()] = bitrate
+                return bitrate
+
+        return self._known_bitrates.get(definition.get_id(), self.default_bitrate)
+
+    # active contains the definitions and recorders of all admitted recordings, in the order they were started
+    def decide(self, candidate: UsernameDefinition, active: list[tuple[UsernameDefinition, Optional[RecorderBase]]], now: float) -> AdmissionDecision:
+        if not self.is_limited():
+            return AdmissionDecision(True, "unlimited")
+
+        if self.min_free_disk > 0 and self._disk_path is not None and get_free_space(self._disk_path) < self.min_free_disk:
+            # stopping other recordings wouldn't give back any space
+            return AdmissionDecision(False, "disk")
+
+        bitrates = { definition.get_id(): self._get_bitrate(definition, recorder, now) for definition, recorder in active }
+        total_bitrate = sum(bitrates.values())
+        admission_bitrate.set(total_bitrate)
+
+        recordings = len(active) + 1
+        bitrate = total_bitrate + self._get_bitrate(candidate, None, now)
+
+        def exceeded_limit():
+            if self.max_recordings is not None and recordings > self.max_recordings:
+                return "recordings"
+            if self.max_bitrate is not None and bitrate > self.max_bitrate:
+                return "bitrate"
+            return None
+
+        reason = exceeded_limit()
+        if reason is None:
+            return AdmissionDecision(True, "capacity")
+
+        if not self.preempt:
+            return AdmissionDecision(False, reason)
+
+        # sorted() is stable, so the most recently started recordings of the same priority come first
+        preemptible = sorted(
+            [ definition for definition, _ in reversed(active) if definition.priority < candidate.priority ],
+            key=lambda definition: definition.priority,
+        )
+        preempt: list[str] = []
+
+        for definition in preemptible:
+            preempt.append(definition.get_id())
+            recordings -= 1
+            bitrate -= bitrates[definition.get_id()]
+
+            if exceeded_limit() is None:
+                return AdmissionDecision(True, reason, preempt)
+
+        return AdmissionDecision(False, reason)
+
+    # forgets the bitrate of a user who is no longer watched
+    def forget(self, username_id: str):
+        self._known_bitrates.pop(username_id, None)
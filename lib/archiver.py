@@ -0,0 +1,301 @@
+from threading import Event, Thread
+from typing import Callable, Iterable, Optional
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import ffmpeg # type: ignore
+
+from lib import metrics
+from lib.recorder_base import RecorderBase
+from lib.ts_index import get_index_path
+
+log = logging.getLogger(__file__)
+
+archive_pending = metrics.REGISTRY.gauge("archive_pending_recordings", "Number of recordings old enough to be archived that haven't been transcoded yet")
+archive_transcodes = metrics.REGISTRY.counter("archive_transcodes_total", "Number of recordings the archiver has processed", ("result",))
+archive_saved_bytes = metrics.REGISTRY.counter("archive_saved_bytes_total", "Disk space freed by replacing recordings with their archived version")
+archive_paused = metrics.REGISTRY.gauge("archive_paused", "1 while the running transcode is paused because recordings are active")
+
+ARCHIVE_SUFFIX = ".archive.mp4"
+SOURCE_EXTENSIONS = (".ts", ".mp4")
+
+class TranscodeInterrupted(Exception):
+    pass
+
+def get_archive_path(recording_path: str):
+    return os.path.splitext(recording_path)[0] + ARCHIVE_SUFFIX
+
+def get_duration(path: str) -> float:
+    return float(ffmpeg.probe(path)["format"]["duration"])
+
+# lowers the scheduling priority of the transcode by niceness and limits it to the last max_cores cores, so the recorders always get the cpu first.
+# this is applied to the already running process instead of in preexec_fn, which isn't safe in our multithreaded process.
+# ffmpeg only starts its worker threads once it has opened the input, and those inherit both from its main thread
+def _limit_cpu(pid: int, niceness: int, max_cores: int):
+    try:
+        niceness = min(os.getpriority(os.PRIO_PROCESS, 0) + niceness, 19)
+        os.setpriority(os.PRIO_PROCESS, pid, niceness)
+    except OSError as e:
+        log.warning(f"Could not lower the priority of the archival transcode: {repr(e)}")
+
+    if hasattr(os, "sched_setaffinity"): # linux only
+        try:
+            cores = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(pid, cores[-max_cores:])
+        except OSError as e:
+            log.warning(f"Could not limit the archival transcode to {max_cores} core(s): {repr(e)}")
+
+# transcodes finished recordings older than after_days to a smaller codec in the background.
+# a transcode only starts while no recording is active, and is paused as soon as one starts.
+# the source is only replaced once the duration of the archived file matches it
+class Archiver(Thread):
+    def __init__(
+        self,
+        output_path: str,
+        get_recorders: Callable[[], Iterable[RecorderBase]],
+        after_days: float,
+        video_codec: str,
+        crf: int,
+        preset: str,
+        audio_codec: str,
+        audio_bitrate: str,
+        niceness: int,
+        max_cores: int,
+        duration_tolerance: float,
+        scan_interval: int,
+    ):
+        super().__init__(name="archiver")
+        self.daemon = True
+
+        self._output_path = os.path.abspath(output_path)
+        self._get_recorders = get_recorders
+        self._after_days = after_days
+        self._video_codec = video_codec
+        self._crf = crf
+        self._preset = preset
+        self._audio_codec = audio_codec
+        self._audio_bitrate = audio_bitrate
+        self._niceness = niceness
+        self._max_cores = max_cores
+        self._duration_tolerance = duration_tolerance
+        self._scan_interval = scan_interval
+
+        self._failed: set[str] = set() # recordings that couldn't be archived are not retried until the next restart
+        self._process: Optional[subprocess.Popen] = None
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._archive_pending()
+            except Exception as e:
+                log.error(f"Error in archiver: {repr(e)}")
+
+            self._stop_event.wait(self._scan_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+        process = self._process
+        if process is not None:
+            process.kill()
+
+    def _recordings_active(self):
+        return any(recorder.isRecording() for recorder in self._get_recorders())
+
+    def _find_candidates(self) -> list[str]:
+        cutoff = time.time() - self._after_days * 24 * 3600
+        candidates: list[str] = []
+
+        for dirpath, _, filenames in os.walk(self._output_path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+
+                if not filename.endswith(SOURCE_EXTENSIONS) or filename.endswith(ARCHIVE_SUFFIX) or path in self._failed:
+                    continue
+
+                # the upload of this recording hasn't been completed yet
+                if any(f.startswith(filename + ".s3-") for f in filenames):
+                    continue
+
+                if os.path.getmtime(path) < cutoff:
+                    candidates.append(path)
+
+        return sorted(candidates, key=os.path.getmtime)
+
+    def _archive_pending(self):
+        candidates = self._find_candidates()
+        archive_pending.set(len(candidates))
+
+        if len(candidates) == 0:
+            return
+
+        archived = 0
+        saved = 0
+
+        for i, path in enumerate(candidates):
+            if not self._wait_for_idle():
+                break
+
+            if not os.path.exists(path):
+                continue
+
+            try:
+                result = self._archive_recording(path)
+            except TranscodeInterrupted:
+                break # the remaining recordings are picked up again by the next scan
+            except Exception as e:
+                log.error(f"Error while archiving {path}: {repr(e)}")
+                result = None
+
+            if result is None:
+                self._failed.add(path)
+                archive_transcodes.inc(labels=("failed",))
+            else:
+                archived += 1
+                saved += result
+                archive_saved_bytes.inc(result)
+                archive_transcodes.inc(labels=("archived",))
+
+            archive_pending.set(len(candidates) - i - 1)
+
+        if archived > 0:
+            log.info(f"Archived {archived} of {len(candidates)} recording(s), saving {saved / 1000**3:.2f} GB in total")
+
+    # returns False if the archiver has been stopped while waiting
+    def _wait_for_idle(self):
+        while self._recordings_active():
+            if self._stop_event.wait(10):
+                return False
+
+        return not self._stop_event.is_set()
+
+    # returns the number of bytes saved, or None if the recording was kept as it is
+    def _archive_recording(self, path: str) -> Optional[int]:
+        archive_path = get_archive_path(path)
+        source_size = os.path.getsize(path)
+        source_duration = get_duration(path)
+
+        # another copy of the same recording (e.g. the .ts next to the .mp4 from the remux plugin) has already been archived
+        if os.path.exists(archive_path):
+            return self._replace_source(path, archive_path, source_duration, source_size, 0)
+
+        partial_path = archive_path + ".partial"
+        stream = ffmpeg.input(path).output(
+            partial_path,
+            format="mp4",
+            vcodec=self._video_codec,
+            crf=self._crf,
+            preset=self._preset,
+            acodec=self._audio_codec,
+            audio_bitrate=self._audio_bitrate,
+            threads=self._max_cores,
+            movflags="faststart",
+        ).global_args("-nostats", "-loglevel", "error")
+
+        log.info(f"Archiving {path} ({source_size / 1000**3:.2f} GB, {source_duration / 3600:.1f} hours)")
+
+        try:
+            self._transcode([ str(arg) for arg in ffmpeg.compile(stream, overwrite_output=True) ])
+        except Exception:
+            if os.path.exists(partial_path):
+                os.unlink(partial_path)
+            raise
+
+        # already efficiently encoded sources can end up larger with the archive settings
+        archive_size = os.path.getsize(partial_path)
+        if archive_size >= source_size:
+            log.warning(f"The archived version of {path} is {archive_size / 1000**3:.2f} GB instead of {source_size / 1000**3:.2f} GB, keeping the original")
+            os.unlink(partial_path)
+            return None
+
+        os.replace(partial_path, archive_path)
+
+        return self._replace_source(path, archive_path, source_duration, source_size, archive_size)
+
+    def _replace_source(self, path: str, archive_path: str, source_duration: float, source_size: int, archive_size: int) -> Optional[int]:
+        archive_duration = get_duration(archive_path)
+
+        if abs(archive_duration - source_duration) > self._duration_tolerance:
+            log.warning(f"The archived version of {path} is {archive_duration:.1f}s long instead of {source_duration:.1f}s, keeping the original")
+
+            if archive_size > 0: # only remove it if we have just created it
+                os.unlink(archive_path)
+            return None
+
+        os.unlink(path)
+
+        index_path = get_index_path(path)
+        if os.path.exists(index_path):
+            os.unlink(index_path)
+
+        saved = source_size - archive_size
+        log.info(f"Replaced {path} with {archive_path}, saving {saved / 1000**3:.2f} GB ({source_size / 1000**3:.2f} GB -> {archive_size / 1000**3:.2f} GB)")
+
+        return saved
+
+    # runs ffmpeg under the cpu limits and pauses it while recordings are active
+    def _transcode(self, args: list[str]):
+        if sys.platform == "win32":
+            self._process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, creationflags=subprocess.IDLE_PRIORITY_CLASS)
+        else:
+            self._process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            _limit_cpu(self._process.pid, self._niceness, self._max_cores)
+
+        process = self._process
+        paused = False
+        interrupted = False
+
+        # ffmpeg writes its progress to stderr, which has to be drained so it doesn't block
+        stderr_tail: list[bytes] = []
+        def read_stderr():
+            assert process.stderr is not None
+            for line in process.stderr:
+                stderr_tail.append(line)
+                del stderr_tail[:-20]
+        stderr_reader = Thread(target=read_stderr, name="archiver-stderr", daemon=True)
+        stderr_reader.start()
+
+        try:
+            while process.poll() is None:
+                if self._stop_event.wait(1):
+                    process.kill()
+                    interrupted = True
+                    break
+
+                active = self._recordings_active()
+
+                if active and not paused:
+                    if not hasattr(signal, "SIGSTOP"): # not available on windows, start over once the recordings are done
+                        log.info("Recordings are active, aborting the archival transcode until they are done")
+                        process.kill()
+                        interrupted = True
+                        break
+
+                    log.info("Recordings are active, pausing the archival transcode")
+                    process.send_signal(signal.SIGSTOP)
+                    paused = True
+                    archive_paused.set(1)
+                elif not active and paused:
+                    log.info("No recordings are active anymore, resuming the archival transcode")
+                    process.send_signal(signal.SIGCONT)
+                    paused = False
+                    archive_paused.set(0)
+
+            process.wait()
+        finally:
+            if paused:
+                archive_paused.set(0)
+            self._process = None
+
+        stderr_reader.join()
+
+        if interrupted:
+            raise TranscodeInterrupted()
+
+        if process.returncode != 0:
+            raise Exception(f"ffmpeg exited with code {process.returncode}: {b''.join(stderr_tail).decode('utf-8', 'replace').strip()}")
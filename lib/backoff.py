@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from typing import Callable
+import logging
+import random
+
+from lib import metrics
+
+log = logging.getLogger(__file__)
+
+recorder_start_failures = metrics.REGISTRY.counter("recorder_start_failures_total", "Number of recorders that stopped with an error before recording anything", ("service", "username", "reason"))
+recorder_start_backoff = metrics.REGISTRY.gauge("recorder_start_backoff_seconds", "Delay before the next start attempt of a user whose recorder failed to start", ("service", "username", "reason"))
+
+@dataclass
+class _FailureStreak:
+    count: int
+    retry_time: float
+
+# remembers which users failed to start recording, so a stream that can't be recorded (e.g. because the quality is missing)
+# isn't resolved again on every tick. the delay doubles with every failure of the same reason, and every reason has its own streak,
+# so e.g. a single resolution error doesn't make the wait for a hosted stream longer
+class StartBackoff:
+    def __init__(self, initial: float = 30, maximum: float = 3600, jitter: float = 0.2, random: Callable[[], float] = random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+
+        self._random = random
+        self._failures: dict[tuple[str, str], dict[str, _FailureStreak]] = {} # (service, username) -> reason -> streak
+
+    def configure(self, initial: float, maximum: float, jitter: float):
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+
+    def record_failure(self, labels: tuple[str, str], reason: str, now: float) -> float:
+        streaks = self._failures.setdefault(labels, {})
+        streak = streaks.setdefault(reason, _FailureStreak(0, now))
+        streak.count += 1
+
+        delay = min(self.initial * 2 ** (streak.count - 1), self.maximum)
+        delay *= 1 + self.jitter * (2 * self._random() - 1) # spread out the retries of users that failed at the same time
+        streak.retry_time = now + delay
+
+        recorder_start_failures.inc(labels=(*labels, reason))
+        recorder_start_backoff.set(delay, (*labels, reason))
+        log.warning(f"Recorder for {labels[0]} user {labels[1]} failed to start ({reason}, {streak.count} times in a row), retrying in {delay:.0f} seconds")
+
+        return delay
+
+    def record_success(self, labels: tuple[str, str]):
+        if labels in self._failures:
+            log.info(f"Recorder for {labels[0]} user {labels[1]} started successfully after {sum(s.count for s in self._failures[labels].values())} failed attempts")
+        self.reset(labels)
+
+    # forgets the failures of a user, e.g. because the stream has ended and the next one might work again
+    def reset(self, labels: tuple[str, str]):
+        streaks = self._failures.pop(labels, None)
+
+        if streaks is not None:
+            for reason in streaks:
+                recorder_start_backoff.remove((*labels, reason))
+
+    def can_start(self, labels: tuple[str, str], now: float):
+        streaks = self._failures.get(labels)
+        return streaks is None or all(now >= s.retry_time for s in streaks.values())
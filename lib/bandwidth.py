@@ -0,0 +1,225 @@
+from threading import Lock
+from typing import Literal, Optional
+import time
+
+from lib import metrics
+
+Priority = Literal["live", "bulk"]
+
+bandwidth_limit = metrics.REGISTRY.gauge("bandwidth_limit_bytes", "Configured bandwidth limit shared by all recorders and background transfers in bytes per second")
+bandwidth_allocation = metrics.REGISTRY.gauge("bandwidth_allocation_bytes", "Bandwidth currently allocated to a recorder or background transfer in bytes per second", ("client", "priority"))
+bandwidth_throttled = metrics.REGISTRY.counter("bandwidth_throttled_seconds_total", "Time recorders and background transfers spent waiting for bandwidth", ("priority",))
+
+# live clients that don't use their allocation get a bit more than they currently use, so they can grow quickly
+DEMAND_HEADROOM = 1.2
+# every live client gets at least this much, so a new recorder can start before its demand is known
+MIN_LIVE_ALLOCATION = 64 * 1024
+
+class BandwidthClient:
+    def __init__(self, manager: "BandwidthManager", name: str, priority: Priority, weight: float, shaped: bool, max_rate: Optional[int]):
+        self.name = name
+        self.priority: Priority = priority
+        self.weight = weight
+        self.shaped = shaped
+        self.max_rate = max_rate
+
+        self._manager = manager
+
+        # these are only touched while holding the lock of the manager
+        self.allocation = 0.0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.window_bytes = 0
+        self.window_throttled = False
+
+    # blocks until the client is allowed to transfer the given amount of bytes.
+    # bigger transfers than the bucket allows are fine, the client just has to wait until the debt is paid off afterwards
+    def consume(self, amount: int):
+        if self._manager.limit is None and self.max_rate is None:
+            return
+
+        self._manager._consume(self, amount)
+
+    # accounts for bytes that were transferred without waiting, for clients that can't be throttled
+    def record(self, amount: int):
+        if self._manager.limit is None:
+            return
+
+        self._manager._record(self, amount)
+
+    def close(self):
+        self._manager._unregister(self)
+
+# a process wide token bucket, which is split between the live recorders and the background transfers.
+# the live recorders always get the bandwidth they need first (weighted by their priority if there isn't enough for all of them),
+# and the background transfers share whatever is left.
+# unshaped clients are never throttled, their measured rate is just taken from the budget before it is split
+class BandwidthManager:
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self._burst = 1.0
+        self._weights: dict[str, float] = {}
+        self._reallocate_interval = 1.0
+
+        self._lock = Lock()
+        self._clients: list[BandwidthClient] = []
+        self._last_reallocation = 0.0
+
+    def configure(self, limit: Optional[int], burst: float = 1.0, weights: dict[str, float] = {}):
+        with self._lock:
+            self.limit = limit
+            self._burst = burst
+            self._weights = dict(weights)
+
+            for client in self._clients:
+                client.weight = self._weights.get(client.name, 1.0)
+
+            self._last_reallocation = 0.0 # reallocate on the next transfer
+
+        bandwidth_limit.set(limit or 0)
+
+    # the weight is looked up from the configured weights by name, which is "<service>=<username>" for recorders.
+    # max_rate caps the client even without a total limit
+    def register(self, name: str, priority: Priority, shaped: bool = True, max_rate: Optional[int] = None) -> BandwidthClient:
+        with self._lock:
+            client = BandwidthClient(self, name, priority, self._weights.get(name, 1.0), shaped, max_rate)
+            self._clients.append(client)
+            self._last_reallocation = 0.0
+
+        return client
+
+    def _unregister(self, client: BandwidthClient):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+                self._last_reallocation = 0.0
+
+            bandwidth_allocation.remove((client.name, client.priority))
+
+    def get_allocations(self) -> dict[str, tuple[Priority, float]]:
+        with self._lock:
+            return { client.name: (client.priority, client.allocation) for client in self._clients }
+
+    def _record(self, client: BandwidthClient, amount: int):
+        with self._lock:
+            now = time.monotonic()
+
+            if self.limit is None:
+                return
+
+            if now - self._last_reallocation >= self._reallocate_interval:
+                self._reallocate(now)
+
+            client.window_bytes += amount
+
+    def _consume(self, client: BandwidthClient, amount: int):
+        wait_time = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if self.limit is None and client.max_rate is None:
+                    return
+
+                if now - self._last_reallocation >= self._reallocate_interval:
+                    self._reallocate(now)
+
+                client.tokens = min(client.tokens + (now - client.last_refill) * client.allocation, client.allocation * self._burst)
+                client.last_refill = now
+
+                # the transfer is taken as soon as the bucket isn't in debt anymore, and paid off afterwards
+                if amount > 0 and client.tokens >= 0:
+                    client.tokens -= amount
+                    client.window_bytes += amount
+                    amount = 0
+
+                if amount == 0 and client.tokens >= 0:
+                    break
+
+                client.window_throttled = True
+
+                # wait until the debt is paid off, but check again after the next reallocation at the latest
+                delay = self._reallocate_interval
+                if client.allocation > 0:
+                    delay = min(delay, -client.tokens / client.allocation)
+
+            time.sleep(delay)
+            wait_time += delay
+
+        if wait_time > 0:
+            bandwidth_throttled.inc(wait_time, (client.priority,))
+
+    # has to be called while holding the lock
+    def _reallocate(self, now: float):
+        elapsed = max(now - self._last_reallocation, 1e-3) if self._last_reallocation > 0 else None
+        self._last_reallocation = now
+
+        if self.limit is None:
+            # only the clients with their own cap are throttled at all
+            for client in self._clients:
+                client.allocation = float(client.max_rate or 0)
+                client.window_bytes = 0
+                client.window_throttled = False
+                bandwidth_allocation.set(client.allocation, (client.name, client.priority))
+            return
+
+        demands: dict[BandwidthClient, float] = {}
+        for client in self._clients:
+            if not client.shaped:
+                demands[client] = client.window_bytes / elapsed if elapsed is not None else 0
+            elif elapsed is None or client.window_throttled:
+                demands[client] = float("inf") # takes as much as it can get
+            elif client.priority == "bulk":
+                demands[client] = float("inf") if client.window_bytes > 0 else 0 # idle background transfers don't need anything
+            else:
+                demands[client] = max(client.window_bytes / elapsed * DEMAND_HEADROOM, MIN_LIVE_ALLOCATION)
+
+            if client.max_rate is not None:
+                demands[client] = min(demands[client], client.max_rate)
+
+            client.window_bytes = 0
+            client.window_throttled = False
+
+        remaining = float(self.limit)
+
+        for client in self._clients:
+            if not client.shaped:
+                client.allocation = demands[client]
+                remaining -= demands[client]
+
+        for priority in ("live", "bulk"):
+            clients = [ c for c in self._clients if c.priority == priority and c.shaped ]
+            remaining -= _share(clients, demands, max(remaining, 0))
+
+        for client in self._clients:
+            bandwidth_allocation.set(client.allocation, (client.name, client.priority))
+
+# weighted max-min fair share: clients that need less than their share get what they need, and the rest is split between the others.
+# sets the allocation of every client and returns the total amount that was handed out
+def _share(clients: list[BandwidthClient], demands: dict[BandwidthClient, float], available: float):
+    unsatisfied = list(clients)
+    total = 0.0
+
+    for client in clients:
+        client.allocation = 0.0
+
+    while len(unsatisfied) > 0 and available > 1:
+        total_weight = sum(c.weight for c in unsatisfied)
+        satisfied = [ c for c in unsatisfied if demands[c] <= available * c.weight / total_weight ]
+
+        if len(satisfied) == 0:
+            for client in unsatisfied:
+                client.allocation = available * client.weight / total_weight
+            total += available
+            break
+
+        for client in satisfied:
+            client.allocation = demands[client]
+            available -= demands[client]
+            total += demands[client]
+            unsatisfied.remove(client)
+
+    return total
+
+MANAGER = BandwidthManager()
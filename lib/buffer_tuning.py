@@ -0,0 +1,165 @@
+from collections import deque
+from threading import Lock
+from typing import Callable
+import logging
+import math
+import time
+
+from lib import metrics
+
+log = logging.getLogger(__file__)
+
+buffer_tuning_budget = metrics.REGISTRY.gauge("buffer_tuning_budget_bytes", "Memory budget shared by the ring buffers of all recorders")
+recorder_ringbuffer_size = metrics.REGISTRY.gauge("recorder_ringbuffer_bytes", "Size of the ring buffer of a recorder", ("service", "username"))
+recorder_ingest_burst = metrics.REGISTRY.gauge("recorder_ingest_burst_factor", "Highest ingest rate of a recorder over one second divided by its average rate", ("service", "username"))
+
+SAMPLE_INTERVAL = 1.0 # seconds
+WINDOW = 60 # samples the bitrate and the burstiness are measured over
+MIN_SAMPLES = 10 # the buffer isn't changed before the bitrate has been measured for this many seconds
+RESIZE_THRESHOLD = 0.25 # buffers are only resized if their size changes by more than this fraction, so they don't change on every sample
+SEGMENT_THREAD_BITRATE = 4_000_000 # bits per second, one segment thread per this much bitrate
+
+class TunedStream:
+    def __init__(self, tuner: "BufferTuner", name: str, buffer_size: int, resize: Callable[[int], None]):
+        self.name = name
+        self.buffer_size = buffer_size
+
+        self._tuner = tuner
+        self._resize = resize
+
+        # these are only touched while holding the lock of the tuner
+        self.desired_size = buffer_size
+        self.rates: deque[float] = deque(maxlen=WINDOW)
+
+        self._last_sample = time.monotonic()
+        self._last_bytes = 0
+
+    # called from the read loop of the recorder with the total number of bytes it has read, only does any work once per sample interval
+    def sample(self, bytes_read: int):
+        now = time.monotonic()
+        if now - self._last_sample < SAMPLE_INTERVAL:
+            return
+
+        rate = (bytes_read - self._last_bytes) / (now - self._last_sample)
+        self._last_sample = now
+        self._last_bytes = bytes_read
+
+        self._tuner._add_sample(self, rate)
+
+    def apply(self, size: int):
+        try:
+            self._resize(size)
+        except Exception as e:
+            log.error(f"Could not resize the ring buffer of {self.name}: {repr(e)}")
+            return
+
+        self.buffer_size = size
+
+    def close(self):
+        self._tuner._unregister(self)
+
+# sizes the streamlink ring buffer of every recorder to hold buffer_seconds of its measured bitrate, scaled up by how bursty the
+# stream arrives. the buffers of all recorders share one memory budget, and are scaled down evenly when they wouldn't fit.
+# the ring buffer can be resized while recording, the number of segment threads is only applied when a recorder (re)starts
+class BufferTuner:
+    def __init__(self):
+        self.enabled = False
+        self._memory_budget = 256 * 1024 * 1024
+        self._buffer_seconds = 10.0
+        self._min_buffer = 2 * 1024 * 1024
+        self._max_buffer = 64 * 1024 * 1024
+        self._max_segment_threads = 4
+
+        self._lock = Lock()
+        self._streams: list[TunedStream] = []
+        self._known: dict[str, tuple[float, float]] = {} # last measured bitrate in bytes per second and burst factor per "<service>=<username>"
+
+    def configure(self, enabled: bool, memory_budget: int, buffer_seconds: float, min_buffer: int, max_buffer: int, max_segment_threads: int):
+        with self._lock:
+            self.enabled = enabled
+            self._memory_budget = memory_budget
+            self._buffer_seconds = buffer_seconds
+            self._min_buffer = min_buffer
+            self._max_buffer = max_buffer
+            self._max_segment_threads = max_segment_threads
+
+        buffer_tuning_budget.set(memory_budget if enabled else 0)
+
+    def _desired_size(self, rate: float, burst: float):
+        return int(min(max(rate * self._buffer_seconds * burst, self._min_buffer), self._max_buffer))
+
+    # returns the ring buffer size and the number of segment threads a new recorder should start with
+    def get_settings(self, name: str) -> tuple[int, int]:
+        with self._lock:
+            known = self._known.get(name)
+
+            if known is None:
+                # nothing is known about this stream yet, assume a typical 6 Mbit/s stream until it has been measured
+                rate, burst = 750_000.0, 1.5
+            else:
+                rate, burst = known
+
+            desired = self._desired_size(rate, burst)
+            used = sum(s.buffer_size for s in self._streams)
+            buffer_size = max(min(desired, self._memory_budget - used), self._min_buffer)
+            segment_threads = max(1, min(self._max_segment_threads, math.ceil(rate * 8 / SEGMENT_THREAD_BITRATE)))
+
+        return buffer_size, segment_threads
+
+    def register(self, name: str, buffer_size: int, resize: Callable[[int], None]) -> TunedStream:
+        stream = TunedStream(self, name, buffer_size, resize)
+
+        with self._lock:
+            self._streams.append(stream)
+
+        recorder_ringbuffer_size.set(buffer_size, tuple(name.split("=", 1)))
+        return stream
+
+    def _unregister(self, stream: TunedStream):
+        with self._lock:
+            if stream in self._streams:
+                self._streams.remove(stream)
+
+        labels = tuple(stream.name.split("=", 1))
+        recorder_ringbuffer_size.remove(labels)
+        recorder_ingest_burst.remove(labels)
+
+    def _add_sample(self, stream: TunedStream, rate: float):
+        resizes: list[tuple[TunedStream, int]] = []
+
+        with self._lock:
+            stream.rates.append(rate)
+
+            if len(stream.rates) < MIN_SAMPLES or not self.enabled:
+                return
+
+            mean = sum(stream.rates) / len(stream.rates)
+            if mean <= 0:
+                return
+
+            burst = max(stream.rates) / mean
+            self._known[stream.name] = (mean, burst)
+            stream.desired_size = self._desired_size(mean, burst)
+            recorder_ingest_burst.set(burst, tuple(stream.name.split("=", 1)))
+
+            # scale all buffers down evenly if they don't fit into the budget together, but never below the minimum
+            total = sum(s.desired_size for s in self._streams)
+            scale = min(1.0, self._memory_budget / total) if total > 0 else 1.0
+
+            for s in self._streams:
+                size = max(int(s.desired_size * scale), self._min_buffer)
+
+                if abs(size - s.buffer_size) > s.buffer_size * RESIZE_THRESHOLD:
+                    resizes.append((s, size))
+
+        # the resizes lock the buffers, so they are applied outside of our own lock
+        for s, size in resizes:
+            if s is stream:
+                log.info(f"Resizing the ring buffer of {s.name} from {s.buffer_size / 1024**2:.1f} MiB to {size / 1024**2:.1f} MiB (measured {mean * 8 / 1000**2:.2f} Mbit/s with a burst factor of {burst:.2f})")
+            else:
+                log.info(f"Resizing the ring buffer of {s.name} from {s.buffer_size / 1024**2:.1f} MiB to {size / 1024**2:.1f} MiB to fit the memory budget")
+
+            s.apply(size)
+            recorder_ringbuffer_size.set(size, tuple(s.name.split("=", 1)))
+
+TUNER = BufferTuner()
@@ -1,28 +1,161 @@
-from typing import Optional
+from typing import Literal, Optional
 from deepmerge.merger import Merger
 from pydantic import BaseModel
-from pydantic import field_validator
+from pydantic import model_validator
+
+from lib.s3 import MIN_PART_SIZE
 
 class TwitchConfig(BaseModel):
     clientid: str
     secret: str
+    stream_url: str = "https://twitch.tv/{username}"
+    api_base_url: Optional[str] = None
+    auth_base_url: Optional[str] = None
+
+class VRCDNConfig(BaseModel):
+    stream_url: str = "https://stream.vrcdn.live/live/{username}.live.ts"
+
+class TieredStorageConfig(BaseModel):
+    scratch_path: Optional[str] = None
+    bandwidth_limit: Optional[int] = None # bytes per second
+    min_scratch_free: int = 0 # bytes
+    move_delay: int = 0 # seconds
+
+class SinkConfig(BaseModel):
+    type: Literal["pipe", "http", "s3"]
+    command: Optional[str] = None # for pipe sinks, {service} and {username} are replaced
+    url: Optional[str] = None # for http sinks, {service} and {username} are replaced. the endpoint for s3 sinks
+    services: Optional[list[str]] = None # only use the sink for recordings of these services
+    max_buffer: int = 16 * 1024 * 1024 # bytes
+    overflow: Literal["drop", "disconnect"] = "drop"
+    bucket: Optional[str] = None # for s3 sinks
+    key: str = "{service}/{username}/{filename}" # for s3 sinks, {service}, {username} and {filename} are replaced
+    region: str = "us-east-1"
+    access_key: Optional[str] = None
+    secret_key: Optional[str] = None
+    part_size: int = 16 * 1024 * 1024 # bytes
+    upload_concurrency: int = 4
+
+    @model_validator(mode="after")
+    def validate_target(self):
+        if self.type == "pipe" and not self.command:
+            raise ValueError("Pipe sinks need a 'command'.")
+        if self.type == "http" and not self.url:
+            raise ValueError("HTTP sinks need a 'url'.")
+        if self.type == "s3":
+            if not self.url or not self.bucket or not self.access_key or not self.secret_key:
+                raise ValueError("S3 sinks need a 'url', 'bucket', 'access_key' and 'secret_key'.")
+            if self.part_size < MIN_PART_SIZE:
+                raise ValueError("The 'part_size' of S3 sinks must be at least 5 MiB.")
+            if self.upload_concurrency < 1:
+                raise ValueError("The 'upload_concurrency' of S3 sinks must be at least 1.")
+        return self
+
+class BandwidthConfig(BaseModel):
+    limit: Optional[int] = None # bytes per second
+    burst: float = 1.0 # seconds
+    weights: dict[str, float] = {} # "<service>=<username>" -> weight
+
+class StartBackoffConfig(BaseModel):
+    initial: float = 30 # seconds
+    maximum: float = 3600 # seconds
+    jitter: float = 0.2 # fraction of the delay
+
+class AdmissionConfig(BaseModel):
+    max_recordings: Optional[int] = None
+    max_bitrate: Optional[int] = None # bits per second, the sum of the bitrates of all recordings
+    min_free_disk: int = 0 # bytes, on the drive the recordings are written to
+    default_bitrate: int = 6_000_000 # bits per second, used for users whose bitrate hasn't been measured yet
+    preempt: bool = True
+    priorities: dict[str, int] = {} # "<service>=<username>" -> priority, 0 by default
+
+class BufferTuningConfig(BaseModel):
+    enabled: bool = False
+    memory_budget: int = 256 * 1024 * 1024 # bytes, shared by the ring buffers of all recorders
+    buffer_seconds: float = 10 # seconds of the measured bitrate a ring buffer should hold
+    min_buffer: int = 2 * 1024 * 1024 # bytes
+    max_buffer: int = 64 * 1024 * 1024 # bytes
+    max_segment_threads: int = 4
+
+    @model_validator(mode="after")
+    def validate_buffers(self):
+        if self.min_buffer > self.max_buffer:
+            raise ValueError("The 'buffer_tuning.min_buffer' field can not be larger than 'buffer_tuning.max_buffer'.")
+        if self.max_segment_threads < 1:
+            raise ValueError("The 'buffer_tuning.max_segment_threads' field must be at least 1.")
+        return self
+
+class ArchiveConfig(BaseModel):
+    after_days: Optional[float] = None # recordings are only archived when this is set
+    video_codec: str = "libx265"
+    crf: int = 28
+    preset: str = "medium"
+    audio_codec: str = "aac"
+    audio_bitrate: str = "128k"
+    niceness: int = 19
+    max_cores: int = 1
+    duration_tolerance: float = 1.0 # seconds
+    scan_interval: int = 3600 # seconds
+
+    @model_validator(mode="after")
+    def validate_cores(self):
+        if self.max_cores < 1:
+            raise ValueError("The 'archive.max_cores' field must be at least 1.")
+        return self
+
+class ShardingConfig(BaseModel):
+    role: Literal["standalone", "coordinator", "worker"] = "standalone"
+    address: str = "127.0.0.1:7300"
+    authkey: Optional[str] = None
+    placement: Literal["least_loaded", "hash"] = "least_loaded"
+    worker_name: Optional[str] = None
+    heartbeat_timeout: int = 10
+
+    @model_validator(mode="after")
+    def validate_authkey(self):
+        # the connection between coordinator and workers uses pickle, so it must never be unauthenticated
+        if self.role != "standalone" and not self.authkey:
+            raise ValueError("The 'sharding.authkey' field must be set when running as coordinator or worker.")
+        return self
 
 class Config(BaseModel):
     twitch: Optional[TwitchConfig]
+    vrcdn: VRCDNConfig
     output_path: str
+    tiered_storage: TieredStorageConfig
     streamers: list[str]
     update_interval: int
     update_end_interval: int
     stream_end_timeout: int
+    stall_timeout: int
+    start_concurrency: int
+    health_check_interval: int
     streamlink_options: list[str]
+    sinks: list[SinkConfig]
     plugins: dict[str, dict]
+    metrics_port: Optional[int]
+    recording_server_port: Optional[int]
+    recording_server_address: str
+    profile_duration: int
+    sharding: ShardingConfig
+    bandwidth: BandwidthConfig
+    start_backoff: StartBackoffConfig
+    admission: AdmissionConfig
+    buffer_tuning: BufferTuningConfig
+    archive: ArchiveConfig
+    trace_path: Optional[str]
+    watch_config: bool
 
-    @field_validator("streamers", mode="after")
-    @classmethod
-    def validate_streamers(cls, v):
-        if len(v) == 0:
+    # recordings are written to the scratch path if there is one and then moved to the output path when they are finished
+    def get_recording_path(self):
+        return self.tiered_storage.scratch_path or self.output_path
+
+    @model_validator(mode="after")
+    def validate_streamers(self):
+        # workers get their streams assigned by the coordinator
+        if len(self.streamers) == 0 and self.sharding.role != "worker":
             raise ValueError("The 'streamers' field must have at least one entry.")
-        return v
+        return self
 
 ConfigMerger = Merger(
     [
@@ -35,15 +168,36 @@ ConfigMerger = Merger(
 )
 
 DefaultConfigDict = {
+    "vrcdn": {},
     "output_path": "./recordings",
+    "tiered_storage": {},
     "streamers": [],
     "update_interval": 120,
     "update_end_interval": 10,
     "stream_end_timeout": 0,
+    "stall_timeout": 60,
+    "start_concurrency": 4,
+    "health_check_interval": 0,
     "streamlink_options": [],
+    "sinks": [],
     "plugins": {},
+    "metrics_port": None,
+    "recording_server_port": None,
+    "recording_server_address": "127.0.0.1",
+    "profile_duration": 60,
+    "sharding": {},
+    "bandwidth": {},
+    "start_backoff": {},
+    "admission": {},
+    "buffer_tuning": {},
+    "archive": {},
+    "trace_path": None,
+    "watch_config": False,
 }
 
+# these can be changed by reloading the config file, everything else requires a restart
+ReloadableConfigFields = { "streamers", "plugins", "update_interval", "update_end_interval", "stream_end_timeout", "watch_config", "bandwidth", "start_backoff", "admission", "buffer_tuning" }
+
 def non_empty_dict_or_none(value: dict):
     for v in value.values():
         if v not in (None, {}, []):
@@ -0,0 +1,259 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread, active_count, local
+from typing import Callable, Iterable
+import itertools
+import logging
+import os
+import weakref
+
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None # type: ignore
+
+log = logging.getLogger(__file__)
+
+def _escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+def _format_labels(labelnames: tuple[str, ...], labelvalues: tuple):
+    if len(labelnames) == 0:
+        return ""
+
+    return "{" + ",".join(f"{n}=\"{_escape_label_value(str(v))}\"" for n,v in zip(labelnames, labelvalues)) + "}"
+
+class Metric:
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.labelnames = labelnames
+
+    # returns tuples of (name suffix, label values, value)
+    def samples(self) -> Iterable[tuple[str, tuple, float]]:
+        return []
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+
+        for suffix, labelvalues, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labelvalues)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+# only lives in the thread local storage of its thread, which is cleared when the thread exits
+class _CellOwner:
+    def __init__(self, cell: dict[tuple, list[float]]):
+        self.cell = cell
+
+class _ThreadLocalMetric(Metric):
+    # every thread increments its own cell without any locking, the cells are only summed up when the metrics are scraped.
+    # the cell of a thread is folded into a single dict as soon as the thread exits, so they don't accumulate over time
+    # even if the metrics are never scraped
+
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, metric_type, labelnames)
+
+        self._local = local()
+        self._cells_lock = Lock()
+        self._cells: dict[int, dict[tuple, list[float]]] = {}
+        self._cell_ids = itertools.count()
+        self._retired: dict[tuple, list[float]] = {}
+
+    def _cell(self) -> dict[tuple, list[float]]:
+        try:
+            return self._local.owner.cell
+        except AttributeError:
+            cell: dict[tuple, list[float]] = {}
+            owner = _CellOwner(cell)
+            cell_id = next(self._cell_ids)
+
+            with self._cells_lock:
+                self._cells[cell_id] = cell
+
+            # the owner is dropped together with the thread local storage once the thread has exited, when its cell can't change anymore
+            weakref.finalize(owner, self._retire, cell_id)
+            self._local.owner = owner
+
+            return cell
+
+    def _retire(self, cell_id: int):
+        with self._cells_lock:
+            cell = self._cells.pop(cell_id)
+
+            for labelvalues, entry in cell.items():
+                retired = self._retired.setdefault(labelvalues, [0.0] * len(entry))
+                for i, v in enumerate(entry):
+                    retired[i] += v
+
+    def _totals(self) -> dict[tuple, list[float]]:
+        with self._cells_lock:
+            totals = { k: list(v) for k,v in self._retired.items() }
+
+            for cell in self._cells.values():
+                for labelvalues, entry in list(cell.items()):
+                    total = totals.setdefault(labelvalues, [0.0] * len(entry))
+                    for i, v in enumerate(list(entry)):
+                        total[i] += v
+
+        return totals
+
+class Counter(_ThreadLocalMetric):
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, "counter", labelnames)
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        cell = self._cell()
+
+        entry = cell.get(labels)
+        if entry is None:
+            cell[labels] = [amount]
+        else:
+            entry[0] += amount
+
+    def samples(self):
+        return [ ("", labelvalues, entry[0]) for labelvalues, entry in self._totals().items() ]
+
+class Summary(_ThreadLocalMetric):
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, "summary", labelnames)
+
+    def observe(self, value: float, labels: tuple = ()):
+        cell = self._cell()
+
+        entry = cell.get(labels)
+        if entry is None:
+            cell[labels] = [1, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+
+    def samples(self):
+        result = []
+        for labelvalues, entry in self._totals().items():
+            result.append(("_count", labelvalues, entry[0]))
+            result.append(("_sum", labelvalues, entry[1]))
+        return result
+
+class Gauge(Metric):
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, "gauge", labelnames)
+
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, labels: tuple = ()):
+        self._values[labels] = value
+
+    def remove(self, labels: tuple = ()):
+        self._values.pop(labels, None)
+
+    def clear(self):
+        self._values = {}
+
+    def samples(self):
+        return [ ("", labelvalues, value) for labelvalues, value in self._values.copy().items() ]
+
+# a counter whose value is computed by a collector instead of being incremented directly
+class CollectedCounter(Gauge):
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.metric_type = "counter"
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+        self._lock = Lock()
+
+    def register[M: Metric](self, metric: M) -> M:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def summary(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        return self.register(Summary(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    # collectors are called right before the metrics are exposed and can be used to update gauges with current values
+    def register_collector(self, collector: Callable[[], None]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def expose(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics)
+
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                log.error(f"Error in metrics collector: {repr(e)}")
+
+        return "".join(m.expose() for m in metrics)
+
+REGISTRY = MetricsRegistry()
+
+process_threads = REGISTRY.gauge("process_threads", "Number of currently running threads")
+process_resident_memory = REGISTRY.gauge("process_resident_memory_bytes", "Resident set size of the process in bytes")
+process_cpu_seconds = REGISTRY.gauge("process_cpu_seconds", "Total user and system CPU time spent by the process in seconds")
+
+def _get_rss():
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # peak instead of current, but better than nothing
+
+    return 0
+
+def _collect_process_metrics():
+    process_threads.set(active_count())
+    process_resident_memory.set(_get_rss())
+
+    times = os.times()
+    process_cpu_seconds.set(times.user + times.system)
+
+REGISTRY.register_collector(_collect_process_metrics)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = REGISTRY.expose().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+class MetricsServer(Thread):
+    def __init__(self, port: int):
+        super().__init__(name="metrics-server")
+        self.daemon = True
+
+        self._server = ThreadingHTTPServer(("", port), _MetricsRequestHandler)
+        self._server.daemon_threads = True
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
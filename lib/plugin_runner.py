@@ -1,20 +1,37 @@
 from threading import Thread
+from typing import Callable, Optional
 import logging
+import time
+
+from lib import metrics
 
 log = logging.getLogger(__file__)
 
+plugin_hook_duration = metrics.REGISTRY.summary("plugin_hook_duration_seconds", "Time spent in plugin hooks", ("plugin", "hook"))
+
 class PluginRunner(Thread):
-    def __init__(self, plugins, method, params, kwparams):
-        super().__init__()
+    def __init__(self, plugins, method, params, kwparams, on_complete: Optional[Callable[[], None]] = None):
+        super().__init__(name=f"plugin-runner-{method}")
 
         self._plugins = plugins
         self._method_name = method
         self._args = params
         self._kwargs = kwparams
+        self._on_complete = on_complete
 
     def run(self):
         for p in self._plugins:
+            start = time.monotonic()
+
             try:
                 getattr(p, self._method_name)(*self._args, **self._kwargs)
             except Exception as e:
                 log.error(f"Error in plugin {p.__class__.get_name()}: {repr(e)}")
+
+            plugin_hook_duration.observe(time.monotonic() - start, (p.__class__.get_name(), self._method_name))
+
+        if self._on_complete is not None:
+            try:
+                self._on_complete()
+            except Exception as e:
+                log.error(f"Error after running plugins: {repr(e)}")
@@ -0,0 +1,187 @@
+from collections import Counter
+from datetime import datetime
+from threading import Thread, enumerate as enumerate_threads, get_ident, main_thread
+from types import FrameType
+from typing import Optional
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+from lib.plugin_runner import PluginRunner
+from lib.recorder_base import RecorderBase
+from lib.service_base import ServiceBase
+
+log = logging.getLogger(__file__)
+
+def _frame_label(filename: str, function: str, lineno: int):
+    # the collapsed stack format uses semicolons as separators, so they can't appear in a frame
+    return f"{function} ({os.path.basename(filename)}:{lineno})".replace(";", ",")
+
+def _sanitize(name: str):
+    return re.sub(r"[^a-zA-Z0-9_\-]", "_", name)
+
+# groups a file into one of the subsystems, used for the allocation traces which are not associated with a thread
+def _subsystem_of_file(filename: str) -> Optional[str]:
+    normalized = filename.replace("\\", "/")
+
+    if normalized.endswith("_recorder.py") and "/services/" in normalized:
+        return "recorders"
+    if normalized.endswith("_service.py") and "/services/" in normalized:
+        return "services"
+    if "/plugins/" in normalized or normalized.endswith("/lib/plugin_runner.py"):
+        return "plugins"
+    if normalized.endswith("/main.py") or normalized.endswith("/lib/scheduler.py"):
+        return "main_loop"
+    return None
+
+class SamplingProfiler(Thread):
+    def __init__(self, output_path: str, duration: float, interval: float = 0.01):
+        super().__init__(name="sampling-profiler")
+        self.daemon = True
+
+        self._output_path = os.path.join(output_path, "profiles", datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+        self._duration = duration
+        self._interval = interval
+
+        self._stacks: dict[str, Counter[str]] = {}
+
+    def _subsystem(self, thread: Optional[Thread], frame: Optional[FrameType]):
+        if isinstance(thread, RecorderBase):
+            service, username = thread.getMetricLabels()
+            return f"recorder_{service}_{username}"
+
+        if isinstance(thread, PluginRunner):
+            return "plugins"
+
+        if thread is main_thread():
+            # the services are updated from the main loop, so we have to look at the stack to tell them apart
+            while frame is not None:
+                if frame.f_code.co_name in ("update_streams", "update_streams_async"):
+                    instance = frame.f_locals.get("self")
+                    if isinstance(instance, ServiceBase):
+                        return f"service_{type(instance).__name__}"
+                frame = frame.f_back
+            return "main_loop"
+
+        if thread is not None:
+            return f"thread_{thread.name}"
+
+        return "other"
+
+    def _sample(self, own_ident: int):
+        threads = { t.ident: t for t in enumerate_threads() }
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+
+            thread = threads.get(ident)
+            subsystem = self._subsystem(thread, frame)
+
+            stack = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                stack.append(_frame_label(current.f_code.co_filename, current.f_code.co_name, current.f_code.co_firstlineno))
+                current = current.f_back
+
+            stack.append(thread.name if thread is not None else str(ident))
+            stack.reverse()
+
+            self._stacks.setdefault(subsystem, Counter())[";".join(stack)] += 1
+
+    def run(self):
+        started_tracemalloc = False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            started_tracemalloc = True
+
+        try:
+            start_snapshot = tracemalloc.take_snapshot()
+            own_ident = get_ident()
+
+            end_time = time.monotonic() + self._duration
+            samples = 0
+
+            while time.monotonic() < end_time:
+                self._sample(own_ident)
+                samples += 1
+                time.sleep(self._interval)
+
+            end_snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+        try:
+            self._write_results(start_snapshot, end_snapshot, samples)
+        except Exception as e:
+            log.error(f"Error while writing profile: {repr(e)}")
+            return
+
+        log.info(f"Profiling finished after {samples} samples, results were written to {self._output_path}")
+
+    def _write_results(self, start_snapshot: tracemalloc.Snapshot, end_snapshot: tracemalloc.Snapshot, samples: int):
+        os.makedirs(self._output_path, exist_ok=True)
+
+        # cpu samples in the collapsed stack format, which can be rendered with flamegraph.pl, speedscope or inferno
+        for subsystem, stacks in self._stacks.items():
+            with open(os.path.join(self._output_path, f"cpu_{_sanitize(subsystem)}.folded"), "w") as folded_file:
+                for stack, count in stacks.most_common():
+                    folded_file.write(f"{stack} {count}\n")
+
+        # memory that was allocated during the profiling period and is still alive at the end of it, in bytes
+        trace_filter = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        allocations: dict[str, Counter[str]] = {}
+        differences = end_snapshot.filter_traces(trace_filter).compare_to(start_snapshot.filter_traces(trace_filter), "traceback")
+
+        for difference in differences:
+            if difference.size_diff <= 0:
+                continue
+
+            # the frame of the project closest to the allocation decides which subsystem it belongs to
+            subsystem = "other"
+            for frame in reversed(difference.traceback):
+                frame_subsystem = _subsystem_of_file(frame.filename)
+                if frame_subsystem is not None:
+                    subsystem = frame_subsystem
+                    break
+
+            stack = ";".join(f"{os.path.basename(f.filename)}:{f.lineno}".replace(";", ",") for f in difference.traceback)
+            allocations.setdefault(subsystem, Counter())[stack] += difference.size_diff
+
+        for subsystem, stacks in allocations.items():
+            with open(os.path.join(self._output_path, f"alloc_{_sanitize(subsystem)}.folded"), "w") as folded_file:
+                for stack, size in stacks.most_common():
+                    folded_file.write(f"{stack} {size}\n")
+
+        with open(os.path.join(self._output_path, "summary.txt"), "w") as summary_file:
+            summary_file.write(f"Duration: {self._duration}s, interval: {self._interval}s, samples: {samples}\n\n")
+
+            summary_file.write("CPU samples per subsystem:\n")
+            for subsystem, stacks in sorted(self._stacks.items(), key=lambda s: -s[1].total()):
+                summary_file.write(f"  {subsystem}: {stacks.total()}\n")
+
+            summary_file.write("\nTop allocations by line:\n")
+            for stat in end_snapshot.filter_traces(trace_filter).compare_to(start_snapshot.filter_traces(trace_filter), "lineno")[:30]:
+                summary_file.write(f"  {stat}\n")
+
+_current_profiler: Optional[SamplingProfiler] = None
+
+# starts a profiler in the background unless one is already running.
+# this is only ever called from the main thread (directly or from a signal handler), so it doesn't need a lock
+def start_profiler(output_path: str, duration: float):
+    global _current_profiler
+
+    if _current_profiler is not None and _current_profiler.is_alive():
+        log.warning("Profiler is already running")
+        return
+
+    log.info(f"Starting profiler for {duration} seconds")
+    _current_profiler = SamplingProfiler(output_path, duration)
+    _current_profiler.start()
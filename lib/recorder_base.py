@@ -1,10 +1,61 @@
 from abc import abstractmethod
-from threading import Thread
-from typing import Self
+from threading import Lock, Thread
+from typing import Optional, Self
+import time
 
+from lib import metrics
 from lib.stream_metadata import StreamMetadata
 
+recorder_bytes_written = metrics.REGISTRY.register(metrics.CollectedCounter("recorder_bytes_written_total", "Number of bytes written to recordings", ("service", "username")))
+recorder_write_rate = metrics.REGISTRY.gauge("recorder_write_rate_bytes", "Write rate of active recorders since the last scrape in bytes per second", ("service", "username"))
+recorder_time_to_first_byte = metrics.REGISTRY.gauge("recorder_time_to_first_byte_seconds", "Time between starting a recorder and receiving the first bytes of the stream", ("service", "username"))
+recorders_active = metrics.REGISTRY.gauge("recorders_active", "Number of recorders that are currently writing data")
+
+# recorders only increment their own byte counter in the read loop, these are aggregated when the metrics are scraped
+_tracking_lock = Lock()
+_active_recorders: set["RecorderBase"] = set()
+_retired_bytes: dict[tuple[str, str], int] = {}
+
+def _collect_recorder_metrics():
+    now = time.monotonic()
+
+    with _tracking_lock:
+        totals = dict(_retired_bytes)
+        recorder_write_rate.clear()
+        recorder_time_to_first_byte.clear()
+
+        for recorder in _active_recorders:
+            labels = recorder.getMetricLabels()
+            bytes_written = recorder.getBytesWritten()
+            totals[labels] = totals.get(labels, 0) + bytes_written
+
+            last_sample_time, last_sample_bytes = recorder._last_rate_sample
+            if now > last_sample_time:
+                recorder_write_rate.set((bytes_written - last_sample_bytes) / (now - last_sample_time), labels)
+            recorder._last_rate_sample = (now, bytes_written)
+
+            time_to_first_byte = recorder.getTimeToFirstByte()
+            if time_to_first_byte is not None:
+                recorder_time_to_first_byte.set(time_to_first_byte, labels)
+
+        recorders_active.set(len(_active_recorders))
+
+    for labels, value in totals.items():
+        recorder_bytes_written.set(value, labels)
+
+metrics.REGISTRY.register_collector(_collect_recorder_metrics)
+
+# raised or stored by the recorders when a stream can't be recorded at all, the reason is used to back off the retries
+class StartFailure(Exception):
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
 class RecorderBase(Thread):
+    service_name = "unknown"
+
+    _username: str
+
     def __init__(self):
         super().__init__()
 
@@ -13,6 +64,14 @@ class RecorderBase(Thread):
         self._encountered_error = None
         self._is_finished = False
         self._stop_time = 0
+        self._ever_recorded = False
+
+        self._start_time = 0.0
+        self._first_byte_time = 0.0
+        self._bytes_written = 0
+        self._last_rate_sample = (0.0, 0)
+
+        self._recording_path: Optional[str] = None
 
     def isRecording(self) -> bool:
         return self._recording
@@ -23,12 +82,68 @@ class RecorderBase(Thread):
     def encounteredError(self):
         return self._encountered_error is not None
 
+    def hasRecorded(self) -> bool:
+        return self._ever_recorded
+
+    # returns the reason if the recorder stopped with an error before it recorded anything
+    def getStartFailure(self) -> Optional[str]:
+        if self._encountered_error is None or self._ever_recorded:
+            return None
+        if isinstance(self._encountered_error, StartFailure):
+            return self._encountered_error.reason
+        return "error"
+
+    # called when starting the recorder raised an exception, so it is handled like any other recorder that failed to start
+    def failStart(self, error: BaseException):
+        if self._recording or self._encountered_error is not None:
+            return
+
+        self._encountered_error = error
+        self._stop_time = time.time()
+
     def getStopTime(self):
         return self._stop_time
 
     def isFinished(self):
         return self._is_finished
 
+    def getBytesWritten(self) -> int:
+        return self._bytes_written
+
+    def getTimeToFirstByte(self):
+        if self._first_byte_time == 0:
+            return None
+        return self._first_byte_time - self._start_time
+
+    # average bitrate since the first byte in bits per second, or None if the recorder hasn't received data for min_duration seconds yet
+    def getBitrate(self, now: float, min_duration: float) -> Optional[float]:
+        if self._first_byte_time == 0 or now - self._first_byte_time < min_duration:
+            return None
+        return self._bytes_written * 8 / (now - self._first_byte_time)
+
+    # path of the file the recorder is currently writing to, if it is on the local machine
+    def getRecordingPath(self) -> Optional[str]:
+        return self._recording_path
+
+    def getMetricLabels(self) -> tuple[str, str]:
+        return (self.service_name, self._username)
+
+    # has to be called by the recorder thread right before it starts reading data
+    def _trackRecordingStart(self):
+        with _tracking_lock:
+            self._last_rate_sample = (time.monotonic(), self._bytes_written)
+            self._ever_recorded = True
+            _active_recorders.add(self)
+
+    # has to be called by the recorder thread after it has stopped reading data
+    def _trackRecordingEnd(self):
+        with _tracking_lock:
+            if self in _active_recorders:
+                _active_recorders.remove(self)
+
+            labels = self.getMetricLabels()
+            _retired_bytes[labels] = _retired_bytes.get(labels, 0) + self._bytes_written
+
     @abstractmethod
     def getFreshClone(self) -> Self:
         pass
@@ -41,6 +156,11 @@ class RecorderBase(Thread):
     def stopRecording(self):
         pass
 
+    # stops the recording from a different thread, even if the recorder thread is currently blocked while waiting for data
+    @abstractmethod
+    def abort(self, error: Exception):
+        pass
+
     @abstractmethod
     def finish(self):
-        pass
\ No newline at end of file
+        pass
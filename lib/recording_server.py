@@ -0,0 +1,223 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable, Optional, cast
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+import json
+import logging
+import os
+import re
+import time
+
+from lib.recorder_base import RecorderBase
+from lib.ts_index import TS_PACKET_SIZE, get_index_path, read_index
+
+log = logging.getLogger(__file__)
+
+FOLLOW_POLL_INTERVAL = 0.5
+SENDFILE_CHUNK_SIZE = 4 * 1024 * 1024
+
+range_re = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+# returns the first and last byte of the requested range, or None if the whole file was requested
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    if header is None:
+        return None
+
+    match = range_re.match(header.strip())
+    if match is None or (match.group(1) == "" and match.group(2) == ""):
+        return None # multiple or malformed ranges, serve the whole file instead
+
+    if match.group(1) == "": # suffix range, e.g. the last 1000 bytes
+        length = int(match.group(2))
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return (max(0, size - length), size - 1)
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) != "" else size - 1
+
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+
+    return (start, min(end, size - 1))
+
+class _RecordingRequestHandler(BaseHTTPRequestHandler):
+    @property
+    def recording_server(self):
+        return cast("_RecordingHTTPServer", self.server)
+
+    def _find_recording(self, service: str, username: str) -> Optional[str]:
+        for recorder in self.recording_server.get_recorders():
+            if recorder.getMetricLabels() == (service, username) and recorder.getRecordingPath() is not None:
+                return recorder.getRecordingPath()
+        return None
+
+    def _send_json(self, data):
+        body = json.dumps(data, indent=4).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _list_recordings(self):
+        recordings = []
+
+        for recorder in self.recording_server.get_recorders():
+            path = recorder.getRecordingPath()
+            if path is None:
+                continue
+
+            service, username = recorder.getMetricLabels()
+            recordings.append({
+                "service": service,
+                "username": username,
+                "recording": recorder.isRecording(),
+                "file": os.path.basename(path),
+                "bytes_written": recorder.getBytesWritten(),
+                "url": f"/recordings/{quote(service)}/{quote(username)}",
+            })
+
+        self._send_json(recordings)
+
+    def _sendfile(self, fd: int, offset: int, count: int):
+        socket_fd = self.connection.fileno()
+
+        while count > 0:
+            sent = os.sendfile(socket_fd, fd, offset, min(count, SENDFILE_CHUNK_SIZE))
+            if sent == 0:
+                break
+
+            offset += sent
+            count -= sent
+
+        return offset
+
+    # starts close to the live edge, at the first keyframe within the backlog if the recording has an index,
+    # otherwise at a packet boundary so the client doesn't have to resync
+    def _follow_start(self, path: str, size: int):
+        start = max(0, size - self.recording_server.follow_backlog)
+
+        index_path = get_index_path(path)
+        if os.path.exists(index_path):
+            try:
+                keyframes = [ offset for offset, _ in read_index(index_path) if start <= offset < size ]
+                if len(keyframes) > 0:
+                    return keyframes[0]
+            except Exception as e:
+                log.debug(f"Could not read the index of {path}: {repr(e)}")
+
+        return start - start % TS_PACKET_SIZE
+
+    def _serve_recording(self, service: str, username: str, follow: bool):
+        path = self._find_recording(service, username)
+
+        if path is None:
+            self.send_error(404, "No active recording for this user")
+            return
+
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            self.send_error(404, "Recording file is not available")
+            return
+
+        try:
+            size = os.fstat(fd).st_size
+
+            if follow:
+                # the size of a growing file is unknown, so the response simply ends when the connection is closed
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+
+                start = self._follow_start(path, size)
+                offset = self._sendfile(fd, start, size - start)
+                self._follow(fd, offset, service, username, path)
+                return
+
+            try:
+                byte_range = parse_range(self.headers.get("Range"), size)
+            except RangeNotSatisfiable:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if byte_range is None:
+                self.send_response(200)
+                start, end = 0, size - 1
+            else:
+                self.send_response(206)
+                start, end = byte_range
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+            self._sendfile(fd, start, end - start + 1)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the viewer went away
+        finally:
+            os.close(fd)
+
+    # keeps sending the data appended to the file for as long as a recorder is still writing to it
+    def _follow(self, fd: int, offset: int, service: str, username: str, path: str):
+        while True:
+            size = os.fstat(fd).st_size
+
+            if size > offset:
+                offset = self._sendfile(fd, offset, size - offset)
+                continue
+
+            if self._find_recording(service, username) != path:
+                return
+
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [ unquote(p) for p in url.path.split("/") if p != "" ]
+
+        if len(parts) == 0:
+            self._list_recordings()
+        elif len(parts) == 3 and parts[0] == "recordings":
+            follow = parse_qs(url.query).get("follow", ["0"])[0] not in ("0", "false", "")
+            self._serve_recording(parts[1], parts[2], follow)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        log.debug(f"Recording server request from {self.address_string()}: {format % args}")
+
+class _RecordingHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], get_recorders: Callable[[], list[RecorderBase]], follow_backlog: int):
+        super().__init__(address, _RecordingRequestHandler)
+
+        self.get_recorders = get_recorders
+        self.follow_backlog = follow_backlog
+
+# serves the files of the active recordings, so they can be watched while they are still being recorded.
+# the file contents are sent with sendfile, so the viewers cost almost no CPU time in the python process
+class RecordingServer(Thread):
+    def __init__(self, address: str, port: int, get_recorders: Callable[[], list[RecorderBase]], follow_backlog: int = 4 * 1024 * 1024):
+        super().__init__(name="recording-server")
+        self.daemon = True
+
+        self._server = _RecordingHTTPServer((address, port), get_recorders, follow_backlog)
+
+    def run(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
@@ -0,0 +1,261 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import BoundedSemaphore, Lock
+from typing import Optional
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+import requests
+
+from lib import bandwidth, metrics
+
+log = logging.getLogger(__file__)
+
+s3_uploaded_bytes = metrics.REGISTRY.counter("s3_uploaded_bytes_total", "Number of bytes uploaded to S3 compatible storage", ("bucket",))
+s3_part_upload_duration = metrics.REGISTRY.summary("s3_part_upload_duration_seconds", "Time it took to upload a single part of a multipart upload", ("bucket",))
+s3_request_failures = metrics.REGISTRY.counter("s3_request_failures_total", "Number of failed requests to S3 compatible storage, including the ones that were retried", ("bucket", "operation"))
+
+REQUEST_ATTEMPTS = 4
+MIN_PART_SIZE = 5 * 1024 * 1024 # the minimum size of all parts except the last one
+
+class S3Error(Exception):
+    pass
+
+def _quote(value: str):
+    return quote(value, safe="-_.~")
+
+# a minimal client for the multipart upload API, which signs the requests with AWS signature version 4.
+# the bucket is always addressed in the path, which works with AWS as well as with MinIO and most other compatible servers
+class S3Client:
+    def __init__(self, endpoint: str, bucket: str, region: str, access_key: str, secret_key: str):
+        self.bucket = bucket
+
+        self._endpoint = endpoint.rstrip("/")
+        self._host = urlsplit(self._endpoint).netloc
+        self._region = region
+        self._access_key = access_key
+        self._secret_key = secret_key
+
+    def _sign(self, method: str, path: str, query: str, headers: dict[str, str], payload_hash: str):
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now.strftime('%Y%m%d')}/{self._region}/s3/aws4_request"
+
+        headers["host"] = self._host
+        headers["x-amz-date"] = amz_date
+        headers["x-amz-content-sha256"] = payload_hash
+
+        signed_headers = ";".join(sorted(headers))
+        canonical_headers = "".join(f"{name}:{headers[name].strip()}\n" for name in sorted(headers))
+        canonical_request = "\n".join([ method, path, query, canonical_headers, signed_headers, payload_hash ])
+        string_to_sign = "\n".join([ "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode("utf-8")).hexdigest() ])
+
+        signing_key = f"AWS4{self._secret_key}".encode("utf-8")
+        for part in scope.split("/"):
+            signing_key = hmac.new(signing_key, part.encode("utf-8"), hashlib.sha256).digest()
+
+        signature = hmac.new(signing_key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+        headers["authorization"] = f"AWS4-HMAC-SHA256 Credential={self._access_key}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+
+    def _request(self, operation: str, method: str, key: str, params: dict[str, str], body: bytes = b"") -> requests.Response:
+        path = quote(f"/{self.bucket}/{key}", safe="/-_.~")
+        query = "&".join(f"{_quote(name)}={_quote(value)}" for name, value in sorted(params.items()))
+        payload_hash = hashlib.sha256(body).hexdigest()
+        error: Exception = S3Error(f"{operation} of {key} was not attempted")
+
+        for attempt in range(REQUEST_ATTEMPTS):
+            headers: dict[str, str] = {}
+            self._sign(method, path, query, headers, payload_hash)
+
+            try:
+                response = requests.request(method, f"{self._endpoint}{path}?{query}", data=body, headers=headers, timeout=60)
+
+                # S3 can report errors of a complete request with a successful status code
+                if response.status_code < 300 and not response.content.lstrip().startswith(b"<Error"):
+                    return response
+
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    s3_request_failures.inc(labels=(self.bucket, operation))
+                    raise S3Error(f"{operation} of {key} failed with status {response.status_code}: {response.text[:500]}")
+
+                error = S3Error(f"{operation} of {key} failed with status {response.status_code}: {response.text[:500]}")
+            except requests.RequestException as e:
+                error = e
+
+            s3_request_failures.inc(labels=(self.bucket, operation))
+
+            if attempt < REQUEST_ATTEMPTS - 1:
+                log.warning(f"{operation} of {key} failed, retrying: {repr(error)}")
+                time.sleep(2 ** attempt)
+
+        raise error
+
+    def create_multipart_upload(self, key: str) -> str:
+        response = self._request("CreateMultipartUpload", "POST", key, { "uploads": "" })
+        return _find_xml_text(response.content, "UploadId")
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        response = self._request("UploadPart", "PUT", key, { "partNumber": str(part_number), "uploadId": upload_id }, data)
+        return response.headers["ETag"]
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: dict[int, str]):
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(parts.items())
+        ) + "</CompleteMultipartUpload>"
+        self._request("CompleteMultipartUpload", "POST", key, { "uploadId": upload_id }, body.encode("utf-8"))
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        self._request("AbortMultipartUpload", "DELETE", key, { "uploadId": upload_id })
+
+def _find_xml_text(content: bytes, tag: str) -> str:
+    for element in ElementTree.fromstring(content).iter():
+        if element.tag == tag or element.tag.endswith("}" + tag):
+            return element.text or ""
+    raise S3Error(f"Response does not contain {tag}")
+
+# a multipart upload of a recording. part n always contains the bytes from (n - 1) * part_size to n * part_size of the file,
+# so the uploaded parts can be written to a small state file next to the recording and the upload can be resumed from there at any time
+class MultipartUpload:
+    def __init__(self, client: S3Client, state_path: str, key: str, upload_id: str, part_size: int, parts: dict[int, str], concurrency: int):
+        self.key = key
+
+        self._client = client
+        self._state_path = state_path
+        self._upload_id = upload_id
+        self._part_size = part_size
+        self._parts = parts
+
+        self._lock = Lock()
+        self._in_flight: set[int] = set()
+        self._futures: list[Future] = []
+        self._error: Optional[Exception] = None
+
+        # every slot holds one part in memory, so this limits the memory usage as well
+        self._slots = BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="s3-upload")
+        self._bandwidth_client = bandwidth.MANAGER.register(f"s3-upload={key}", "bulk")
+
+    @staticmethod
+    def load(client: S3Client, state_path: str, concurrency: int) -> "MultipartUpload":
+        with open(state_path, "r") as state_file:
+            state = json.load(state_file)
+
+        parts = { int(number): etag for number, etag in state["parts"].items() }
+        return MultipartUpload(client, state_path, state["key"], state["upload_id"], state["part_size"], parts, concurrency)
+
+    @staticmethod
+    def load_or_create(client: S3Client, state_path: str, key: str, part_size: int, concurrency: int) -> "MultipartUpload":
+        if os.path.exists(state_path):
+            upload = MultipartUpload.load(client, state_path, concurrency)
+            log.info(f"Resuming upload of {upload.key} with {len(upload._parts)} parts already uploaded")
+            return upload
+
+        upload = MultipartUpload(client, state_path, key, client.create_multipart_upload(key), part_size, {}, concurrency)
+        upload._save()
+        log.info(f"Started multipart upload of {key}")
+        return upload
+
+    def _save(self):
+        with self._lock:
+            state = { "key": self.key, "upload_id": self._upload_id, "part_size": self._part_size, "parts": dict(self._parts) }
+
+        # write the new state next to the old one and then replace it, so it is never left half written
+        with open(self._state_path + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(self._state_path + ".tmp", self._state_path)
+
+    def next_part_end(self):
+        with self._lock:
+            number = 1
+            while number in self._parts or number in self._in_flight:
+                number += 1
+        return number * self._part_size
+
+    # starts uploading all parts that are complete in the first size bytes of the file.
+    # blocks while all upload slots are busy, so the caller can never get too far ahead of the uploads
+    def upload_parts(self, fd: int, size: int, final: bool = False):
+        if self._error is not None:
+            raise self._error
+
+        part_count = size // self._part_size
+        if final and (size % self._part_size > 0 or size == 0):
+            part_count += 1
+
+        for number in range(1, part_count + 1):
+            with self._lock:
+                if number in self._parts or number in self._in_flight:
+                    continue
+                self._in_flight.add(number)
+
+            self._slots.acquire()
+            offset = (number - 1) * self._part_size
+            self._futures.append(self._executor.submit(self._upload_part, fd, number, offset, min(self._part_size, size - offset)))
+
+    def _upload_part(self, fd: int, number: int, offset: int, length: int):
+        try:
+            start = time.monotonic()
+            data = os.pread(fd, length, offset)
+
+            self._bandwidth_client.consume(len(data))
+            etag = self._client.upload_part(self.key, self._upload_id, number, data)
+
+            with self._lock:
+                self._parts[number] = etag
+            self._save()
+
+            s3_uploaded_bytes.inc(len(data), (self._client.bucket,))
+            s3_part_upload_duration.observe(time.monotonic() - start, (self._client.bucket,))
+        except Exception as e:
+            log.error(f"Uploading part {number} of {self.key} failed: {repr(e)}")
+            self._error = e
+        finally:
+            with self._lock:
+                self._in_flight.discard(number)
+            self._slots.release()
+
+    # waits until all started parts are uploaded
+    def wait(self):
+        for future in self._futures:
+            future.result()
+        self._futures = []
+
+        if self._error is not None:
+            raise self._error
+
+    # uploads the rest of the file, including the last part which may be smaller than the others, and completes the upload
+    def complete(self, fd: int, size: int):
+        if size == 0:
+            self.abort()
+            return
+
+        self.upload_parts(fd, size, final=True)
+        self.wait()
+
+        part_count = (size + self._part_size - 1) // self._part_size
+        with self._lock:
+            parts = { number: etag for number, etag in self._parts.items() if number <= part_count }
+
+        self._client.complete_multipart_upload(self.key, self._upload_id, parts)
+        self.close()
+        os.remove(self._state_path)
+
+        log.info(f"Completed upload of {self.key} ({size / 1000**2:.1f} MB in {len(parts)} parts)")
+
+    def abort(self):
+        try:
+            self._client.abort_multipart_upload(self.key, self._upload_id)
+        finally:
+            self.close()
+            os.remove(self._state_path)
+
+        log.info(f"Aborted upload of {self.key}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._bandwidth_client.close()
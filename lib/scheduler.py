@@ -0,0 +1,408 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, Optional
+import logging
+import time
+
+from lib import metrics
+from lib.admission import AdmissionController, admission_decisions, admission_queued
+from lib.backoff import StartBackoff
+from lib.recorder_base import RecorderBase
+from lib.service_base import ServiceBase
+from lib.trace import TraceWriter
+from lib.username_definition import UsernameDefinition
+
+log = logging.getLogger(__file__)
+
+recorder_restarts = metrics.REGISTRY.counter("recorder_restarts_total", "Number of times a recorder was restarted while the stream was still live", ("service", "username"))
+service_poll_duration = metrics.REGISTRY.summary("service_poll_duration_seconds", "Time spent updating the live status of all watched users of a service", ("service",))
+service_live_streams = metrics.REGISTRY.gauge("service_live_streams", "Number of watched users that were live during the last update", ("service",))
+recorder_start_duration = metrics.REGISTRY.summary("recorder_start_duration_seconds", "Time between deciding to start a recorder and the service returning from starting it, including the wait for a free start slot", ("service",))
+recorders_starting = metrics.REGISTRY.gauge("recorders_starting", "Number of recorders that are waiting for a start slot or are being started")
+
+class WatchState(Enum):
+    OFFLINE = "offline" # no recorder exists
+    STARTING = "starting" # the service is starting the recorder in the background, e.g. resolving the stream
+    RECORDING = "recording" # the recorder has been started and is waiting for or writing data
+    STOPPED = "stopped" # the recorder has stopped, it is restarted if the stream is still live or finished after the stream end timeout
+    BACKOFF = "backoff" # the recorder failed to start, it is restarted once the backoff has passed if the stream is still live
+    QUEUED = "queued" # the user is live, but the admission control doesn't let the recording start yet. no recorder exists
+
+class Watch:
+    def __init__(self, definition: UsernameDefinition):
+        self.definition = definition
+        self.state = WatchState.OFFLINE
+        self.recorder: Optional[RecorderBase] = None
+
+    def recorder_stopped(self):
+        assert self.recorder is not None
+        return (self.recorder.isInitialized() or self.recorder.encounteredError()) and not self.recorder.isRecording()
+
+# stands in for a recorder that couldn't even be created (e.g. because a plugin failed), so the watch backs off like after any
+# other failed start instead of the exception ending the main loop. creating the real recorder is tried again on the next restart
+class _UncreatedRecorder(RecorderBase):
+    def __init__(self, definition: UsernameDefinition, get_recorder: Callable[[UsernameDefinition], RecorderBase], error: Exception):
+        super().__init__()
+
+        self.service_name = definition.service
+        self._username = definition.username
+        self._definition = definition
+        self._get_recorder = get_recorder
+        self.failStart(error)
+
+    def getFreshClone(self):
+        return _create_recorder(self._definition, self._get_recorder)
+
+    def startRecording(self, metadata):
+        pass
+
+    def stopRecording(self):
+        pass
+
+    def abort(self, error: Exception):
+        pass
+
+    def finish(self):
+        self._is_finished = True
+
+def _create_recorder(definition: UsernameDefinition, get_recorder: Callable[[UsernameDefinition], RecorderBase]) -> RecorderBase:
+    try:
+        return get_recorder(definition)
+    except Exception as e:
+        log.error(f"Could not create the recorder for {definition.service} user {definition.username}: {repr(e)}")
+        return _UncreatedRecorder(definition, get_recorder, e)
+
+# runs the recorder lifecycle of all watched users.
+# the services only report which users went live or offline since their last update, so the work per tick depends on the
+# number of changes and active recorders instead of the number of watched users
+class Scheduler:
+    def __init__(
+        self,
+        services: Dict[str, ServiceBase],
+        get_recorder: Callable[[UsernameDefinition], RecorderBase],
+        update_interval: float,
+        update_end_interval: float,
+        stream_end_timeout: float,
+        backoff: Optional[StartBackoff] = None,
+        trace: Optional[TraceWriter] = None,
+        admission: Optional[AdmissionController] = None,
+        start_concurrency: int = 0,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._services = services
+        self._get_recorder = get_recorder
+        self._clock = clock
+        self._trace = trace
+
+        self.backoff = backoff if backoff is not None else StartBackoff()
+        self.admission = admission if admission is not None else AdmissionController()
+
+        self.update_interval = update_interval
+        self.update_end_interval = update_end_interval
+        self.stream_end_timeout = stream_end_timeout
+
+        self._watches: Dict[str, Watch] = {} # mapping from userdef_id to watch
+        self._usernames: Dict[str, list[str]] = { service_name: [] for service_name in services } # watched usernames per service, passed to the updates
+        self._live_users: Dict[str, set[str]] = { service_name: set() for service_name in services }
+        self._active: Dict[str, Watch] = {} # watches that currently have a recorder
+        self._queued: Dict[str, Watch] = {} # watches that are waiting for the admission control, in the order they were queued
+        self._new_watches: set[str] = set() # watches added since the last update, which have to be started even if they were live before
+        self._retiring: list[RecorderBase] = [] # recorders of users that are no longer watched, which are finished once they have stopped
+        self._starting: list[tuple[Future, Watch, RecorderBase]] = [] # recorders that are being started in the background
+
+        # starting a recorder can block for a long time (e.g. streamlink resolving the stream), so it is done on a pool of threads
+        # and the main loop only checks when it is done. without a pool the recorders are started inline, which the benchmarks rely on
+        self._start_pool = ThreadPoolExecutor(max_workers=start_concurrency, thread_name_prefix="recorder-start") if start_concurrency > 0 else None
+
+        self._last_check = 0.0
+
+    def get_recorders(self) -> list[RecorderBase]:
+        return [ watch.recorder for watch in list(self._active.values()) if watch.recorder is not None ]
+
+    def get_watch_states(self) -> Dict[str, WatchState]:
+        return { username_id: watch.state for username_id, watch in self._watches.items() }
+
+    def get_settings(self) -> dict[str, float]:
+        return {
+            "update_interval": self.update_interval,
+            "update_end_interval": self.update_end_interval,
+            "stream_end_timeout": self.stream_end_timeout,
+        }
+
+    def set_watches(self, watches: Dict[str, UsernameDefinition]):
+        for username_id in self._watches.keys() - watches.keys():
+            watch = self._watches.pop(username_id)
+            log.info(f"No longer watching {watch.definition.service} user {watch.definition.username}")
+
+            self._new_watches.discard(username_id)
+            self._active.pop(username_id, None)
+            self._queued.pop(username_id, None)
+            self.backoff.reset((watch.definition.service, watch.definition.username))
+            self.admission.forget(username_id)
+
+            if watch.recorder is not None:
+                watch.recorder.stopRecording()
+                self._retiring.append(watch.recorder)
+                watch.recorder = None
+
+        added = watches.keys() - self._watches.keys()
+
+        for username_id in added:
+            self._watches[username_id] = Watch(watches[username_id])
+            log.info(f"Watching {watches[username_id].service} user {watches[username_id].username}")
+
+        # the parameters of existing watches only apply to the next recorder
+        for username_id, definition in watches.items():
+            self._watches[username_id].definition = definition
+
+        self._usernames = { service_name: [] for service_name in self._services }
+        for watch in self._watches.values():
+            self._usernames[watch.definition.service].append(watch.definition.username)
+
+        if self._trace is not None:
+            self._trace.watches(self._clock(), self._usernames)
+
+        if len(added) > 0:
+            self._new_watches |= added
+            self._last_check = 0.0 # check the new users right away
+
+    def stop_all(self):
+        for watch in self._active.values():
+            if watch.recorder is not None and watch.recorder.isRecording():
+                watch.recorder.stopRecording()
+
+    def _start(self, watch: Watch):
+        definition = watch.definition
+
+        watch.recorder = _create_recorder(definition, self._get_recorder)
+        self._active[definition.get_id()] = watch
+
+        if self._trace is not None:
+            self._trace.start(self._clock(), definition.service, definition.username)
+
+        self._start_recorder(watch)
+
+    def _start_recorder(self, watch: Watch):
+        assert watch.recorder is not None
+
+        definition = watch.definition
+        service = self._services[definition.service]
+        recorder = watch.recorder
+        submit_time = time.monotonic()
+
+        if isinstance(recorder, _UncreatedRecorder):
+            # it has already failed, the next tick sees it as stopped and backs off
+            watch.state = WatchState.RECORDING
+            return
+
+        def start():
+            try:
+                service.start_recorder(definition.username, recorder)
+            finally:
+                duration = time.monotonic() - submit_time
+                recorder_start_duration.observe(duration, (definition.service,))
+                log.debug(f"Starting the recorder for {definition.service} user {definition.username} took {duration:.2f} seconds")
+
+        watch.state = WatchState.STARTING
+
+        if self._start_pool is None:
+            error = None
+
+            try:
+                start()
+            except Exception as e:
+                error = e
+
+            self._started(watch, recorder, error)
+            return
+
+        self._starting.append((self._start_pool.submit(start), watch, recorder))
+        recorders_starting.set(len(self._starting))
+
+    def _started(self, watch: Watch, recorder: RecorderBase, error: Optional[BaseException]):
+        if error is not None:
+            log.error(f"Error while starting the recorder for {watch.definition.service} user {watch.definition.username}: {repr(error)}")
+            recorder.failStart(error)
+
+        if watch.recorder is not recorder:
+            # the user was removed or preempted while the recorder was starting, and starting it might have undone the stop
+            recorder.stopRecording()
+        elif watch.state == WatchState.STARTING:
+            watch.state = WatchState.RECORDING
+
+    # starts the recorder if the admission control lets it, otherwise the watch is queued until there is room for it
+    def _admit(self, watch: Watch, now: float):
+        definition = watch.definition
+        active = [ (w.definition, w.recorder) for w in self._active.values() ]
+        decision = self.admission.decide(definition, active, now)
+
+        if not decision.admitted:
+            if watch.state != WatchState.QUEUED:
+                log.info(f"Queueing the recording of {definition.service} user {definition.username} (priority {definition.priority}), the {decision.reason} limit is reached")
+                admission_decisions.inc(labels=("queued", decision.reason))
+                watch.state = WatchState.QUEUED
+                self._queued[definition.get_id()] = watch
+            return
+
+        for username_id in decision.preempt:
+            self._preempt(self._active[username_id], definition, now)
+
+        if watch.state == WatchState.QUEUED:
+            log.info(f"Starting the queued recording of {definition.service} user {definition.username}")
+            del self._queued[definition.get_id()]
+
+        admission_decisions.inc(labels=("admitted", decision.reason))
+        self._start(watch)
+
+    def _preempt(self, watch: Watch, preempted_by: UsernameDefinition, now: float):
+        assert watch.recorder is not None
+
+        definition = watch.definition
+        log.warning(f"Stopping the recording of {definition.service} user {definition.username} (priority {definition.priority}) to make room for {preempted_by.service} user {preempted_by.username} (priority {preempted_by.priority})")
+        admission_decisions.inc(labels=("preempted", "priority"))
+
+        # the recorder is finished like the ones of users that are no longer watched, and a new one is started once there is room again
+        watch.recorder.stopRecording()
+        self._retiring.append(watch.recorder)
+
+        if self._trace is not None:
+            self._trace.stop(now, definition.service, definition.username, None, watch.recorder.hasRecorded())
+
+        watch.recorder = None
+        watch.state = WatchState.QUEUED
+        del self._active[definition.get_id()]
+        self._queued[definition.get_id()] = watch
+
+    def _restart(self, watch: Watch):
+        assert watch.recorder is not None
+
+        watch.recorder = watch.recorder.getFreshClone()
+        recorder_restarts.inc(labels=watch.recorder.getMetricLabels())
+
+        if self._trace is not None:
+            self._trace.start(self._clock(), watch.definition.service, watch.definition.username)
+
+        self._start_recorder(watch)
+
+    def _finish(self, watch: Watch):
+        assert watch.recorder is not None
+
+        log.info(f"Finishing recorder for username {watch.definition.username}, because the stream end timeout was reached")
+        watch.recorder.finish()
+        watch.recorder = None
+        watch.state = WatchState.OFFLINE
+        del self._active[watch.definition.get_id()]
+
+        # the next stream gets a fresh start
+        self.backoff.reset((watch.definition.service, watch.definition.username))
+
+    def _update_services(self, now: float) -> list[str]:
+        went_live: list[str] = []
+
+        for service_name, service in self._services.items():
+            poll_start = time.monotonic()
+
+            try:
+                changes = service.update(self._usernames[service_name])
+                self._live_users[service_name] = changes.live
+                service_live_streams.set(len(changes.live), (service_name,))
+
+                went_live.extend(UsernameDefinition(service_name, username, []).get_id() for username in changes.went_live)
+
+                if self._trace is not None:
+                    started_at = { username: service.get_stream_start(username) for username in changes.went_live }
+                    self._trace.poll(now, service_name, changes.went_live, changes.went_offline, { u: t for u, t in started_at.items() if t is not None })
+            except Exception as ex:
+                log.error(f"Error while fetching streams for service {service_name}: {repr(ex)}")
+
+                if self._trace is not None:
+                    self._trace.poll_error(now, service_name)
+
+            service_poll_duration.observe(time.monotonic() - poll_start, (service_name,))
+
+        return went_live
+
+    def _is_live(self, watch: Watch):
+        return watch.definition.username in self._live_users[watch.definition.service]
+
+    def tick(self):
+        now = self._clock()
+
+        for recorder in [ r for r in self._retiring if (r.isInitialized() or r.encounteredError()) and not r.isRecording() ]:
+            recorder.finish()
+            self._retiring.remove(recorder)
+
+        if len(self._starting) > 0:
+            for start in [ s for s in self._starting if s[0].done() ]:
+                self._starting.remove(start)
+                self._started(start[1], start[2], start[0].exception())
+
+            recorders_starting.set(len(self._starting))
+
+        any_finished = False
+        any_stopped = False
+
+        for watch in self._active.values():
+            assert watch.recorder is not None
+
+            if watch.state == WatchState.RECORDING and watch.recorder_stopped():
+                labels = (watch.definition.service, watch.definition.username)
+                start_failure = watch.recorder.getStartFailure()
+
+                if start_failure is not None:
+                    self.backoff.record_failure(labels, start_failure, now)
+                    watch.state = WatchState.BACKOFF
+                else:
+                    self.backoff.record_success(labels)
+                    watch.state = WatchState.STOPPED
+
+                if self._trace is not None:
+                    self._trace.stop(now, *labels, start_failure, watch.recorder.hasRecorded())
+
+            # failed recorders wait for their backoff, there is no need to check the live status for them right away
+            any_finished = any_finished or (watch.recorder.isFinished() and watch.state != WatchState.BACKOFF)
+            any_stopped = any_stopped or watch.state == WatchState.STOPPED
+
+        if (now - self._last_check >= self.update_interval) or any_finished or (any_stopped and now - self._last_check >= self.update_end_interval):
+            # check the live status if
+            # -> the update interval has passed
+            # -> any recorder has finished (we have to check immediately, since the finished recorder will get replaced immediately in the next step)
+            # -> any recorder is not recording (we have to check more often in this case so we can stop recorders quickly after the stream ended)
+            self._last_check = now
+
+            candidates = self._update_services(now)
+            candidates.extend(self._new_watches)
+            self._new_watches = set()
+
+            for username_id in candidates:
+                watch = self._watches.get(username_id)
+
+                if watch is not None and watch.state == WatchState.OFFLINE and self._is_live(watch):
+                    self._admit(watch, now)
+
+        for watch in list(self._active.values()):
+            if watch.state not in (WatchState.STOPPED, WatchState.BACKOFF):
+                continue
+
+            assert watch.recorder is not None
+
+            if self._is_live(watch): # continue recording
+                if watch.state == WatchState.STOPPED or self.backoff.can_start((watch.definition.service, watch.definition.username), now):
+                    self._restart(watch)
+            elif now - watch.recorder.getStopTime() >= self.stream_end_timeout:
+                self._finish(watch)
+
+        if len(self._queued) > 0:
+            # the users with the highest priority get the free room first, sorted() keeps the order of the queue otherwise
+            for watch in sorted(self._queued.values(), key=lambda w: -w.definition.priority):
+                if watch.state != WatchState.QUEUED:
+                    continue # started or preempted again while going through the queue
+
+                if self._is_live(watch):
+                    self._admit(watch, now)
+                else:
+                    log.info(f"The queued {watch.definition.service} user {watch.definition.username} is no longer live")
+                    watch.state = WatchState.OFFLINE
+                    del self._queued[watch.definition.get_id()]
+
+        admission_queued.set(len(self._queued))
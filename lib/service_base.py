@@ -1,13 +1,26 @@
 from abc import ABC, abstractmethod
-from typing import Iterable, List
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
 
 from lib.config import Config
 from plugins.plugin_base import Plugin
 from lib.recorder_base import RecorderBase
+from lib.storage_mover import StorageMover
+
+# the difference between the live users of two consecutive updates of a service
+@dataclass
+class LiveChanges:
+    went_live: set[str]
+    went_offline: set[str]
+    live: set[str] # everyone who is live after the update, including the users who were already live before
 
 class ServiceBase[R](ABC):
+    storage_mover: Optional[StorageMover]
+
     def __init__(self):
         self.initialized = False
+        self.storage_mover = None
+        self._previous_live_users: set[str] = set()
     
     @abstractmethod
     def init(self, config: Config) -> bool:
@@ -22,6 +35,29 @@ class ServiceBase[R](ABC):
     def update_streams(self, usernames: Iterable[str]) -> int:
         pass
 
+    # returns the users who were live during the last update
+    @abstractmethod
+    def get_live_users(self) -> set[str]:
+        pass
+
+    # returns the unix timestamp at which the stream of a live user started, if the service knows it
+    def get_stream_start(self, username: str) -> Optional[float]:
+        return None
+
+    # updates the streams and returns which users went live or offline since the previous update
+    def update(self, usernames: Iterable[str]) -> LiveChanges:
+        self.update_streams(usernames)
+
+        live_users = self.get_live_users()
+        changes = LiveChanges(
+            went_live = live_users - self._previous_live_users,
+            went_offline = self._previous_live_users - live_users,
+            live = live_users,
+        )
+        self._previous_live_users = live_users
+
+        return changes
+
     @abstractmethod
     def get_recorder(self, username: str, params: List[str], plugins: list[tuple[type[Plugin], dict]]) -> R:
         pass
@@ -0,0 +1,397 @@
+from multiprocessing.connection import Client, Connection, Listener
+from threading import Event, Lock, Thread
+from typing import Any, Optional
+import bisect
+import hashlib
+import itertools
+import logging
+import os
+import socket
+import time
+
+from lib.recorder_base import RecorderBase
+from lib.service_base import ServiceBase
+from lib.stream_metadata import StreamMetadata
+from lib.username_definition import UsernameDefinition
+from plugins.plugin_base import Plugin
+
+log = logging.getLogger(__file__)
+
+# the messages between the coordinator and the workers are tuples, where the first element is the message type:
+#
+# worker -> coordinator:
+#   ("hello", worker_name)
+#   ("status", { recorder_id: status_dict }) sent every second, doubles as heartbeat
+#
+# coordinator -> worker:
+#   ("start", recorder_id, previous_recorder_id, service, username, params, metadata)
+#   ("stop", recorder_id)
+#   ("finish", recorder_id)
+
+STATUS_INTERVAL = 1.0
+
+class WorkerLostError(Exception):
+    pass
+
+class NoWorkerAvailableError(Exception):
+    pass
+
+class RemoteRecorderError(Exception):
+    pass
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return (host or "0.0.0.0", int(port))
+
+def _hash(key: str):
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+class _WorkerHandle:
+    def __init__(self, name: str, connection: Connection):
+        self.name = name
+        self.connection = connection
+        self.recorders: dict[str, "RemoteRecorder"] = {}
+        self.alive = True
+
+        self._send_lock = Lock()
+
+    def send(self, message: tuple):
+        with self._send_lock:
+            self.connection.send(message)
+
+# stands in for a recorder running on a worker process, so the main loop can treat it like any other recorder
+class RemoteRecorder(RecorderBase):
+    _id_counter = itertools.count()
+
+    def __init__(self, coordinator: "Coordinator", username_definition: UsernameDefinition, previous: Optional["RemoteRecorder"] = None):
+        super().__init__()
+
+        self.recorder_id = f"{os.getpid()}-{next(RemoteRecorder._id_counter)}"
+        self.service_name = username_definition.service
+        self.username_definition = username_definition
+        self.previous = previous
+        self.worker: Optional[_WorkerHandle] = None
+
+        self._username = username_definition.username
+        self._coordinator = coordinator
+        self._start_failure: Optional[str] = None
+
+    def getFreshClone(self):
+        return RemoteRecorder(self._coordinator, self.username_definition, previous=self)
+
+    def startRecording(self, metadata: StreamMetadata):
+        self._start_time = time.time()
+        self._coordinator.assign(self, metadata)
+
+    def stopRecording(self):
+        self._coordinator.send_command(self, ("stop", self.recorder_id))
+
+    def abort(self, error: Exception):
+        self.stopRecording()
+
+    def finish(self):
+        self._coordinator.send_command(self, ("finish", self.recorder_id))
+        self._coordinator.release(self)
+
+    def run(self):
+        raise Exception("Remote recorders can not be run locally")
+
+    def _applyStatus(self, status: dict[str, Any]):
+        self._recording = status["recording"]
+        self._is_initialized = status["initialized"]
+        self._bytes_written = status["bytes_written"]
+
+        if status["first_byte_time"] != 0 and self._first_byte_time == 0:
+            self._first_byte_time = time.time()
+
+        if status["error"] is not None and self._encountered_error is None:
+            self._encountered_error = RemoteRecorderError(status["error"])
+
+        if status["recording"]:
+            self._ever_recorded = True
+        self._start_failure = status["start_failure"]
+
+        # use our own clock for the stop time, the worker might be on a different host
+        if self._stop_time == 0 and not self._recording and (self._is_initialized or self._encountered_error is not None):
+            self._stop_time = time.time()
+
+    # the worker knows why its recorder failed, the error itself only arrives as a string
+    def getStartFailure(self) -> Optional[str]:
+        if self._start_failure is not None:
+            return self._start_failure
+        return super().getStartFailure()
+
+    def _markFailed(self, error: Exception):
+        if self._encountered_error is None:
+            self._encountered_error = error
+
+        self._recording = False
+        self._is_initialized = True
+        self._stop_time = time.time()
+
+class Coordinator(Thread):
+    def __init__(self, address: str, authkey: str, placement: str, heartbeat_timeout: float):
+        super().__init__(name="shard-coordinator")
+        self.daemon = True
+
+        self._listener = Listener(parse_address(address), authkey=authkey.encode("utf-8"))
+        self._placement = placement
+        self._heartbeat_timeout = heartbeat_timeout
+
+        self._lock = Lock()
+        self._workers: dict[str, _WorkerHandle] = {}
+        self._ring: list[tuple[int, str]] = []
+
+    def run(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                log.error(f"Error while accepting worker connection: {repr(e)}")
+                continue
+
+            Thread(target=self._handle_worker, args=(connection,), daemon=True).start()
+
+    def _rebuild_ring(self):
+        # 64 virtual nodes per worker, so the users are spread evenly
+        self._ring = sorted((_hash(f"{name}#{i}"), name) for name in self._workers for i in range(64))
+
+    def _handle_worker(self, connection: Connection):
+        try:
+            if not connection.poll(self._heartbeat_timeout):
+                raise Exception("Worker did not introduce itself")
+
+            message = connection.recv()
+            if message[0] != "hello":
+                raise Exception(f"Unexpected message {message[0]}")
+        except Exception as e:
+            log.error(f"Rejecting worker connection: {repr(e)}")
+            connection.close()
+            return
+
+        worker = _WorkerHandle(message[1], connection)
+
+        with self._lock:
+            if worker.name in self._workers:
+                log.error(f"A worker with the name {worker.name} is already connected, rejecting the new one")
+                connection.close()
+                return
+
+            self._workers[worker.name] = worker
+            self._rebuild_ring()
+
+        log.info(f"Worker {worker.name} connected")
+
+        try:
+            while True:
+                if not connection.poll(self._heartbeat_timeout):
+                    raise WorkerLostError(f"No heartbeat from worker {worker.name} for {self._heartbeat_timeout} seconds")
+
+                message = connection.recv()
+
+                if message[0] == "status":
+                    with self._lock:
+                        for recorder_id, status in message[1].items():
+                            recorder = worker.recorders.get(recorder_id)
+                            if recorder is not None:
+                                recorder._applyStatus(status)
+        except Exception as e:
+            log.error(f"Lost connection to worker {worker.name}: {repr(e)}")
+
+        connection.close()
+
+        with self._lock:
+            worker.alive = False
+            del self._workers[worker.name]
+            self._rebuild_ring()
+
+            # the main loop restarts these on one of the remaining workers if the streams are still live
+            for recorder in worker.recorders.values():
+                recorder._markFailed(WorkerLostError(f"Worker {worker.name} was lost"))
+
+            worker.recorders = {}
+
+    def _choose_worker(self, recorder: RemoteRecorder) -> Optional[_WorkerHandle]:
+        if len(self._workers) == 0:
+            return None
+
+        # keep restarted recordings on the same worker, so they can continue writing to the same file
+        if recorder.previous is not None and recorder.previous.worker is not None and recorder.previous.worker.alive:
+            return recorder.previous.worker
+
+        if self._placement == "hash":
+            index = bisect.bisect(self._ring, (_hash(recorder.username_definition.get_id()), ""))
+            return self._workers[self._ring[index % len(self._ring)][1]]
+
+        return min(self._workers.values(), key=lambda w: len(w.recorders))
+
+    def get_recorder(self, username_definition: UsernameDefinition) -> RemoteRecorder:
+        return RemoteRecorder(self, username_definition)
+
+    def assign(self, recorder: RemoteRecorder, metadata: StreamMetadata):
+        with self._lock:
+            worker = self._choose_worker(recorder)
+
+            if worker is None:
+                log.error(f"Can not start recording of {recorder.service_name} user {recorder._username}, because no workers are connected")
+                recorder._markFailed(NoWorkerAvailableError("No workers are connected"))
+                return
+
+            previous_id = None
+            if recorder.previous is not None:
+                previous_id = recorder.previous.recorder_id
+                worker.recorders.pop(previous_id, None)
+                recorder.previous = None # don't keep the whole chain of recorders alive
+
+            recorder.worker = worker
+            worker.recorders[recorder.recorder_id] = recorder
+
+        log.info(f"Assigning {recorder.service_name} user {recorder._username} to worker {worker.name}")
+
+        username_definition = recorder.username_definition
+        self.send_command(recorder, ("start", recorder.recorder_id, previous_id, username_definition.service, username_definition.username, username_definition.parameters, metadata))
+
+    def send_command(self, recorder: RemoteRecorder, message: tuple):
+        worker = recorder.worker
+
+        if worker is None or not worker.alive:
+            return
+
+        try:
+            worker.send(message)
+        except Exception as e:
+            log.error(f"Could not send {message[0]} command to worker {worker.name}: {repr(e)}")
+
+    def release(self, recorder: RemoteRecorder):
+        with self._lock:
+            if recorder.worker is not None:
+                recorder.worker.recorders.pop(recorder.recorder_id, None)
+
+class ShardWorker:
+    def __init__(self, address: str, authkey: str, name: Optional[str], services: dict[str, ServiceBase], plugins: list[tuple[type[Plugin], Any]]):
+        self._address = parse_address(address)
+        self._authkey = authkey.encode("utf-8")
+        self._name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self._services = services
+        self._plugins = plugins
+
+        self._recorders: dict[str, RecorderBase] = {}
+        self._failed_starts: dict[str, str] = {} # recorder_id -> error of recorders that could not even be created
+        self._recorders_lock = Lock()
+
+    def get_recorders(self) -> list[RecorderBase]:
+        with self._recorders_lock:
+            return list(self._recorders.values())
+
+    def run(self):
+        while True:
+            try:
+                connection = Client(self._address, authkey=self._authkey)
+            except Exception as e:
+                log.error(f"Could not connect to coordinator at {self._address[0]}:{self._address[1]}: {repr(e)}")
+                time.sleep(5)
+                continue
+
+            log.info(f"Connected to coordinator at {self._address[0]}:{self._address[1]} as worker {self._name}")
+
+            try:
+                self._run_session(connection)
+            except Exception as e:
+                log.error(f"Lost connection to coordinator: {repr(e)}")
+
+            connection.close()
+
+            # the coordinator is going to reassign the streams to other workers, so we have to stop ours
+            with self._recorders_lock:
+                recorders = list(self._recorders.values())
+                self._recorders = {}
+                self._failed_starts = {}
+
+            for recorder in recorders:
+                recorder.stopRecording()
+                recorder.finish()
+
+            time.sleep(1)
+
+    def _run_session(self, connection: Connection):
+        send_lock = Lock()
+        disconnected = Event()
+
+        def send(message: tuple):
+            with send_lock:
+                connection.send(message)
+
+        def status_loop():
+            while not disconnected.wait(STATUS_INTERVAL):
+                with self._recorders_lock:
+                    statuses = { recorder_id: self._get_status(recorder) for recorder_id, recorder in self._recorders.items() }
+
+                    for recorder_id, error in self._failed_starts.items():
+                        statuses[recorder_id] = { "recording": False, "initialized": True, "error": error, "bytes_written": 0, "first_byte_time": 0, "start_failure": "error" }
+
+                try:
+                    send(("status", statuses))
+                except Exception:
+                    return
+
+        send(("hello", self._name))
+
+        status_thread = Thread(target=status_loop, name="shard-worker-status", daemon=True)
+        status_thread.start()
+
+        try:
+            while True:
+                message = connection.recv()
+
+                if message[0] == "start":
+                    # starting a recorder can block for a while, so we don't want to hold up the other messages
+                    Thread(target=self._start_recorder, args=message[1:], daemon=True).start()
+                elif message[0] == "stop":
+                    with self._recorders_lock:
+                        recorder = self._recorders.get(message[1])
+
+                    if recorder is not None:
+                        recorder.stopRecording()
+                elif message[0] == "finish":
+                    with self._recorders_lock:
+                        recorder = self._recorders.pop(message[1], None)
+                        self._failed_starts.pop(message[1], None)
+
+                    if recorder is not None:
+                        recorder.finish()
+        finally:
+            disconnected.set()
+
+    def _get_status(self, recorder: RecorderBase):
+        return {
+            "recording": recorder.isRecording(),
+            "initialized": recorder.isInitialized(),
+            "error": repr(recorder._encountered_error) if recorder._encountered_error is not None else None,
+            "bytes_written": recorder.getBytesWritten(),
+            "first_byte_time": recorder._first_byte_time,
+            "start_failure": recorder.getStartFailure(),
+        }
+
+    def _start_recorder(self, recorder_id: str, previous_id: Optional[str], service_name: str, username: str, params: list[str], metadata: StreamMetadata):
+        try:
+            previous = None
+            with self._recorders_lock:
+                if previous_id is not None:
+                    previous = self._recorders.pop(previous_id, None)
+                    self._failed_starts.pop(previous_id, None)
+
+            if previous is not None:
+                recorder = previous.getFreshClone()
+            else:
+                recorder = self._services[service_name].get_recorder(username, params, self._plugins)
+
+            with self._recorders_lock:
+                self._recorders[recorder_id] = recorder
+
+            recorder.startRecording(metadata)
+        except Exception as e:
+            log.error(f"Error while starting recorder for {service_name} user {username}: {repr(e)}")
+
+            with self._recorders_lock:
+                self._recorders.pop(recorder_id, None)
+                self._failed_starts[recorder_id] = repr(e)
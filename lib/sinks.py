@@ -0,0 +1,335 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Iterator, Optional
+import logging
+import os
+import re
+import shlex
+import subprocess
+
+import requests
+
+from lib import metrics
+from lib.config import SinkConfig
+from lib.s3 import MultipartUpload, S3Client
+
+log = logging.getLogger(__file__)
+
+sink_dropped_bytes = metrics.REGISTRY.counter("sink_dropped_bytes_total", "Number of bytes that were dropped because a sink could not keep up", ("service", "username", "sink"))
+sink_disconnects = metrics.REGISTRY.counter("sink_disconnects_total", "Number of times a sink was disconnected because it could not keep up or failed", ("service", "username", "sink"))
+
+class Sink(ABC):
+    # called from the read loop of the recorder for every chunk, must never block or raise
+    @abstractmethod
+    def write(self, data: bytes):
+        pass
+
+    # called when the recording stops, the sink should flush whatever is still buffered and clean up afterwards
+    @abstractmethod
+    def close(self):
+        pass
+
+# feeds the chunks to a consumer running in its own thread through a bounded buffer, so a slow consumer never stalls the recorder.
+# the chunks are the same bytes objects the recorder writes to its file, so they are shared between all sinks without copying them
+class QueuedSink(Sink, Thread):
+    def __init__(self, name: str, labels: tuple[str, str, str], max_buffer: int, overflow: str):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+
+        self._labels = labels
+        self._max_buffer = max_buffer
+        self._overflow = overflow
+
+        self._buffer: deque[bytes] = deque()
+        self._buffered_bytes = 0
+        self._buffer_condition = Condition()
+        self._closed = False
+        self._disconnected = False
+        self._dropping = False
+
+    def write(self, data: bytes):
+        with self._buffer_condition:
+            if self._closed or self._disconnected:
+                return
+
+            if self._buffered_bytes + len(data) > self._max_buffer:
+                if self._overflow == "disconnect":
+                    log.warning(f"Sink {self.name} can't keep up, disconnecting it")
+                    sink_disconnects.inc(labels=self._labels)
+                    self._disconnected = True
+                    self._buffer.clear()
+                    self._buffered_bytes = 0
+                    self._buffer_condition.notify()
+                else:
+                    if not self._dropping:
+                        log.warning(f"Sink {self.name} can't keep up, dropping data")
+                        self._dropping = True
+                    sink_dropped_bytes.inc(len(data), self._labels)
+                return
+
+            self._dropping = False
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+            self._buffer_condition.notify()
+
+    def close(self):
+        with self._buffer_condition:
+            self._closed = True
+            self._buffer_condition.notify()
+
+    # yields the buffered chunks until the sink is closed and the buffer is empty, or until it is disconnected
+    def _chunks(self) -> Iterator[bytes]:
+        while True:
+            with self._buffer_condition:
+                while len(self._buffer) == 0 and not self._closed and not self._disconnected:
+                    self._buffer_condition.wait()
+
+                if self._disconnected or len(self._buffer) == 0:
+                    return
+
+                data = self._buffer.popleft()
+                self._buffered_bytes -= len(data)
+
+            yield data
+
+    def run(self):
+        try:
+            self._consume(self._chunks())
+        except Exception as e:
+            with self._buffer_condition:
+                disconnected = self._disconnected
+
+            # errors after a disconnect are expected, since the consumer is cut off in the middle of the stream
+            if not disconnected:
+                log.error(f"Error in sink {self.name}: {repr(e)}")
+                sink_disconnects.inc(labels=self._labels)
+
+        # stop buffering data nobody is going to read anymore
+        with self._buffer_condition:
+            self._disconnected = True
+            self._buffer.clear()
+            self._buffered_bytes = 0
+
+    @abstractmethod
+    def _consume(self, chunks: Iterator[bytes]):
+        pass
+
+# writes the stream into the stdin of a process, e.g. ffmpeg restreaming it or an analysis tool
+class PipeSink(QueuedSink):
+    def __init__(self, command: str, labels: tuple[str, str, str], max_buffer: int, overflow: str):
+        super().__init__(f"pipe-sink-{labels[1]}-{labels[2]}", labels, max_buffer, overflow)
+
+        self._command = command
+
+    def _consume(self, chunks: Iterator[bytes]):
+        process = subprocess.Popen(shlex.split(self._command), stdin=subprocess.PIPE)
+        assert process.stdin is not None
+
+        try:
+            for data in chunks:
+                process.stdin.write(data)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            process.wait()
+
+# sends the stream as a chunked POST request, e.g. to a local restreaming server
+class HttpSink(QueuedSink):
+    def __init__(self, url: str, labels: tuple[str, str, str], max_buffer: int, overflow: str):
+        super().__init__(f"http-sink-{labels[1]}-{labels[2]}", labels, max_buffer, overflow)
+
+        self._url = url
+
+    def _consume(self, chunks: Iterator[bytes]):
+        response = requests.post(self._url, data=chunks, headers={ "Content-Type": "video/mp2t" }, timeout=10)
+        response.raise_for_status()
+
+S3_STATE_PATTERN = re.compile(r"^(.+)\.s3-(\d+)\.json$")
+
+# the sinks that are currently uploading a recording, by the path of their upload state
+_active_uploads: dict[str, "S3Sink"] = {}
+_active_uploads_lock = Lock()
+
+def get_s3_state_path(recording_path: str, index: int):
+    return f"{recording_path}.s3-{index}.json"
+
+def create_s3_client(sink_config: SinkConfig):
+    # the fields are checked by the config validation
+    assert sink_config.url is not None and sink_config.bucket is not None
+    assert sink_config.access_key is not None and sink_config.secret_key is not None
+    return S3Client(sink_config.url, sink_config.bucket, sink_config.region, sink_config.access_key, sink_config.secret_key)
+
+# uploads the recording to S3 compatible storage while it is being written. the data isn't buffered in memory,
+# instead the sink only counts the bytes and the complete parts are read back from the recording file, which is still in the page cache.
+# this way a slow upload never drops data, and an upload that was interrupted can continue from the file after a restart
+class S3Sink(Sink, Thread):
+    def __init__(self, sink_config: SinkConfig, labels: tuple[str, str, str], recording_path: str, start_offset: int):
+        Thread.__init__(self, name=f"s3-sink-{labels[1]}-{labels[2]}")
+        self.daemon = True
+
+        self._client = create_s3_client(sink_config)
+        self._key = sink_config.key.format(service=labels[0], username=labels[1], filename=os.path.basename(recording_path))
+        self._part_size = sink_config.part_size
+        self._concurrency = sink_config.upload_concurrency
+        self._labels = labels
+        self._state_path = get_s3_state_path(recording_path, int(labels[2]))
+
+        # the file stays readable through this descriptor even if it is moved before the upload is done
+        self._fd = os.open(recording_path, os.O_RDONLY)
+        self._written = start_offset
+        self._wakeup_at = 0 # the consumer only needs to be woken up once the next part is complete
+        self._condition = Condition()
+        self._closed = False
+
+        with _active_uploads_lock:
+            self._previous = _active_uploads.get(self._state_path)
+            _active_uploads[self._state_path] = self
+
+    def write(self, data: bytes):
+        with self._condition:
+            self._written += len(data)
+
+            if self._written >= self._wakeup_at:
+                self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def run(self):
+        upload: Optional[MultipartUpload] = None
+
+        try:
+            # a restarted recorder appends to the same file, so the upload of the previous run has to be done with it first
+            if self._previous is not None:
+                self._previous.join()
+
+            upload = MultipartUpload.load_or_create(self._client, self._state_path, self._key, self._part_size, self._concurrency)
+
+            while True:
+                next_part_end = upload.next_part_end()
+
+                with self._condition:
+                    self._wakeup_at = next_part_end
+                    while self._written < next_part_end and not self._closed:
+                        self._condition.wait()
+                    closed = self._closed
+
+                size = os.fstat(self._fd).st_size
+                upload.upload_parts(self._fd, size)
+
+                if closed:
+                    break
+
+                if size < next_part_end:
+                    # the end of the part is still in the write buffer of the recorder
+                    with self._condition:
+                        self._condition.wait(1)
+
+            upload.wait()
+        except Exception as e:
+            log.error(f"Error in sink {self.name}, the upload is going to be completed when the recording is finished: {repr(e)}")
+            sink_disconnects.inc(labels=self._labels)
+        finally:
+            if upload is not None:
+                upload.close()
+
+            os.close(self._fd)
+
+            with _active_uploads_lock:
+                if _active_uploads.get(self._state_path) is self:
+                    del _active_uploads[self._state_path]
+
+# uploads whatever is missing of a recording and completes the upload, or aborts it if the recording doesn't exist anymore
+def complete_s3_upload(sink_config: SinkConfig, state_path: str, recording_path: str):
+    with _active_uploads_lock:
+        active = _active_uploads.get(state_path)
+
+    if active is not None:
+        active.join()
+
+    if not os.path.exists(state_path):
+        return # no upload was started for this recording
+
+    upload = MultipartUpload.load(create_s3_client(sink_config), state_path, sink_config.upload_concurrency)
+
+    if not os.path.exists(recording_path):
+        log.warning(f"Recording {recording_path} doesn't exist anymore, aborting its upload")
+        upload.abort()
+        return
+
+    fd: Optional[int] = None
+
+    try:
+        fd = os.open(recording_path, os.O_RDONLY)
+        upload.complete(fd, os.fstat(fd).st_size)
+    except Exception:
+        upload.close()
+        raise
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+# called when a recording is finished, blocks until all of its uploads are complete
+def finish_sinks(sink_configs: list[SinkConfig], service: str, recording_path: str):
+    for index, sink_config in enumerate(sink_configs):
+        if sink_config.type != "s3" or (sink_config.services is not None and service not in sink_config.services):
+            continue
+
+        try:
+            complete_s3_upload(sink_config, get_s3_state_path(recording_path, index), recording_path)
+        except Exception as e:
+            log.error(f"Could not complete the upload of {recording_path}, it is going to be resumed after a restart: {repr(e)}")
+
+# completes the uploads that were left over when the process stopped during a recording
+def resume_uploads(sink_configs: list[SinkConfig], paths: list[str]):
+    for path in paths:
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                match = S3_STATE_PATTERN.match(filename)
+                if match is None:
+                    continue
+
+                index = int(match.group(2))
+                if index >= len(sink_configs) or sink_configs[index].type != "s3":
+                    log.warning(f"Found the upload state {filename}, but there is no S3 sink with index {index} anymore")
+                    continue
+
+                log.info(f"Resuming the upload of {match.group(1)}")
+
+                try:
+                    complete_s3_upload(sink_configs[index], os.path.join(dirpath, filename), os.path.join(dirpath, match.group(1)))
+                except Exception as e:
+                    log.error(f"Could not resume the upload of {match.group(1)}: {repr(e)}")
+
+# recording_path is the file the recorder writes to and start_offset the size it had when the recording started.
+# the uploads of the S3 sinks are only completed by finish_sinks, since a restarted recorder continues to write to the same file
+def create_sinks(sink_configs: list[SinkConfig], service: str, username: str, recording_path: str, start_offset: int) -> list[Sink]:
+    sinks: list[Sink] = []
+
+    for index, sink_config in enumerate(sink_configs):
+        if sink_config.services is not None and service not in sink_config.services:
+            continue
+
+        labels = (service, username, str(index))
+        sink: S3Sink | QueuedSink
+
+        # the targets are checked by the config validation
+        if sink_config.type == "s3":
+            sink = S3Sink(sink_config, labels, recording_path, start_offset)
+        elif sink_config.type == "pipe":
+            assert sink_config.command is not None
+            sink = PipeSink(sink_config.command.format(service=service, username=username), labels, sink_config.max_buffer, sink_config.overflow)
+        else:
+            assert sink_config.url is not None
+            sink = HttpSink(sink_config.url.format(service=service, username=username), labels, sink_config.max_buffer, sink_config.overflow)
+
+        sink.start()
+        sinks.append(sink)
+
+    return sinks
@@ -0,0 +1,64 @@
+from threading import Event, Thread
+from typing import Callable, Iterable
+from weakref import WeakKeyDictionary
+import logging
+import time
+
+from lib import metrics
+from lib.recorder_base import RecorderBase
+
+log = logging.getLogger(__file__)
+
+recorder_stalls = metrics.REGISTRY.counter("recorder_stalls_total", "Number of recorders that were aborted because they stopped receiving data", ("service", "username"))
+
+class RecorderStalledError(Exception):
+    pass
+
+class StallWatchdog(Thread):
+    def __init__(self, get_recorders: Callable[[], Iterable[RecorderBase]], stall_timeout: float):
+        super().__init__(name="stall-watchdog")
+        self.daemon = True
+
+        self._get_recorders = get_recorders
+        self._stall_timeout = stall_timeout
+        self._check_interval = min(5.0, stall_timeout / 4)
+
+        # recorder -> (bytes written, time at which this byte count was first observed)
+        self._progress: WeakKeyDictionary[RecorderBase, tuple[int, float]] = WeakKeyDictionary()
+
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.error(f"Error in stall watchdog: {repr(e)}")
+
+    def check(self):
+        now = time.monotonic()
+
+        for recorder in self._get_recorders():
+            if not recorder.isRecording():
+                self._progress.pop(recorder, None)
+                continue
+
+            bytes_written = recorder.getBytesWritten()
+            last_bytes_written, last_progress_time = self._progress.get(recorder, (-1, now))
+
+            if bytes_written != last_bytes_written:
+                self._progress[recorder] = (bytes_written, now)
+                continue
+
+            stalled_for = now - last_progress_time
+
+            if stalled_for >= self._stall_timeout:
+                service, username = recorder.getMetricLabels()
+                log.warning(f"Recorder for {service} user {username} did not receive any data for {stalled_for:.0f} seconds, aborting it")
+
+                recorder_stalls.inc(labels=(service, username))
+                recorder.abort(RecorderStalledError(f"No data received for {stalled_for:.0f} seconds"))
+                self._progress.pop(recorder, None)
+
+    def stop(self):
+        self._stop_event.set()
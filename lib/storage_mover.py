@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+from threading import Event, Lock, Thread
+from typing import Optional
+import errno
+import logging
+import os
+import shutil
+import time
+
+from lib import bandwidth, metrics
+from lib.plugin_runner import PluginRunner
+from lib.stream_metadata import StreamMetadata
+from plugins.plugin_base import Plugin
+
+log = logging.getLogger(__file__)
+
+storage_moves_pending = metrics.REGISTRY.gauge("storage_moves_pending", "Number of finished recordings waiting to be moved from the scratch to the bulk storage")
+storage_moved_bytes = metrics.REGISTRY.counter("storage_moved_bytes_total", "Number of bytes moved from the scratch to the bulk storage")
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+@dataclass
+class PendingMove:
+    path: str # path of the recording, all files next to it with the same name and a different extension are moved as well
+    ready_time: float
+    metadata: Optional[StreamMetadata]
+    plugins: list[Plugin]
+
+def get_free_space(path: str):
+    return shutil.disk_usage(path).free
+
+class StorageMover(Thread):
+    def __init__(self, scratch_path: str, bulk_path: str, bandwidth_limit: Optional[int], min_scratch_free: int, move_delay: int):
+        super().__init__(name="storage-mover")
+        self.daemon = True
+
+        self._scratch_path = os.path.abspath(scratch_path)
+        self._bulk_path = os.path.abspath(bulk_path)
+        self._min_scratch_free = min_scratch_free
+        self._move_delay = move_delay
+
+        self._bandwidth_client = bandwidth.MANAGER.register("storage-mover", "bulk", max_rate=bandwidth_limit)
+
+        self._pending: list[PendingMove] = []
+        self._pending_lock = Lock()
+        self._wakeup = Event()
+
+    # everything that is still on the scratch storage when we start is left over from a previous run, so it can be moved right away
+    def enqueue_leftovers(self):
+        for dirpath, _, filenames in os.walk(self._scratch_path):
+            with self._pending_lock:
+                for filename in filenames:
+                    if not filename.endswith(".partial"):
+                        self._pending.append(PendingMove(os.path.join(dirpath, filename), 0, None, []))
+                storage_moves_pending.set(len(self._pending))
+
+        self._wakeup.set()
+
+    def enqueue(self, path: str, metadata: Optional[StreamMetadata], plugins: list[Plugin]):
+        with self._pending_lock:
+            self._pending.append(PendingMove(path, time.time() + self._move_delay, metadata, plugins))
+            storage_moves_pending.set(len(self._pending))
+
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            self._wakeup.wait(10)
+            self._wakeup.clear()
+
+            while True:
+                move = self._next_move()
+                if move is None:
+                    break
+
+                try:
+                    final_path = self._move_recording(move.path)
+                except Exception as e:
+                    log.error(f"Error while moving {move.path} to the bulk storage: {repr(e)}")
+
+                    # try again later, the bulk storage might just be unavailable at the moment
+                    move.ready_time = time.time() + 60
+                    with self._pending_lock:
+                        self._pending.append(move)
+                    break
+
+                with self._pending_lock:
+                    storage_moves_pending.set(len(self._pending))
+
+                if final_path is not None and move.metadata is not None and len(move.plugins) > 0:
+                    PluginRunner(move.plugins, "handle_recording_moved", [ move.metadata, final_path ], {}).run()
+
+    def _next_move(self) -> Optional[PendingMove]:
+        now = time.time()
+
+        # when the scratch storage is running full we move everything, even if the delay hasn't passed yet
+        scratch_full = self._min_scratch_free > 0 and get_free_space(self._scratch_path) < self._min_scratch_free
+
+        with self._pending_lock:
+            candidates = [ m for m in self._pending if m.ready_time <= now or scratch_full ]
+
+            if len(candidates) == 0:
+                return None
+
+            move = min(candidates, key=lambda m: m.ready_time)
+            self._pending.remove(move)
+            return move
+
+    def _move_recording(self, path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            # this also happens for leftovers, where the files of a recording are moved together with the first one
+            log.debug(f"Recording {path} doesn't exist anymore, not moving it")
+            return None
+
+        directory = os.path.dirname(os.path.abspath(path))
+        base_name = os.path.splitext(os.path.basename(path))[0]
+        files = [ f for f in os.listdir(directory) if os.path.splitext(f)[0] == base_name or f.startswith(os.path.basename(path) + ".") ]
+
+        target_directory = os.path.join(self._bulk_path, os.path.relpath(directory, self._scratch_path))
+        os.makedirs(target_directory, exist_ok=True)
+
+        total_size = sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+        if get_free_space(target_directory) < total_size:
+            raise Exception(f"Not enough free space on the bulk storage ({total_size} bytes needed)")
+
+        for filename in files:
+            self._move_file(os.path.join(directory, filename), os.path.join(target_directory, filename))
+
+        log.info(f"Moved {len(files)} file(s) of recording {base_name} to {target_directory}")
+
+        return os.path.join(target_directory, os.path.basename(path))
+
+    def _move_file(self, source: str, target: str):
+        size = os.path.getsize(source)
+
+        if os.stat(source).st_dev == os.stat(os.path.dirname(target)).st_dev:
+            os.replace(source, target)
+            storage_moved_bytes.inc(size)
+            return
+
+        partial_target = target + ".partial"
+
+        with open(source, "rb") as source_file, open(partial_target, "wb") as target_file:
+            self._copy(source_file.fileno(), target_file.fileno(), size)
+            target_file.flush()
+            os.fsync(target_file.fileno())
+
+        shutil.copystat(source, partial_target)
+        os.replace(partial_target, target)
+        os.unlink(source)
+
+    def _copy(self, source_fd: int, target_fd: int, size: int):
+        use_copy_file_range = hasattr(os, "copy_file_range")
+        copied = 0
+
+        while copied < size:
+            chunk_size = min(COPY_CHUNK_SIZE, size - copied)
+            written = 0
+
+            if use_copy_file_range:
+                try:
+                    # lets the kernel (or the NFS server with server side copy) copy the data without it passing through python
+                    written = os.copy_file_range(source_fd, target_fd, chunk_size)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+                    use_copy_file_range = False
+
+            if not use_copy_file_range:
+                data = memoryview(os.read(source_fd, chunk_size))
+                written = len(data)
+
+                while len(data) > 0:
+                    data = data[os.write(target_fd, data):]
+
+            if written == 0:
+                raise Exception("Source file got shorter while copying it")
+
+            copied += written
+            storage_moved_bytes.inc(written)
+            self._bandwidth_client.consume(written)
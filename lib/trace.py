@@ -0,0 +1,77 @@
+from typing import Any, Iterator, Optional, TextIO
+import gzip
+import json
+import logging
+import time
+
+log = logging.getLogger(__file__)
+
+TRACE_VERSION = 1
+FLUSH_INTERVAL = 60
+
+# records the results of the service updates and the lifecycle of the recorders as gzipped JSON lines, so the scheduling can be
+# replayed later with different settings (see benchmarks/replay_trace.py).
+# only the changes of the live status are written, so a trace of a day with thousands of watched users stays small
+class TraceWriter:
+    def __init__(self, path: str, settings: dict[str, float]):
+        self._file: Optional[TextIO] = None
+        self._last_flush = time.monotonic()
+
+        try:
+            # every run appends a new gzip member, which are read as a single stream
+            self._file = gzip.open(path, "at", encoding="utf-8")
+        except OSError as e:
+            log.error(f"Could not open trace file {path}, nothing is going to be traced: {repr(e)}")
+            return
+
+        self._write({ "type": "header", "version": TRACE_VERSION, "t": time.time(), "settings": settings })
+
+    def _write(self, event: dict[str, Any]):
+        if self._file is None:
+            return
+
+        self._file.write(json.dumps(event, separators=(",", ":")) + "\n")
+
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = time.monotonic()
+
+    def settings(self, now: float, settings: dict[str, float]):
+        self._write({ "type": "settings", "t": now, "settings": settings })
+
+    def watches(self, now: float, usernames: dict[str, list[str]]):
+        self._write({ "type": "watches", "t": now, "watches": usernames })
+
+    def poll(self, now: float, service: str, went_live: set[str], went_offline: set[str], started_at: dict[str, float]):
+        self._write({
+            "type": "poll",
+            "t": now,
+            "service": service,
+            "went_live": sorted(went_live),
+            "went_offline": sorted(went_offline),
+            "started_at": started_at,
+        })
+
+    def poll_error(self, now: float, service: str):
+        self._write({ "type": "poll_error", "t": now, "service": service })
+
+    def start(self, now: float, service: str, username: str):
+        self._write({ "type": "start", "t": now, "service": service, "username": username })
+
+    # the failure is the reason the recorder couldn't start, recorded tells if it received any data before it stopped
+    def stop(self, now: float, service: str, username: str, failure: Optional[str], recorded: bool):
+        self._write({ "type": "stop", "t": now, "service": service, "username": username, "failure": failure, "recorded": recorded })
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_trace(path: str) -> Iterator[dict[str, Any]]:
+    with gzip.open(path, "rt", encoding="utf-8") as trace_file:
+        try:
+            for line in trace_file:
+                if line.strip() != "":
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            pass # the process was killed while writing the last event
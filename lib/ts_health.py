@@ -0,0 +1,350 @@
+from dataclasses import dataclass, field
+from threading import Event, Thread
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+import logging
+import os
+
+# numpy is optional, np is None without it. the type checker always sees the real module
+if TYPE_CHECKING:
+    import numpy as np
+else:
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+from lib import metrics
+from lib.recorder_base import RecorderBase
+
+log = logging.getLogger(__file__)
+
+ts_continuity_errors = metrics.REGISTRY.counter("ts_continuity_errors_total", "Number of continuity counter errors found in active recordings", ("service", "username"))
+ts_timestamp_gaps = metrics.REGISTRY.counter("ts_timestamp_gaps_total", "Number of PCR and PTS gaps found in active recordings", ("service", "username"))
+ts_sync_losses = metrics.REGISTRY.counter("ts_sync_losses_total", "Number of times the packet sync was lost in active recordings", ("service", "username"))
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+NULL_PID = 0x1FFF
+TIMESTAMP_CLOCK = 90000
+TIMESTAMP_WRAP = 1 << 33
+
+CHUNK_PACKETS = 256 * 1024 # ~48 MB per step, which keeps the temporary arrays small
+
+# the first bytes of every packet, which contain everything except the PES headers.
+# they are copied out of the packets first, so all the following steps work on a small contiguous array
+HEADER_SIZE = 12
+if np is not None:
+    HEADER_DTYPE = np.dtype([
+        ("sync", "u1"),
+        ("pid", ">u2"), # including the error, payload unit start and priority flags
+        ("flags", "u1"), # scrambling, adaptation field control and continuity counter
+        ("af_length", "u1"),
+        ("af_flags", "u1"),
+        ("pcr", "u1", (6,)),
+    ])
+
+@dataclass
+class TsHealthReport:
+    bytes: int = 0
+    packets: int = 0
+    sync_losses: int = 0
+    skipped_bytes: int = 0
+    continuity_errors: dict[int, int] = field(default_factory=dict) # pid -> count
+    discontinuities: int = 0 # packets with the discontinuity indicator set
+    pcr_gaps: int = 0
+    max_pcr_gap: float = 0.0 # seconds
+    pts_gaps: dict[int, int] = field(default_factory=dict) # pid -> count
+    max_pts_gap: float = 0.0 # seconds
+    duration: float = 0.0 # seconds, from the PCR
+    bitrate_interval: float = 10.0 # seconds
+    bitrate: list[float] = field(default_factory=list) # bytes per second for every interval
+
+    def is_healthy(self):
+        return self.sync_losses == 0 and len(self.continuity_errors) == 0 and self.pcr_gaps == 0 and len(self.pts_gaps) == 0
+
+    def summary(self):
+        return (
+            f"{self.bytes / 1000**3:.2f} GB, {self.duration / 60:.1f} min, "
+            f"{sum(self.continuity_errors.values())} continuity errors, {self.sync_losses} sync losses, "
+            f"{self.pcr_gaps} PCR gaps (max {self.max_pcr_gap:.1f}s), {sum(self.pts_gaps.values())} PTS gaps (max {self.max_pts_gap:.1f}s), "
+            f"{self.discontinuities} discontinuities"
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "healthy": self.is_healthy(),
+            "bytes": self.bytes,
+            "packets": self.packets,
+            "sync_losses": self.sync_losses,
+            "skipped_bytes": self.skipped_bytes,
+            "continuity_errors": { str(pid): count for pid, count in self.continuity_errors.items() },
+            "discontinuities": self.discontinuities,
+            "pcr_gaps": self.pcr_gaps,
+            "max_pcr_gap": self.max_pcr_gap,
+            "pts_gaps": { str(pid): count for pid, count in self.pts_gaps.items() },
+            "max_pts_gap": self.max_pts_gap,
+            "duration": self.duration,
+            "bitrate_interval": self.bitrate_interval,
+            "bitrate": [ round(b) for b in self.bitrate ],
+        }
+
+# analyzes the packet headers of a recording with numpy, without looking at the packets one by one in python.
+# the state is kept between calls, so a growing file can be analyzed in small steps while it is recorded
+class TsHealthAnalyzer:
+    def __init__(self, max_gap: float = 1.0, bitrate_interval: float = 10.0):
+        if np is None:
+            raise Exception("The analysis of recordings requires numpy to be installed (uv sync --extra ts-health)")
+
+        self.report = TsHealthReport(bitrate_interval=bitrate_interval)
+        self.offset = 0 # position in the file up to which it has been analyzed
+
+        self._max_gap = max_gap
+        self._last_cc: dict[int, int] = {}
+        self._pcr_pid: Optional[int] = None
+        self._last_pcr: Optional[tuple[int, int]] = None # (packet number, pcr base)
+        self._last_pts: dict[int, int] = {}
+
+    # analyzes everything that was appended to the file since the last call
+    def analyze_file(self, path: str):
+        size = os.path.getsize(path)
+        if size - self.offset < TS_PACKET_SIZE:
+            return self.report
+
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=self.offset, shape=(size - self.offset,))
+        self.offset += self.analyze(data)
+
+        return self.report
+
+    # returns the number of bytes consumed, everything after that is an incomplete packet
+    def analyze(self, data) -> int:
+        pos = 0
+        end = len(data)
+
+        while end - pos >= TS_PACKET_SIZE:
+            if data[pos] != TS_SYNC_BYTE or (end - pos >= 2 * TS_PACKET_SIZE and data[pos + TS_PACKET_SIZE] != TS_SYNC_BYTE):
+                next_sync = self._find_sync(data, pos)
+                if next_sync is None:
+                    break # not enough data to be sure, try again with more
+
+                if self.report.packets > 0 or pos > 0:
+                    self.report.sync_losses += 1
+                self.report.skipped_bytes += next_sync - pos
+                pos = next_sync
+                continue
+
+            count = min((end - pos) // TS_PACKET_SIZE, CHUNK_PACKETS)
+            raw = data[pos:pos + count * TS_PACKET_SIZE].reshape(-1, TS_PACKET_SIZE)
+            headers = np.ascontiguousarray(raw[:, :HEADER_SIZE]).view(HEADER_DTYPE).reshape(-1)
+
+            # stop in front of the first packet that is out of sync
+            out_of_sync = np.flatnonzero(headers["sync"] != TS_SYNC_BYTE)
+            if len(out_of_sync) > 0:
+                count = int(out_of_sync[0])
+                raw = raw[:count]
+                headers = headers[:count]
+
+            self._analyze_packets(headers, raw)
+            pos += count * TS_PACKET_SIZE
+
+        self.report.bytes += pos
+        return pos
+
+    # looks for two sync bytes one packet apart
+    def _find_sync(self, data, start: int) -> Optional[int]:
+        window = data[start + 1:start + 1 + 64 * TS_PACKET_SIZE]
+        candidates = np.flatnonzero(window[:len(window) - TS_PACKET_SIZE] == TS_SYNC_BYTE)
+        confirmed = candidates[window[candidates + TS_PACKET_SIZE] == TS_SYNC_BYTE]
+
+        if len(confirmed) > 0:
+            return start + 1 + int(confirmed[0])
+        if len(window) < 64 * TS_PACKET_SIZE:
+            return None
+        return start + 1 + len(window) - TS_PACKET_SIZE # nothing in this window, skip it
+
+    def _analyze_packets(self, headers, raw):
+        first_packet = self.report.packets
+        self.report.packets += len(headers)
+
+        pid_field = headers["pid"]
+        pid = pid_field & 0x1FFF
+        flags = headers["flags"]
+        af_length = headers["af_length"]
+        has_payload = (flags & 0x10) != 0
+        has_af = (flags & 0x20) != 0
+        af_flags = np.where(has_af & (af_length > 0), headers["af_flags"], 0)
+        discontinuity = (af_flags & 0x80) != 0
+
+        self.report.discontinuities += int(np.count_nonzero(discontinuity))
+
+        self._check_continuity(pid, flags & 0x0F, has_payload, discontinuity)
+        self._check_pcr(pid, af_flags, af_length, headers["pcr"], first_packet)
+        self._check_pts(pid, pid_field, has_payload, np.where(has_af, af_length.astype(np.int32) + 5, 4), raw)
+
+    def _check_continuity(self, pid, cc, has_payload, discontinuity):
+        # there are only a handful of PIDs in a stream, so going through them one by one is cheaper than sorting all packets
+        counts = np.bincount(pid[has_payload], minlength=NULL_PID + 1)
+        counts[NULL_PID] = 0
+
+        for p in np.flatnonzero(counts):
+            mask = has_payload & (pid == p)
+            counters = cc[mask].astype(np.int8)
+            previous = np.empty_like(counters)
+            previous[1:] = counters[:-1]
+            previous[0] = self._last_cc.get(int(p), -1)
+
+            # a packet may be sent twice with the same counter
+            errors = (counters != ((previous + 1) & 0x0F)) & (counters != previous) & (previous >= 0) & ~discontinuity[mask]
+            error_count = int(np.count_nonzero(errors))
+
+            if error_count > 0:
+                self.report.continuity_errors[int(p)] = self.report.continuity_errors.get(int(p), 0) + error_count
+
+            self._last_cc[int(p)] = int(counters[-1])
+
+    def _check_pcr(self, pid, af_flags, af_length, pcr_bytes, first_packet: int):
+        has_pcr = ((af_flags & 0x10) != 0) & (af_length >= 7)
+
+        if self._pcr_pid is None:
+            pcr_pids = pid[has_pcr]
+            if len(pcr_pids) == 0:
+                return
+            self._pcr_pid = int(pcr_pids[0])
+
+        indices = np.flatnonzero(has_pcr & (pid == self._pcr_pid))
+        if len(indices) == 0:
+            return
+
+        b = pcr_bytes[indices, :5].astype(np.int64)
+        pcr = (b[:, 0] << 25) | (b[:, 1] << 17) | (b[:, 2] << 9) | (b[:, 3] << 1) | (b[:, 4] >> 7)
+        positions = indices + first_packet
+
+        if self._last_pcr is not None:
+            pcr = np.concatenate(([self._last_pcr[1]], pcr))
+            positions = np.concatenate(([self._last_pcr[0]], positions))
+
+        self._last_pcr = (int(positions[-1]), int(pcr[-1]))
+
+        if len(pcr) < 2:
+            return
+
+        deltas = _timestamp_deltas(pcr)
+        gaps = (deltas > self._max_gap) | (deltas < 0)
+        self.report.pcr_gaps += int(np.count_nonzero(gaps))
+        if np.any(gaps):
+            self.report.max_pcr_gap = max(self.report.max_pcr_gap, float(np.max(np.abs(deltas[gaps]))))
+
+        # the time doesn't advance over gaps, so the bitrate is only based on the data that was actually there
+        deltas[gaps] = 0
+        times = self.report.duration + np.cumsum(deltas)
+        self.report.duration = float(times[-1])
+
+        interval = self.report.bitrate_interval
+        bins = (times / interval).astype(np.int64)
+        sizes = np.diff(positions) * TS_PACKET_SIZE
+        first_bin = int(bins[0])
+        totals = np.bincount(bins - first_bin, weights=sizes)
+
+        bitrate = self.report.bitrate
+        if len(bitrate) < first_bin + len(totals):
+            bitrate.extend([ 0.0 ] * (first_bin + len(totals) - len(bitrate)))
+        for i, total in enumerate(totals):
+            bitrate[first_bin + i] += float(total) / interval
+
+    def _check_pts(self, pid, pid_field, has_payload, payload_offsets, raw):
+        # only the packets starting a PES packet contain timestamps, which are just a few dozen per second
+        indices = np.flatnonzero(((pid_field & 0x4000) != 0) & has_payload & (payload_offsets + 14 <= TS_PACKET_SIZE))
+        if len(indices) == 0:
+            return
+
+        offsets = payload_offsets[indices]
+        header = raw[indices[:, None], offsets[:, None] + np.arange(14)].astype(np.int64)
+
+        stream_id = header[:, 3]
+        is_pes = (header[:, 0] == 0) & (header[:, 1] == 0) & (header[:, 2] == 1) & (stream_id >= 0xC0) & (stream_id <= 0xEF) & ((header[:, 7] & 0x80) != 0)
+        if not np.any(is_pes):
+            return
+
+        header = header[is_pes]
+        pes_pids = pid[indices[is_pes]]
+        pts = ((header[:, 9] & 0x0E) << 29) | (header[:, 10] << 22) | ((header[:, 11] & 0xFE) << 14) | (header[:, 12] << 7) | (header[:, 13] >> 1)
+
+        for p in np.unique(pes_pids):
+            stream_pts = pts[pes_pids == p]
+            if int(p) in self._last_pts:
+                stream_pts = np.concatenate(([self._last_pts[int(p)]], stream_pts))
+            self._last_pts[int(p)] = int(stream_pts[-1])
+
+            if len(stream_pts) < 2:
+                continue
+
+            # the frames are not in presentation order, so small steps backwards are expected
+            deltas = _timestamp_deltas(stream_pts)
+            gaps = np.abs(deltas) > self._max_gap
+            gap_count = int(np.count_nonzero(gaps))
+
+            if gap_count > 0:
+                self.report.pts_gaps[int(p)] = self.report.pts_gaps.get(int(p), 0) + gap_count
+                self.report.max_pts_gap = max(self.report.max_pts_gap, float(np.max(np.abs(deltas[gaps]))))
+
+# differences between consecutive 90 kHz timestamps in seconds, with wrap-arounds taken into account
+def _timestamp_deltas(timestamps):
+    deltas = np.diff(timestamps) % TIMESTAMP_WRAP
+    deltas = np.where(deltas > TIMESTAMP_WRAP // 2, deltas - TIMESTAMP_WRAP, deltas)
+    return deltas / TIMESTAMP_CLOCK
+
+def analyze_recording(path: str, max_gap: float = 1.0, bitrate_interval: float = 10.0) -> TsHealthReport:
+    analyzer = TsHealthAnalyzer(max_gap, bitrate_interval)
+    return analyzer.analyze_file(path)
+
+# analyzes the data appended to the active recordings every few seconds, and logs and counts the problems as soon as they appear
+class TsHealthMonitor(Thread):
+    def __init__(self, get_recorders: Callable[[], Iterable[RecorderBase]], interval: float, max_gap: float = 1.0):
+        super().__init__(name="ts-health-monitor")
+        self.daemon = True
+
+        self._get_recorders = get_recorders
+        self._interval = interval
+        self._max_gap = max_gap
+
+        # keyed by the path, since restarted recorders append to the same file
+        self._analyzers: dict[str, TsHealthAnalyzer] = {}
+
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.check()
+            except Exception as e:
+                log.error(f"Error in the recording health monitor: {repr(e)}")
+
+    def check(self):
+        active_paths: set[str] = set()
+
+        for recorder in self._get_recorders():
+            path = recorder.getRecordingPath()
+            if path is None or not path.endswith(".ts") or not os.path.exists(path):
+                continue
+
+            active_paths.add(path)
+            analyzer = self._analyzers.get(path)
+            if analyzer is None:
+                analyzer = self._analyzers[path] = TsHealthAnalyzer(self._max_gap)
+
+            before = (sum(analyzer.report.continuity_errors.values()), analyzer.report.pcr_gaps + sum(analyzer.report.pts_gaps.values()), analyzer.report.sync_losses)
+            report = analyzer.analyze_file(path)
+            after = (sum(report.continuity_errors.values()), report.pcr_gaps + sum(report.pts_gaps.values()), report.sync_losses)
+
+            if after != before:
+                labels = recorder.getMetricLabels()
+                ts_continuity_errors.inc(after[0] - before[0], labels)
+                ts_timestamp_gaps.inc(after[1] - before[1], labels)
+                ts_sync_losses.inc(after[2] - before[2], labels)
+
+                log.warning(f"Recording of {labels[0]} user {labels[1]} has new problems: {report.summary()}")
+
+        for path in self._analyzers.keys() - active_paths:
+            del self._analyzers[path]
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,163 @@
+from typing import BinaryIO, Optional
+import logging
+import struct
+
+log = logging.getLogger(__file__)
+
+# the index is a sidecar file next to the recording (<recording>.tsidx), which starts with a small header,
+# followed by one record per keyframe with the byte offset of its first TS packet and its PTS
+INDEX_MAGIC = b"TSIX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sB3x")
+INDEX_RECORD = struct.Struct("<QQ")
+INDEX_SUFFIX = ".tsidx"
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+# maps the second byte of every TS header to 1 if the payload unit start indicator is set, so the packets starting a PES packet
+# can be found with bytes.find instead of looking at every single packet in python
+_PUSI_TABLE = bytes(1 if b & 0x40 else 0 for b in range(256))
+
+def _decode_pts(data: bytes, pos: int):
+    return ((data[pos] & 0x0E) << 29) | (data[pos + 1] << 22) | ((data[pos + 2] & 0xFE) << 14) | (data[pos + 3] << 7) | (data[pos + 4] >> 1)
+
+# looks for an H.264 IDR slice or SPS in the payload, for streams that don't set the random access indicator
+def _has_h264_keyframe(data: bytes, start: int, end: int):
+    pos = data.find(b"\x00\x00\x01", start, end)
+
+    while pos != -1 and pos + 3 < end:
+        if data[pos + 3] & 0x1F in (5, 7):
+            return True
+        pos = data.find(b"\x00\x00\x01", pos + 3, end)
+
+    return False
+
+# parses the TS packet headers while the data is written to the recording and appends every video keyframe to the index.
+# only the packets that start a new PES packet are looked at in detail, which are just a few dozen per second
+class TsIndexer:
+    def __init__(self, index_path: str, start_offset: int):
+        self._offset = start_offset # offset of the next byte passed to feed in the recording
+        self._remainder = b"" # incomplete packet at the end of the last chunk
+        self._index_file: Optional[BinaryIO] = None
+
+        try:
+            self._index_file = open(index_path, "ab")
+
+            if self._index_file.tell() == 0:
+                self._index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+        except OSError as e:
+            log.error(f"Could not open index file {index_path}, the recording is not going to be indexed: {repr(e)}")
+            self._index_file = None
+
+    def feed(self, data: bytes):
+        if self._index_file is None:
+            return
+
+        if len(self._remainder) > 0:
+            buffer = self._remainder + data
+        else:
+            buffer = data
+
+        base = self._offset - len(self._remainder)
+        self._offset += len(data)
+
+        pos = 0
+        end = len(buffer)
+
+        while end - pos >= TS_PACKET_SIZE:
+            count = (end - pos) // TS_PACKET_SIZE
+            packets_end = pos + count * TS_PACKET_SIZE
+
+            # only process the packets up to the first one that is out of sync
+            sync_bytes = buffer[pos:packets_end:TS_PACKET_SIZE]
+            if sync_bytes.count(TS_SYNC_BYTE) != count:
+                count = next(i for i, b in enumerate(sync_bytes) if b != TS_SYNC_BYTE)
+                packets_end = pos + count * TS_PACKET_SIZE
+
+            flags = buffer[pos + 1:packets_end:TS_PACKET_SIZE].translate(_PUSI_TABLE)
+            i = flags.find(1)
+            while i != -1:
+                self._parse_packet(buffer, pos + i * TS_PACKET_SIZE, base)
+                i = flags.find(1, i + 1)
+
+            pos = packets_end
+
+            if end - pos >= TS_PACKET_SIZE and buffer[pos] != TS_SYNC_BYTE:
+                # lost sync, skip ahead to the next position that looks like the start of a packet
+                next_sync = buffer.find(TS_SYNC_BYTE, pos + 1)
+                while next_sync != -1 and next_sync + TS_PACKET_SIZE < end and buffer[next_sync + TS_PACKET_SIZE] != TS_SYNC_BYTE:
+                    next_sync = buffer.find(TS_SYNC_BYTE, next_sync + 1)
+
+                pos = next_sync if next_sync != -1 else end
+
+        self._remainder = buffer[pos:]
+
+    def _parse_packet(self, data: bytes, pos: int, base: int):
+        packet_end = pos + TS_PACKET_SIZE
+        adaptation_field_control = (data[pos + 3] >> 4) & 0x3
+        payload = pos + 4
+        random_access = False
+
+        if adaptation_field_control & 0x2:
+            adaptation_field_length = data[pos + 4]
+            if adaptation_field_length > 0:
+                random_access = bool(data[pos + 5] & 0x40)
+            payload = pos + 5 + adaptation_field_length
+
+        if not adaptation_field_control & 0x1 or payload + 14 > packet_end:
+            return
+
+        # only video PES packets with a PTS are interesting
+        if data[payload:payload + 3] != b"\x00\x00\x01" or not 0xE0 <= data[payload + 3] <= 0xEF or not data[payload + 7] & 0x80:
+            return
+
+        if not random_access and not _has_h264_keyframe(data, payload + 9 + data[payload + 8], packet_end):
+            return
+
+        assert self._index_file is not None
+        self._index_file.write(INDEX_RECORD.pack(base + pos, _decode_pts(data, payload + 9)))
+
+    def close(self):
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+def read_index(index_path: str) -> list[tuple[int, int]]:
+    with open(index_path, "rb") as index_file:
+        header = index_file.read(INDEX_HEADER.size)
+
+        if len(header) < INDEX_HEADER.size or INDEX_HEADER.unpack(header)[0] != INDEX_MAGIC:
+            raise Exception(f"{index_path} is not a recording index")
+        if INDEX_HEADER.unpack(header)[1] != INDEX_VERSION:
+            raise Exception(f"{index_path} has an unsupported version")
+
+        data = index_file.read()
+
+    # a crash while writing can leave an incomplete record at the end
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    return list(INDEX_RECORD.iter_unpack(data[:usable]))
+
+# converts the keyframes of an index to (offset, seconds since the first keyframe).
+# the PTS can wrap around or jump when the recording was restarted, in which case the gap is counted like the previous keyframe interval
+def index_timeline(entries: list[tuple[int, int]], max_gap: float = 30.0) -> list[tuple[int, float]]:
+    timeline: list[tuple[int, float]] = []
+    time = 0.0
+    last_delta = 0.0
+
+    for i, (offset, pts) in enumerate(entries):
+        if i > 0:
+            delta = ((pts - entries[i - 1][1]) % PTS_WRAP) / PTS_CLOCK
+            if delta > max_gap:
+                delta = last_delta
+            time += delta
+            last_delta = delta
+
+        timeline.append((offset, time))
+
+    return timeline
+
+def get_index_path(recording_path: str):
+    return recording_path + INDEX_SUFFIX
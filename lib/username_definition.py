@@ -6,6 +6,7 @@ class UsernameDefinition:
     service: str
     username: str
     parameters: List[str]
+    priority: int = 0 # recordings with a higher priority can preempt the ones with a lower priority
 
     def get_id(self):
         return f"{self.service}={self.username}"
\ No newline at end of file
@@ -1,4 +1,5 @@
 import argparse
+import copy
 import time
 import os
 import logging
@@ -6,17 +7,31 @@ import re
 import importlib
 import sys
 import json
+from threading import Event
 from typing import Any, Dict, Type, cast
 import signal
 
 from pydantic import ValidationError
 import yaml
 
+from lib import bandwidth, metrics, profiler, ts_health
+from lib.buffer_tuning import TUNER
 from lib.recorder_base import RecorderBase
+from lib.recording_server import RecordingServer
+from lib.scheduler import Scheduler
+from lib.admission import AdmissionController
+from lib.archiver import Archiver
+from lib.backoff import StartBackoff
+from lib.trace import TraceWriter
+from lib.ts_health import TsHealthMonitor
+from lib.sharding import Coordinator, ShardWorker
+from lib.sinks import resume_uploads
+from lib.stall_watchdog import StallWatchdog
+from lib.storage_mover import StorageMover
 from lib.service_base import ServiceBase
 from lib.username_definition import UsernameDefinition
-from plugins.plugin_base import Plugin
-from lib.config import Config, ConfigMerger, DefaultConfigDict, non_empty_dict_or_none
+from plugins.plugin_base import Plugin, PluginException
+from lib.config import Config, ConfigMerger, DefaultConfigDict, ReloadableConfigFields, non_empty_dict_or_none
 from services.twitch_service import TwitchService
 from services.vrcdn_service import VRCDNService
 
@@ -49,42 +64,95 @@ parser.add_argument("-s", metavar="username", dest="watched_accounts", help="Add
 parser.add_argument("--update-interval", metavar="seconds", dest="update_interval", help="Update interval in seconds (Default: 120)", type=int)
 parser.add_argument("--update-end-interval", metavar="seconds", dest="update_end_interval", help="Update interval in seconds after a recording has stopped but before it is finished (Default: 10)", type=int)
 parser.add_argument("--stream-end-timeout", metavar="seconds", dest="stream_end_timeout", help="Time to wait after a recording ended before considering the stream as finished (Default: 0)", type=int)
+parser.add_argument("--scratch-path", metavar="path", dest="scratch_path", help="Path on fast storage where the recordings are written to, before they are moved to the output path when they are finished (Default: disabled)")
+parser.add_argument("--bandwidth-limit", metavar="bytes", dest="bandwidth_limit", help="Total bandwidth in bytes per second shared by all recorders and background transfers, with the recorders taking precedence (Default: unlimited)", type=int)
+parser.add_argument("--max-recordings", metavar="N", dest="max_recordings", help="Maximum number of recordings running at the same time, users going live after that are queued or preempt recordings with a lower priority (Default: unlimited)", type=int)
+parser.add_argument("--start-concurrency", metavar="N", dest="start_concurrency", help="Number of recorders that can be started at the same time in the background, 0 to start them one after another on the main loop (Default: 4)", type=int)
+parser.add_argument("--buffer-memory-budget", metavar="bytes", dest="buffer_memory_budget", help="Enables the buffer tuning with this much memory shared by the ring buffers of all recorders, which are sized from the bitrate of their streams (Default: disabled)", type=int)
+parser.add_argument("--archive-after", metavar="days", dest="archive_after", help="Transcode finished recordings older than this many days to a smaller codec in the background, while no recordings are active (Default: disabled)", type=float)
+parser.add_argument("--stall-timeout", metavar="seconds", dest="stall_timeout", help="Time without receiving any data after which a recorder is aborted and restarted, 0 to disable (Default: 60)", type=int)
+parser.add_argument("--health-check-interval", metavar="seconds", dest="health_check_interval", help="Analyze the data appended to active recordings for corruption and gaps in this interval, 0 to disable. Requires numpy (Default: 0)", type=int)
 parser.add_argument("--log", metavar="loglevel", dest="loglevel", help="Sets the loglevel, one of CRITICAL, ERROR, WARNING, INFO, DEBUG (Default: INFO)", default="INFO")
 parser.add_argument("-c", metavar="option", dest="streamlink_options", help="Set a streamlink config option in the format optionname:type=value, e.g. '-c ipv4:bool=True' or '-c ffmpeg-ffmpeg:str=/usr/bin/ffmpeg'", action="append", default=[], type=streamlink_option_type)
 parser.add_argument("-p", metavar="plugin", dest="plugins", help="Enable a plugin", default=[], action="append")
+parser.add_argument("--metrics-port", metavar="port", dest="metrics_port", help="Serve Prometheus metrics on this port under /metrics (Default: disabled)", type=int)
+parser.add_argument("--recording-server-port", metavar="port", dest="recording_server_port", help="Serve the files of the active recordings on this port (Default: disabled)", type=int)
+parser.add_argument("--profile", dest="profile", action="store_true", help="Run the sampling profiler right after starting. It can also be started at any time by sending SIGUSR1 to the process")
+parser.add_argument("--profile-duration", metavar="seconds", dest="profile_duration", help="How long the profiler runs after it has been started (Default: 60)", type=int)
+parser.add_argument("--coordinator", metavar="address", dest="coordinator_address", help="Run as coordinator which polls the services and assigns the recordings to workers connecting to this address (host:port)")
+parser.add_argument("--worker", metavar="address", dest="worker_address", help="Run as worker which records the streams assigned by the coordinator at this address (host:port)")
+parser.add_argument("--trace", metavar="path", dest="trace_path", help="Append the results of the service updates and the recorder starts and stops to this file, so they can be replayed with different settings later (Default: disabled)")
 parser.add_argument("-C", "--config", metavar="path", dest="config_file_path", help="Optional path to a config file in YAML format")
+parser.add_argument("--watch-config", dest="watch_config", action="store_true", default=None, help="Reload the config file automatically when it changes. It can also be reloaded at any time by sending SIGHUP to the process")
 parser.add_argument("--print-config", dest="print_config", action="store_true", help="Print the config for debug purposes")
 parser.add_argument("-V", "--version", action="version", version=__version__)
 
 args = parser.parse_args()
-config_dict: dict = DefaultConfigDict
-
-# merge config file
-if args.config_file_path is not None:
-    with open(args.config_file_path, "r") as config_file:
-        config_file_content = yaml.load(config_file, yaml.Loader)
-
-    if config_file_content is not None: # don't raise an error when the config file is empty
-        config_dict = ConfigMerger.merge(config_dict, dict(config_file_content))
-
-# merge command line options
-config_dict = ConfigMerger.merge(config_dict, {
-    "twitch": non_empty_dict_or_none({
-        "clientid": args.twitch_clientid,
-        "secret": args.twitch_secret,
-    }),
-    "streamers": args.watched_accounts,
-    "output_path": args.output_path,
-    "update_interval": args.update_interval,
-    "update_end_interval": args.update_end_interval,
-    "stream_end_timeout": args.stream_end_timeout,
-    "streamlink_options": args.streamlink_options,
-    "plugins": { p: {} for p in args.plugins },
-})
+
+def load_config_dict():
+    # the merger modifies the dict in place, so we need a fresh copy every time the config is loaded
+    config_dict: dict = copy.deepcopy(DefaultConfigDict)
+
+    # merge config file
+    if args.config_file_path is not None:
+        with open(args.config_file_path, "r") as config_file:
+            config_file_content = yaml.load(config_file, yaml.Loader)
+
+        if config_file_content is not None: # don't raise an error when the config file is empty
+            config_dict = ConfigMerger.merge(config_dict, dict(config_file_content))
+
+    # merge command line options
+    return ConfigMerger.merge(config_dict, {
+        "twitch": non_empty_dict_or_none({
+            "clientid": args.twitch_clientid,
+            "secret": args.twitch_secret,
+        }),
+        "streamers": args.watched_accounts,
+        "output_path": args.output_path,
+        "tiered_storage": non_empty_dict_or_none({
+            "scratch_path": args.scratch_path,
+        }),
+        "update_interval": args.update_interval,
+        "update_end_interval": args.update_end_interval,
+        "stream_end_timeout": args.stream_end_timeout,
+        "stall_timeout": args.stall_timeout,
+        "start_concurrency": args.start_concurrency,
+        "health_check_interval": args.health_check_interval,
+        "streamlink_options": args.streamlink_options,
+        "plugins": { p: {} for p in args.plugins },
+        "metrics_port": args.metrics_port,
+        "recording_server_port": args.recording_server_port,
+        "profile_duration": args.profile_duration,
+        "sharding": non_empty_dict_or_none({
+            "role": "coordinator" if args.coordinator_address is not None else "worker" if args.worker_address is not None else None,
+            "address": args.coordinator_address or args.worker_address,
+        }),
+        "watch_config": args.watch_config,
+        "trace_path": args.trace_path,
+        "bandwidth": non_empty_dict_or_none({
+            "limit": args.bandwidth_limit,
+        }),
+        "admission": non_empty_dict_or_none({
+            "max_recordings": args.max_recordings,
+        }),
+        "buffer_tuning": non_empty_dict_or_none({
+            "enabled": True if args.buffer_memory_budget is not None else None,
+            "memory_budget": args.buffer_memory_budget,
+        }),
+        "archive": non_empty_dict_or_none({
+            "after_days": args.archive_after,
+        }),
+    })
+
+config_dict = load_config_dict()
 
 if args.print_config:
     print(json.dumps(config_dict, indent=4))
 
+if args.coordinator_address is not None and args.worker_address is not None:
+    print("--coordinator and --worker can not be used at the same time")
+    sys.exit(1)
+
 try:
     config = Config(**config_dict)
 except ValidationError as err:
@@ -114,124 +182,325 @@ for service_name, service in services.items():
         log.error(f"Failed to initialize service {service_name}: {e}")
 
 
-def is_any_recorder_finished(recorders: Dict[str, RecorderBase]):
-    for recorder in recorders.values():
-        if recorder.isFinished():
-            return True
-    return False
+username_definition_re = re.compile(r"(?:(\w+)=)?([a-zA-Z0-9_\-]+)((?::\w+)*)")
+
+def parse_watches(streamers: list[str], priorities: dict[str, int]):
+    watches: Dict[str, UsernameDefinition] = {}
+
+    for streamer_definition in streamers:
+        username_match = username_definition_re.match(streamer_definition)
+
+        if username_match is None:
+            raise ValueError(f"Invalid username definition: {streamer_definition}")
+
+        username_definition = UsernameDefinition(
+            service="twitch",
+            username=username_match.group(2),
+            parameters=[]
+        )
+
+        if username_match.group(1) is not None:
+            username_definition.service = username_match.group(1)
+
+        if username_definition.service not in services:
+            raise ValueError(f"Invalid service {username_definition.service} for username {username_definition.username}")
+
+        if not services[username_definition.service].initialized:
+            raise ValueError(f"Service {username_definition.service} is not initialized")
+
+        if username_match.group(3) is not None:
+            username_definition.parameters = username_match.group(3).split(":")[1:]
+
+        username_definition.priority = priorities.get(username_definition.get_id(), 0)
+
+        watches[username_definition.get_id()] = username_definition
+
+    return watches
+
+# mapping from plugin name to the raw config and the (class, config) tuple, so unchanged plugins can be kept on reload
+PluginEntries = Dict[str, tuple[dict, tuple[Type[Plugin], Any]]]
+
+def load_plugins(plugin_configs: dict[str, dict], previous: PluginEntries) -> PluginEntries:
+    plugin_entries: PluginEntries = {}
+
+    for plugin_name, plugin_config_dict in plugin_configs.items():
+        if plugin_name in previous and previous[plugin_name][0] == plugin_config_dict:
+            plugin_entries[plugin_name] = previous[plugin_name]
+            continue
+
+        plugin = importlib.import_module(f"plugins.{plugin_name}").PluginExport
+        plugin_class = cast(type[Plugin], plugin)
+
+        plugin_config = plugin_class.create_config(plugin_config_dict)
+        plugin_entries[plugin_name] = (copy.deepcopy(plugin_config_dict), (plugin_class, plugin_config))
+
+    return plugin_entries
+
+def get_config_mtime():
+    if args.config_file_path is None:
+        return None
 
-def is_any_recorder_not_recording(recorders: Dict[str, RecorderBase]):
-    for recorder in recorders.values():
-        if not recorder.isRecording():
-            return True
-    return False
+    try:
+        return os.stat(args.config_file_path).st_mtime_ns
+    except OSError:
+        return None
+
+# returns the config with the reloadable fields updated together with the new watches and plugins,
+# raises an exception if the new config is invalid, in which case nothing is changed
+def reload_config(config: Config, plugin_entries: PluginEntries):
+    new_config = Config(**load_config_dict())
+    new_watches = parse_watches(new_config.streamers, new_config.admission.priorities)
+    new_plugin_entries = load_plugins(new_config.plugins, plugin_entries)
+
+    for field in Config.model_fields:
+        if field not in ReloadableConfigFields and getattr(new_config, field) != getattr(config, field):
+            log.warning(f"Changing '{field}' requires a restart, the new value is ignored")
+
+    for plugin_name in new_plugin_entries.keys() - plugin_entries.keys():
+        log.info(f"Loaded plugin {new_plugin_entries[plugin_name][1][0].get_name()}")
+
+    for plugin_name in new_plugin_entries.keys() & plugin_entries.keys():
+        if new_plugin_entries[plugin_name] is not plugin_entries[plugin_name]:
+            log.info(f"Reloaded plugin {new_plugin_entries[plugin_name][1][0].get_name()} with the changed config")
+
+    for plugin_name in plugin_entries.keys() - new_plugin_entries.keys():
+        log.info(f"Unloaded plugin {plugin_entries[plugin_name][1][0].get_name()}")
+
+    return config.model_copy(update={ field: getattr(new_config, field) for field in ReloadableConfigFields }), new_watches, new_plugin_entries
+
+def start_recording_server(get_recorders):
+    assert config.recording_server_port is not None
+
+    recording_server = RecordingServer(config.recording_server_address, config.recording_server_port, get_recorders)
+    recording_server.start()
+    log.info(f"Serving active recordings on {config.recording_server_address}:{config.recording_server_port}")
+
+def start_health_monitor(get_recorders):
+    if ts_health.np is None:
+        log.error("The recording health monitor requires numpy to be installed (uv sync --extra ts-health), it is not going to be started")
+        return
+
+    TsHealthMonitor(get_recorders, config.health_check_interval).start()
+    log.info(f"Checking the health of active recordings every {config.health_check_interval} seconds")
+
+def start_archiver(get_recorders, after_days: float):
+    archive = config.archive
+    archiver = Archiver(
+        config.output_path,
+        get_recorders,
+        after_days,
+        archive.video_codec,
+        archive.crf,
+        archive.preset,
+        archive.audio_codec,
+        archive.audio_bitrate,
+        archive.niceness,
+        archive.max_cores,
+        archive.duration_tolerance,
+        archive.scan_interval,
+    )
+    archiver.start()
+    log.info(f"Archiving recordings older than {after_days} days with {archive.video_codec} on up to {archive.max_cores} core(s)")
+
+    return archiver
+
+def configure_buffer_tuning(config: Config):
+    tuning = config.buffer_tuning
+    TUNER.configure(tuning.enabled, tuning.memory_budget, tuning.buffer_seconds, tuning.min_buffer, tuning.max_buffer, tuning.max_segment_threads)
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal.SIG_DFL)
 
+    if hasattr(signal, "SIGUSR1"): # not available on windows
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start_profiler(config.output_path, config.profile_duration))
+
     if not os.path.exists(config.output_path):
         log.info(f"Output path {config.output_path} doesn't exist, creating it now...")
         os.makedirs(config.output_path, exist_ok=True)
 
-    # list of tuples (class, config)
-    plugins: list[tuple[Type[Plugin], Any]] = []
+    bandwidth.MANAGER.configure(config.bandwidth.limit, config.bandwidth.burst, config.bandwidth.weights)
+    configure_buffer_tuning(config)
 
-    for plugin_name, plugin_config_dict in config.plugins.items():
-        plugin = importlib.import_module(f"plugins.{plugin_name}").PluginExport
-        plugin_class = cast(type[Plugin], plugin)
+    if any(sink.type == "s3" for sink in config.sinks):
+        # this has to happen before the leftovers are moved to the bulk storage and before new recordings are started
+        resume_uploads(config.sinks, list({ config.get_recording_path(), config.output_path }))
 
-        try:
-            plugin_config = plugin_class.create_config(plugin_config_dict)
-        except ValidationError as err:
-            print(err)
-            sys.exit(1)
+    if config.tiered_storage.scratch_path is not None:
+        if not os.path.exists(config.tiered_storage.scratch_path):
+            log.info(f"Scratch path {config.tiered_storage.scratch_path} doesn't exist, creating it now...")
+            os.makedirs(config.tiered_storage.scratch_path, exist_ok=True)
+
+        storage_mover = StorageMover(
+            config.tiered_storage.scratch_path,
+            config.output_path,
+            config.tiered_storage.bandwidth_limit,
+            config.tiered_storage.min_scratch_free,
+            config.tiered_storage.move_delay,
+        )
+        storage_mover.enqueue_leftovers()
+        storage_mover.start()
 
-        plugins.append((plugin_class, plugin_config))
+        for service in services.values():
+            service.storage_mover = storage_mover
+
+        log.info(f"Recording to {config.tiered_storage.scratch_path} and moving finished recordings to {config.output_path}")
+
+    plugin_entries: PluginEntries = {}
+    try:
+        plugin_entries = load_plugins(config.plugins, {})
+    except (ValidationError, PluginException) as err:
+        print(err)
+        sys.exit(1)
+
+    # list of tuples (class, config)
+    plugins: list[tuple[Type[Plugin], Any]] = [ entry[1] for entry in plugin_entries.values() ]
 
     for p in plugins:
         log.info(f"Loaded plugin {p[0].get_name()}")
 
-    log.info(f"Checking services every {config.update_interval} seconds")
+    if config.metrics_port is not None:
+        metrics_server = metrics.MetricsServer(config.metrics_port)
+        metrics_server.start()
+        log.info(f"Serving metrics on port {config.metrics_port}")
 
-    username_definition_re = re.compile(r"(?:(\w+)=)?([a-zA-Z0-9_\-]+)((?::\w+)*)")
+    if args.profile:
+        profiler.start_profiler(config.output_path, config.profile_duration)
 
-    watches: Dict[str, UsernameDefinition] = {}
-    for streamer_definition in config.streamers:
-        username_match = username_definition_re.match(streamer_definition)
+    if config.sharding.role == "worker":
+        assert config.sharding.authkey is not None # checked by the config validation
 
-        if username_match is None:
-            log.error(f"Invalid username definition: {streamer_definition}")
-            sys.exit(1)
+        log.info(f"Running as worker for the coordinator at {config.sharding.address}")
+        worker = ShardWorker(config.sharding.address, config.sharding.authkey, config.sharding.worker_name, services, plugins)
 
-        username_definition = UsernameDefinition(
-            service="twitch",
-            username=username_match.group(2),
-            parameters=[]
-        )
+        if config.stall_timeout > 0:
+            StallWatchdog(worker.get_recorders, config.stall_timeout).start()
 
-        if username_match.group(1) is not None:
-            username_definition.service = username_match.group(1)
+        if config.recording_server_port is not None:
+            start_recording_server(worker.get_recorders)
 
-        if username_definition.service not in services:
-            log.error(f"Invalid service {username_definition.service} for username {username_definition.username}")
-            sys.exit(1)
+        if config.health_check_interval > 0:
+            start_health_monitor(worker.get_recorders)
 
-        if not services[username_definition.service].initialized:
-            log.error(f"Service {username_definition.service} is not initialized")
-            sys.exit(1)
+        archiver = None
+        if config.archive.after_days is not None:
+            archiver = start_archiver(worker.get_recorders, config.archive.after_days)
 
-        if username_match.group(3) is not None:
-            username_definition.parameters = username_match.group(3).split(":")[1:]
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
 
-        watches[username_definition.get_id()] = username_definition
-        log.info(f"Watching {username_definition.service} user {username_definition.username}")
+        if archiver is not None:
+            archiver.stop()
+
+        sys.exit(0)
+
+    coordinator = None
+    if config.sharding.role == "coordinator":
+        assert config.sharding.authkey is not None # checked by the config validation
 
-    recorders: Dict[str, RecorderBase] = {} # mapping from userdef_id to recorder
-    last_check = 0.0
+        coordinator = Coordinator(config.sharding.address, config.sharding.authkey, config.sharding.placement, config.sharding.heartbeat_timeout)
+        coordinator.start()
+        log.info(f"Running as coordinator, waiting for workers on {config.sharding.address}")
+
+    log.info(f"Checking services every {config.update_interval} seconds")
+
+    try:
+        watches = parse_watches(config.streamers, config.admission.priorities)
+    except ValueError as e:
+        log.error(str(e))
+        sys.exit(1)
+
+    def get_recorder(username_definition: UsernameDefinition) -> RecorderBase:
+        if coordinator is not None:
+            return coordinator.get_recorder(username_definition)
+        return services[username_definition.service].get_recorder(username_definition.username, username_definition.parameters, plugins)
+
+    trace = None
+    if config.trace_path is not None:
+        log.info(f"Writing a trace of the service updates to {config.trace_path}")
+        trace = TraceWriter(config.trace_path, {
+            "update_interval": config.update_interval,
+            "update_end_interval": config.update_end_interval,
+            "stream_end_timeout": config.stream_end_timeout,
+        })
+
+    backoff = StartBackoff(config.start_backoff.initial, config.start_backoff.maximum, config.start_backoff.jitter)
+    admission = AdmissionController(
+        config.admission.max_recordings,
+        config.admission.max_bitrate,
+        config.admission.min_free_disk,
+        config.admission.default_bitrate,
+        config.admission.preempt,
+        config.get_recording_path() if coordinator is None else None, # the recordings are on the workers
+    )
+
+    scheduler = Scheduler(services, get_recorder, config.update_interval, config.update_end_interval, config.stream_end_timeout, backoff, trace, admission, config.start_concurrency)
+    scheduler.set_watches(watches)
+
+    reload_requested = Event()
+    config_mtime = get_config_mtime()
+
+    if hasattr(signal, "SIGHUP"): # not available on windows
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+
+    if config.stall_timeout > 0 and coordinator is None: # the workers run their own watchdog
+        stall_watchdog = StallWatchdog(scheduler.get_recorders, config.stall_timeout)
+        stall_watchdog.start()
+
+    if config.recording_server_port is not None and coordinator is None: # the recordings are on the workers
+        start_recording_server(scheduler.get_recorders)
+
+    if config.health_check_interval > 0 and coordinator is None: # the recordings are on the workers
+        start_health_monitor(scheduler.get_recorders)
+
+    archiver = None
+    if config.archive.after_days is not None and coordinator is None: # the recordings are on the workers
+        archiver = start_archiver(scheduler.get_recorders, config.archive.after_days)
 
     try:
         while True:
-            streams_live = 0
-
-            if (time.time() - last_check >= config.update_interval) or is_any_recorder_finished(recorders) or \
-               (is_any_recorder_not_recording(recorders) and time.time() - last_check >= config.update_end_interval):
-                # check the live status if
-                # -> the update interval has passed
-                # -> any recorder has finished (we have to check immediately, since the finished recorder will get replaced immediately in the next step)
-                # -> any recorder is not recording (we have to check more often in this case so we can stop recorders quickly after the stream ended)
-                last_check = time.time()
-
-                for service_name, service in services.items():
-                    try:
-                        streams_live += service.update_streams(w.username for w in watches.values() if w.service == service_name)
-                    except Exception as ex:
-                        log.error(f"Error while fetching streams for service {service_name}: {repr(ex)}")
-
-            if streams_live > 0 or len(recorders) > 0:
-                # check if the status of any of our watches has changed
-                for username_id, username_definition in watches.items():
-                    is_live = services[username_definition.service].is_user_live(username_definition.username)
-
-                    if username_id in recorders and (recorders[username_id].isInitialized() or recorders[username_id].encounteredError()) and not recorders[username_id].isRecording():
-                        stream_end_timeout_reached = (time.time() - recorders[username_id].getStopTime()) >= config.stream_end_timeout
-
-                        if is_live: # continue recording
-                            newRecorder = recorders[username_id].getFreshClone()
-                            recorders[username_id] = newRecorder
-                            services[username_definition.service].start_recorder(username_definition.username, newRecorder)
-                        elif stream_end_timeout_reached:
-                            log.info(f"Finishing recorder for username {username_definition.username}, because the stream end timeout was reached")
-                            recorders[username_id].finish()
-                            del recorders[username_id] # remove finished recorders
-
-                    if is_live and username_id not in recorders:
-                        recorders[username_id] = services[username_definition.service].get_recorder(username_definition.username, username_definition.parameters, plugins)
-                        services[username_definition.service].start_recorder(username_definition.username, recorders[username_id])
+            if config.watch_config:
+                current_mtime = get_config_mtime()
+                if current_mtime != config_mtime:
+                    config_mtime = current_mtime
+                    reload_requested.set()
+
+            if reload_requested.is_set():
+                reload_requested.clear()
+                log.info("Reloading config")
+
+                try:
+                    config, watches, plugin_entries = reload_config(config, plugin_entries)
+                except Exception as e:
+                    log.error(f"Could not reload the config, keeping the current one: {repr(e)}")
+                else:
+                    # running recorders keep the plugins they were created with, only new ones get the reloaded list
+                    plugins = [ entry[1] for entry in plugin_entries.values() ]
+
+                    scheduler.update_interval = config.update_interval
+                    scheduler.update_end_interval = config.update_end_interval
+                    scheduler.stream_end_timeout = config.stream_end_timeout
+                    scheduler.backoff.configure(config.start_backoff.initial, config.start_backoff.maximum, config.start_backoff.jitter)
+                    scheduler.admission.configure(config.admission.max_recordings, config.admission.max_bitrate, config.admission.min_free_disk, config.admission.default_bitrate, config.admission.preempt)
+                    scheduler.set_watches(watches)
+
+                    if trace is not None:
+                        trace.settings(time.time(), scheduler.get_settings())
+
+                    bandwidth.MANAGER.configure(config.bandwidth.limit, config.bandwidth.burst, config.bandwidth.weights)
+                    configure_buffer_tuning(config)
+
+            scheduler.tick()
 
             time.sleep(1)
     except KeyboardInterrupt:
         pass
 
-    for recorder in recorders.values():
-        if recorder.isRecording():
-            recorder.stopRecording()
\ No newline at end of file
+    scheduler.stop_all()
+
+    if archiver is not None:
+        archiver.stop()
+
+    if trace is not None:
+        trace.close()
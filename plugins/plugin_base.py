@@ -21,5 +21,9 @@ class Plugin[C]:
     def handle_recording_end(self, stream_metadata: StreamMetadata, output_path: str, error=None, finish=True):
         pass # abstract but optional to implement
 
+    # only called when a scratch path is configured, after the finished recording has been moved to the output path
+    def handle_recording_moved(self, stream_metadata: StreamMetadata, output_path: str):
+        pass # abstract but optional to implement
+
 class PluginException(Exception):
     pass
\ No newline at end of file
@@ -0,0 +1,44 @@
+import logging
+import os
+
+from pydantic import BaseModel
+
+from .plugin_base import Plugin, PluginException, StreamMetadata
+from lib import ts_health
+
+log = logging.getLogger(__file__)
+
+class TsHealthPluginConfig(BaseModel):
+    max_gap: float = 1.0 # seconds
+    bitrate_interval: float = 10.0 # seconds
+
+# analyzes finished recordings and adds the results to the metadata, so the plugins after this one can use them
+class TsHealthPlugin(Plugin):
+    def __init__(self, config: TsHealthPluginConfig):
+        super().__init__(config)
+
+    # the plugins are only instantiated when a recorder is created, so a missing dependency has to be caught when the config is loaded
+    @staticmethod
+    def create_config(raw_config: dict) -> TsHealthPluginConfig:
+        if ts_health.np is None:
+            raise PluginException("The TS-Health plugin requires numpy to be installed (uv sync --extra ts-health)")
+
+        return TsHealthPluginConfig(**raw_config)
+
+    @staticmethod
+    def get_name():
+        return "TS-Health"
+
+    def handle_recording_end(self, stream_metadata: StreamMetadata, output_path, error=None, finish=True):
+        if not finish or output_path is None or not output_path.endswith(".ts") or not os.path.exists(output_path):
+            return
+
+        report = ts_health.analyze_recording(output_path, self._config.max_gap, self._config.bitrate_interval)
+        stream_metadata.additionalData["ts_health"] = report.to_dict()
+
+        if report.is_healthy():
+            log.info(f"Recording {output_path} looks healthy: {report.summary()}")
+        else:
+            log.warning(f"Recording {output_path} has problems: {report.summary()}")
+
+PluginExport = TsHealthPlugin
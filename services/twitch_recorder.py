@@ -1,4 +1,4 @@
-from threading import Event
+from threading import Event, Thread
 import logging
 import os
 import sys
@@ -8,18 +8,27 @@ from typing import Optional
 import pathvalidate
 from streamlink.exceptions import StreamError
 from streamlink.session import Streamlink # type: ignore
-from streamlink.stream import Stream # type: ignore
+from streamlink.stream import Stream, StreamIO # type: ignore
 
 from lib.stream_metadata import StreamMetadata
 from lib.plugin_runner import PluginRunner
-from lib.recorder_base import RecorderBase
+from lib import bandwidth
+from lib.buffer_tuning import TUNER, TunedStream
+from lib.config import SinkConfig
+from lib.recorder_base import RecorderBase, StartFailure
+from lib.sinks import Sink, create_sinks, finish_sinks
+from lib.storage_mover import StorageMover
+from lib.ts_index import TsIndexer, get_index_path
 from plugins.plugin_base import Plugin
 
 log = logging.getLogger(__file__)
 
 class TwitchRecorder(RecorderBase):
+    service_name = "twitch"
+
     _username: str
     _quality: str
+    _stream_url: str
     _output_path: str
     _streamlink_options: list[str]
 
@@ -28,15 +37,19 @@ class TwitchRecorder(RecorderBase):
     _current_title: Optional[str]
     _current_metadata: Optional[StreamMetadata]
     _current_stream: Optional[Stream]
+    _stream_fd: Optional[StreamIO]
     _recording_path: Optional[str]
     _plugins: list[Plugin]
+    _sinks: list[SinkConfig]
 
-    def __init__(self, username: str, quality: str, output_path: str, streamlink_options: list[str], plugins: list[tuple[type[Plugin], dict]]):
+    def __init__(self, username: str, quality: str, stream_url: str, output_path: str, streamlink_options: list[str], plugins: list[tuple[type[Plugin], dict]], sinks: list[SinkConfig], storage_mover: Optional[StorageMover] = None):
         super().__init__()
-        self._launch_params = (username, quality, output_path, streamlink_options, plugins) # make it easier to create a fresh copy later in case we need one
+        self._launch_params = (username, quality, stream_url, output_path, streamlink_options, plugins, sinks, storage_mover) # make it easier to create a fresh copy later in case we need one
 
         self._username = username.lower()
+        self.name = f"twitch-recorder-{self._username}"
         self._quality = quality
+        self._stream_url = stream_url.format(username=self._username)
         self._output_path = os.path.join(output_path, username)
         self._streamlink_options = streamlink_options
 
@@ -45,11 +58,15 @@ class TwitchRecorder(RecorderBase):
         self._current_title = None
         self._current_metadata: Optional[StreamMetadata] = None
         self._current_stream = None
+        self._stream_fd = None
         self._recording_path = None
+        self._tuned_buffer_size: Optional[int] = None
 
         self._stop_event = Event()
 
         self._plugins = [p(c) for p,c in plugins]
+        self._sinks = sinks
+        self._storage_mover = storage_mover
 
     def getFreshClone(self):
         new_recorder = TwitchRecorder(*self._launch_params)
@@ -66,7 +83,12 @@ class TwitchRecorder(RecorderBase):
         if self._current_stream is None:
             raise Exception("Cannot run recorder without having set a stream first")
 
-        stream_fd = None
+        sinks: list[Sink] = []
+        indexer: Optional[TsIndexer] = None
+        tuned_stream: Optional[TunedStream] = None
+        # streamlink's segment threads have already downloaded the data into the ring buffer, waiting in here would only let it run full
+        # and drop segments. so the ingest is only measured and taken from the budget of the other transfers
+        bandwidth_client = bandwidth.MANAGER.register(f"{self.service_name}={self._username}", "live", shaped=False)
 
         try:
             if not os.path.exists(self._output_path):
@@ -75,18 +97,37 @@ class TwitchRecorder(RecorderBase):
             self._recording_path = os.path.join(self._output_path, self._current_title + ".ts")
 
             with open(self._recording_path, "ab") as output_file:
-                stream_fd = self._current_stream.open()
+                self._stream_fd = self._current_stream.open()
+                sinks = create_sinks(self._sinks, self.service_name, self._username, self._recording_path, output_file.tell())
+                indexer = TsIndexer(get_index_path(self._recording_path), output_file.tell())
+
+                ring_buffer = getattr(self._stream_fd, "buffer", None) # only segmented streams like HLS read through a ring buffer
+                if self._tuned_buffer_size is not None and ring_buffer is not None and hasattr(ring_buffer, "resize"):
+                    tuned_stream = TUNER.register(f"{self.service_name}={self._username}", self._tuned_buffer_size, ring_buffer.resize)
 
                 self._recording = True
                 self._is_initialized = True
+                self._trackRecordingStart()
 
                 while not self._stop_event.is_set():
-                    data = stream_fd.read(1024)
+                    data = self._stream_fd.read(1024)
 
                     if not data: # stream has ended
                         break
 
                     output_file.write(data)
+                    indexer.feed(data)
+                    bandwidth_client.record(len(data))
+
+                    for sink in sinks:
+                        sink.write(data)
+
+                    if self._first_byte_time == 0:
+                        self._first_byte_time = time.time()
+                    self._bytes_written += len(data)
+
+                    if tuned_stream is not None:
+                        tuned_stream.sample(self._bytes_written)
         except StreamError as e:
             log.error(f"Error while opening stream: {repr(e)}")
             self._encountered_error = e
@@ -98,9 +139,26 @@ class TwitchRecorder(RecorderBase):
             self._encountered_error = e
         finally:
             self._stop_time = time.time()
+            self._trackRecordingEnd()
+
+            if self._stream_fd is not None:
+                if self._stop_event.is_set():
+                    # closing joins the segment threads of streamlink, which only give up on a stalled server after their own
+                    # timeouts, so an aborted recorder doesn't wait for them before it reports that it stopped
+                    Thread(target=self._stream_fd.close, name=f"close-stream-{self._username}", daemon=True).start()
+                else:
+                    self._stream_fd.close()
 
-            if stream_fd is not None:
-                stream_fd.close()
+            for sink in sinks:
+                sink.close()
+
+            if indexer is not None:
+                indexer.close()
+
+            if tuned_stream is not None:
+                tuned_stream.close()
+
+            bandwidth_client.close()
 
         self._recording = False
         self._is_finished = True
@@ -116,16 +174,35 @@ class TwitchRecorder(RecorderBase):
 
         log.info(f"Start recording of twitch user {self._username} with quality '{self._quality}'")
 
+        self._start_time = time.time()
+
         session = Streamlink()
 
         for option in self._streamlink_options:
             session.set_option(option[0], option[1])
 
-        streams = session.streams(f"https://twitch.tv/{self._username}")
+        # buffer settings that were set explicitly are left alone, otherwise they are sized for the bitrate this user streamed with last time
+        explicit_options = { option[0] for option in self._streamlink_options }
+        if TUNER.enabled and "ringbuffer-size" not in explicit_options:
+            self._tuned_buffer_size, segment_threads = TUNER.get_settings(f"{self.service_name}={self._username}")
+            session.set_option("ringbuffer-size", self._tuned_buffer_size)
+
+            if "stream-segment-threads" not in explicit_options:
+                session.set_option("stream-segment-threads", segment_threads)
+        else:
+            self._tuned_buffer_size = None
+
+        try:
+            streams = session.streams(self._stream_url)
+        except Exception as e:
+            self._stop_time = time.time()
+            self._encountered_error = StartFailure("resolution", f"Could not resolve the stream: {repr(e)}")
+            log.error(f"Could not resolve the stream: {repr(e)}")
+            return
 
         if self._quality not in streams:
             self._stop_time = time.time()
-            self._encountered_error = Exception(f"Could not find quality '{self._quality}' in the list of available qualities.")
+            self._encountered_error = StartFailure("quality_missing", f"Could not find quality '{self._quality}' in the list of available qualities.")
             log.error(f"Could not find quality '{self._quality}' in the list of available qualities. Options are: {', '.join(streams.keys())}")
             return
 
@@ -133,7 +210,7 @@ class TwitchRecorder(RecorderBase):
 
         if self._username not in current_stream.to_manifest_url():
             self._stop_time = time.time()
-            self._encountered_error = Exception(f"This stream is a hosted stream by a different person and is therefore not going to be recorded.")
+            self._encountered_error = StartFailure("hosted", f"This stream is a hosted stream by a different person and is therefore not going to be recorded.")
             log.error(f"This stream is a hosted stream by a different person and is therefore not going to be recorded.")
             return
 
@@ -158,8 +235,43 @@ class TwitchRecorder(RecorderBase):
 
     def stopRecording(self):
         self._stop_event.set()
+        self._interruptRead()
+
+    def abort(self, error: Exception):
+        if self._encountered_error is None:
+            self._encountered_error = error
+
+        self.stopRecording()
+
+    def _interruptRead(self):
+        stream_fd = self._stream_fd
+
+        if stream_fd is None:
+            return
+
+        # closing the buffer makes a blocked read return immediately, the reader itself is then closed by the recorder thread
+        buffer = getattr(stream_fd, "buffer", None)
+
+        if buffer is not None:
+            buffer.close()
+        else:
+            stream_fd.close()
 
     def finish(self):
         if self._recording_path is not None:
-            runner = PluginRunner(self._plugins, "handle_recording_end", [ self._current_metadata, self._recording_path ], { "error": None, "finish": True })
-            runner.start()
\ No newline at end of file
+            on_complete = None
+            if self._storage_mover is not None:
+                storage_mover = self._storage_mover
+                recording_path = self._recording_path
+                on_complete = lambda: storage_mover.enqueue(recording_path, self._current_metadata, self._plugins)
+
+            runner = PluginRunner(self._plugins, "handle_recording_end", [ self._current_metadata, self._recording_path ], { "error": None, "finish": True }, on_complete)
+
+            # the uploads have to be complete before the plugins get to modify the recording
+            sink_configs = self._sinks
+            recording_path = self._recording_path
+            def finish_recording():
+                finish_sinks(sink_configs, self.service_name, recording_path)
+                runner.run()
+
+            Thread(target=finish_recording, name=f"finish-recording-{self._username}").start()
\ No newline at end of file
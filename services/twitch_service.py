@@ -4,21 +4,27 @@ import logging
 from typing import Iterable, List, Optional
 
 from twitchAPI.twitch import Twitch
+from twitchAPI.helper import TWITCH_API_BASE_URL, TWITCH_AUTH_BASE_URL
 from twitchAPI.object.api import Stream
 
+from lib import metrics
 from lib.stream_metadata import StreamMetadata
-from lib.config import Config
+from lib.config import Config, SinkConfig
 from plugins.plugin_base import Plugin
 from lib.service_base import ServiceBase
 from services.twitch_recorder import TwitchRecorder
 
 log = logging.getLogger(__file__)
 
+helix_requests = metrics.REGISTRY.counter("twitch_helix_requests_total", "Number of requests sent to the Twitch Helix API", ("endpoint",))
+
 class TwitchService(ServiceBase[TwitchRecorder]):
     _twitch: Twitch
     _streams: dict[str, Stream]
     _output_path: Optional[str]
+    _stream_url: str
     _streamlink_options: list[str]
+    _sinks: list[SinkConfig]
 
     def __init__(self):
         super().__init__()
@@ -26,7 +32,9 @@ class TwitchService(ServiceBase[TwitchRecorder]):
         self._streams = {}
 
         self._output_path = None
+        self._stream_url = ""
         self._streamlink_options = []
+        self._sinks = []
 
     def init(self, config: Config):
         return asyncio.run(self.init_async(config))
@@ -36,17 +44,30 @@ class TwitchService(ServiceBase[TwitchRecorder]):
             log.info("Twitch API credentials not found, Twitch service is not going to be loaded")
             return False
 
+        # the API urls can be overwritten to use a different server for testing
         self._twitch = await Twitch(
             app_id=config.twitch.clientid,
             app_secret=config.twitch.secret,
+            base_url=config.twitch.api_base_url or TWITCH_API_BASE_URL,
+            auth_base_url=config.twitch.auth_base_url or TWITCH_AUTH_BASE_URL,
         )
-        self._output_path = config.output_path
+        self._output_path = config.get_recording_path()
+        self._stream_url = config.twitch.stream_url
         self._streamlink_options = config.streamlink_options
+        self._sinks = config.sinks
 
         return True
 
     def is_user_live(self, username: str) -> bool:
         return (username in self._streams and self._streams[username].type == "live")
+
+    def get_live_users(self) -> set[str]:
+        return { username for username, stream in self._streams.items() if stream.type == "live" }
+
+    def get_stream_start(self, username: str) -> Optional[float]:
+        if username not in self._streams:
+            return None
+        return self._streams[username].started_at.timestamp()
     
     def update_streams(self, usernames: Iterable[str]):
         return asyncio.run(self.update_streams_async(usernames))
@@ -55,20 +76,24 @@ class TwitchService(ServiceBase[TwitchRecorder]):
         if not self.initialized:
             return 0
 
-        self._streams = {}
+        # the recorders are started on other threads while the update runs, so the streams are only replaced once they are complete
+        streams: dict[str, Stream] = {}
         remaining_usernames = list(u.lower() for u in usernames)
         cursor = None
 
         while len(remaining_usernames) > 0:
+            helix_requests.inc(labels=("get_streams",))
+
             async for stream in self._twitch.get_streams(
                 after=cursor,
                 first = 100,
                 user_login=remaining_usernames[:100]
             ):
-                self._streams[stream.user_login] = stream
+                streams[stream.user_login] = stream
 
             remaining_usernames = remaining_usernames[100:]
 
+        self._streams = streams
         return len(self._streams)
 
     def get_recorder(self, username: str, params: List[str], plugins: list[tuple[type[Plugin], dict]]) -> TwitchRecorder:
@@ -79,7 +104,7 @@ class TwitchService(ServiceBase[TwitchRecorder]):
         if len(params) > 0:
             quality = params[0]
 
-        return TwitchRecorder(username, quality, self._output_path, self._streamlink_options, plugins)
+        return TwitchRecorder(username, quality, self._stream_url, self._output_path, self._streamlink_options, plugins, self._sinks, self.storage_mover)
 
     def start_recorder(self, username: str, recorder: TwitchRecorder):
         stream_data = self._streams[username.lower()]
@@ -11,13 +11,20 @@ import ffmpeg # type: ignore
 
 from lib.stream_metadata import StreamMetadata
 from lib.plugin_runner import PluginRunner
+from lib import bandwidth
+from lib.config import SinkConfig
 from lib.recorder_base import RecorderBase
+from lib.sinks import Sink, create_sinks, finish_sinks
+from lib.storage_mover import StorageMover
 from plugins.plugin_base import Plugin
 
 log = logging.getLogger(__file__)
 
 class VRCDNRecorder(RecorderBase):
+    service_name = "vrcdn"
+
     _username: str
+    _stream_url: str
     _output_path: str
 
     _cloned_paths: list[str] = []
@@ -26,16 +33,20 @@ class VRCDNRecorder(RecorderBase):
     _current_title_suffix: Optional[str]
     _current_metadata: Optional[StreamMetadata]
     _recording_path: Optional[str]
+    _response: Optional[requests.Response]
 
     _plugins: list[Plugin]
+    _sinks: list[SinkConfig]
 
-    def __init__(self, username: str, output_path: str, plugins: list[tuple[type[Plugin], dict]]):
+    def __init__(self, username: str, stream_url: str, output_path: str, plugins: list[tuple[type[Plugin], dict]], sinks: list[SinkConfig], storage_mover: Optional[StorageMover] = None, read_timeout: float = 10):
         super().__init__()
         self.daemon = True
 
-        self._launch_params = (username, output_path, plugins)
+        self._launch_params = (username, stream_url, output_path, plugins, sinks, storage_mover, read_timeout)
 
         self._username = username
+        self.name = f"vrcdn-recorder-{self._username}"
+        self._stream_url = stream_url.format(username=username)
         self._output_path = os.path.join(output_path, "vrcdn_" + username)
 
         self._cloned_paths = []
@@ -44,11 +55,15 @@ class VRCDNRecorder(RecorderBase):
         self._current_title_suffix = None
         self._current_metadata: Optional[StreamMetadata] = None
         self._recording_path = None
+        self._response = None
+        self._read_timeout = read_timeout
 
         self._stop_event = Event()
         self._start_event = Event()
 
         self._plugins = [p(c) for p,c in plugins]
+        self._sinks = sinks
+        self._storage_mover = storage_mover
 
     def getFreshClone(self):
         new_recorder = VRCDNRecorder(*self._launch_params)
@@ -67,10 +82,9 @@ class VRCDNRecorder(RecorderBase):
         if self._current_title is None:
             raise Exception("Cannot run recorder without having set a title first")
 
-        resp = None
-
-        recording_url = f"https://stream.vrcdn.live/live/{self._username}.live.ts"
         ever_started = False
+        sinks: list[Sink] = []
+        bandwidth_client = bandwidth.MANAGER.register(f"{self.service_name}={self._username}", "live")
 
         try:
             if not os.path.exists(self._output_path):
@@ -84,19 +98,30 @@ class VRCDNRecorder(RecorderBase):
             self._recording_path = os.path.join(self._output_path, current_title + ".ts")
 
             with open(self._recording_path, "wb") as output_file:
-                resp = requests.get(recording_url, stream=True, timeout=10)
-                resp.raise_for_status()
-                stream_iterator = resp.iter_content(chunk_size=1024*10)
+                # the read timeout bounds how long a read can block, so a stop or an abort by the stall watchdog always takes effect
+                self._response = requests.get(self._stream_url, stream=True, timeout=(10, self._read_timeout))
+                self._response.raise_for_status()
+                stream_iterator = self._response.iter_content(chunk_size=1024*10)
+                sinks = create_sinks(self._sinks, self.service_name, self._username, self._recording_path, 0)
 
                 self._recording = True
                 self._is_initialized = True
                 ever_started = True
+                self._trackRecordingStart()
                 self._start_event.set()
 
                 while not self._stop_event.is_set():
                     data = next(stream_iterator)
 
                     output_file.write(data)
+                    bandwidth_client.consume(len(data))
+
+                    for sink in sinks:
+                        sink.write(data)
+
+                    if self._first_byte_time == 0:
+                        self._first_byte_time = time.time()
+                    self._bytes_written += len(data)
         except StopIteration:
             pass
         except requests.HTTPError as e:
@@ -112,9 +137,19 @@ class VRCDNRecorder(RecorderBase):
         finally:
             self._is_initialized = True # just in case we encounter an error earlier
             self._stop_time = time.time()
+            self._trackRecordingEnd()
+
+            if self._response is not None:
+                self._response.close()
+
+            for sink in sinks:
+                sink.close()
 
-            if resp is not None:
-                resp.close()
+            bandwidth_client.close()
+
+        # every run writes its own file, so its uploads can be completed right away
+        if self._recording_path is not None and os.path.exists(self._recording_path):
+            finish_sinks(self._sinks, self.service_name, self._recording_path)
 
         # if a file was written, remux it into an mp4 file to normalize video/audio stream order
         if self._recording_path is not None and os.path.exists(self._recording_path):
@@ -151,6 +186,8 @@ class VRCDNRecorder(RecorderBase):
 
         log.info(f"Start recording of VRCDN user {self._username}")
 
+        self._start_time = time.time()
+
         if self._current_title is None: # otherwise we are cloned -> reuse the old title so we can append the cloned suffix
             if "win" in sys.platform:
                 self._current_title = f"{metadata.startedAt.strftime('%Y-%m-%d_%H_%M_%S')}_{self._username}"
@@ -178,6 +215,12 @@ class VRCDNRecorder(RecorderBase):
     def stopRecording(self):
         self._stop_event.set()
 
+    def abort(self, error: Exception):
+        if self._encountered_error is None:
+            self._encountered_error = error
+
+        self.stopRecording()
+
     def finish(self):
         log.info(f"Finished recording of VRCDN user {self._username}")
         if (self._recording_path is not None or len(self._cloned_paths) > 0) and self._current_title is not None:
@@ -215,5 +258,8 @@ class VRCDNRecorder(RecorderBase):
                 runner = PluginRunner(self._plugins, "handle_recording_end", [ self._current_metadata, recording_path ], { "error": concat_error, "finish": True })
                 runner.run()
 
+                if self._storage_mover is not None and concat_error is None:
+                    self._storage_mover.enqueue(recording_path, self._current_metadata, self._plugins)
+
             concat_thread = Thread(target=concat_file_thread)
             concat_thread.start()
\ No newline at end of file
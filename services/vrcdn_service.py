@@ -5,7 +5,7 @@ import asyncio
 import random
 import aiohttp
 
-from lib.config import Config
+from lib.config import Config, SinkConfig
 from lib.stream_metadata import StreamMetadata
 from plugins.plugin_base import Plugin
 from lib.service_base import ServiceBase
@@ -40,27 +40,41 @@ async def check_urls(urls: Dict[str, str], max_delay: float = 0):
 class VRCDNService(ServiceBase[VRCDNRecorder]):
     _online_users: set[str]
     _output_path: Optional[str]
+    _stream_url: str
+    _sinks: list[SinkConfig]
 
     def __init__(self):
         super().__init__()
 
         self._online_users = set()
         self._output_path = None
+        self._stream_url = ""
+        self._sinks = []
         self._update_interval = 0
+        self._read_timeout = 10.0
 
     def init(self, config: Config):
-        self._output_path = config.output_path
+        self._output_path = config.get_recording_path()
+        self._stream_url = config.vrcdn.stream_url
+        self._sinks = config.sinks
         self._update_interval = config.update_interval
 
+        # a read never blocks for longer than the stall timeout, so the recorder notices an abort by the watchdog in time
+        if config.stall_timeout > 0:
+            self._read_timeout = min(self._read_timeout, config.stall_timeout)
+
         return True
     
     def is_user_live(self, username: str) -> bool:
         return username in self._online_users
+
+    def get_live_users(self) -> set[str]:
+        return self._online_users
     
     def update_streams(self, usernames: Iterable[str]):
         self._online_users = set()
 
-        urls = { username: f"https://stream.vrcdn.live/live/{username}.live.ts" for username in usernames }
+        urls = { username: self._stream_url.format(username=username) for username in usernames }
 
         users_live = asyncio.run(check_urls(urls, self._update_interval))
 
@@ -75,7 +89,7 @@ class VRCDNService(ServiceBase[VRCDNRecorder]):
         if self._output_path is None:
             raise Exception("The service has not been initialized yet")
 
-        return VRCDNRecorder(username, self._output_path, plugins)
+        return VRCDNRecorder(username, self._stream_url, self._output_path, plugins, self._sinks, self.storage_mover, self._read_timeout)
     
     def start_recorder(self, username: str, recorder: VRCDNRecorder):
         metadata = StreamMetadata(